@@ -30,7 +30,7 @@ class ApplicationContext:
         self.menu_index = 0
         self.save_decision = ["Yes", "No"]
         self.save_index = 0
-        self.login_index = 0
+        self.login_alias = None  # alias shown by LoginState
 
         # Set the initial state
         self.current_state = INITIAL_STATE(self)
@@ -44,6 +44,7 @@ class ApplicationContext:
     def update(self):
         self.encoder.update()
         self.current_state.handle()
+        self.authenticator.tick()
     
     def initialize_fingerprint(self, pin: str):
         if self.fingerprint is None:
@@ -0,0 +1,230 @@
+"""
+Offloads SHA-256, AES blocks and random numbers to an ATECC608.
+
+The driver methods in lib/adafruit_atecc wake the chip before and idle it
+after every single command. AteccTransport sends the same command
+packets but leaves the chip awake, and AteccBackend.batch() groups
+commands so one wake pays for all of them. The chip's watchdog puts it to
+sleep 1.3 s after a wake, so a long batch is cut into windows that fit.
+Idle mode keeps the SHA context, so a hash may span several windows.
+
+Nothing here is imported at boot; crypto_backend.offload() builds the
+backend when PLUTO_CRYPTO_OFFLOAD = "atecc" is set and a chip answers.
+The transport only needs two I2CDevice-like objects, so tools/atecc_sim.py
+can stand in for the chip on a host.
+"""
+import time
+
+OP_RANDOM = 0x1B
+OP_SHA = 0x47
+OP_AES = 0x51
+
+SHA_START = 0x00
+SHA_UPDATE = 0x01
+SHA_END = 0x02
+AES_ENCRYPT = 0x00
+AES_DECRYPT = 0x01
+
+# Maximum execution times in ms, as in the driver
+EXEC_MS = {OP_RANDOM: 23, OP_SHA: 47, OP_AES: 50}
+WATCHDOG_MS = 1000  # stay clear of the 1.3 s watchdog
+WAKE_MS = 1.5  # tWHI, wake to first command
+RETRIES = 20
+
+SHA_BLOCK = 64
+AES_BLOCK = 16
+RANDOM_BYTES = 32  # per OP_RANDOM
+# RANDOM output of a chip whose config zone is not locked
+UNLOCKED_RANDOM = b"\xff\xff\x00\x00" * 8
+
+def _crc16(data) -> int:
+    """CRC-16 (poly 0x8005, bits fed LSB first) used by ATECC packets."""
+    crc = 0
+    for b in data:
+        for shift in range(8):
+            if ((b >> shift) & 1) != ((crc >> 15) & 1):
+                crc = ((crc << 1) ^ 0x8005) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
+class AteccTransport:
+    """
+    Raw command packets over I2C. `device` is the chip's I2CDevice and
+    `wake_device` one at address 0 whose NACKed write makes the wake pulse.
+    """
+    def __init__(self, device, wake_device, sleep=time.sleep, monotonic=time.monotonic):
+        self._device = device
+        self._wake_device = wake_device
+        self._sleep = sleep
+        self._monotonic = monotonic
+        self._awake_since = None
+        self.wakes = 0
+        self.commands = 0
+
+    @classmethod
+    def for_chip(cls, chip):
+        """Share the I2C devices of an adafruit_atecc.ATECC driver."""
+        return cls(chip._i2c_device, chip._wake_device)
+
+    @property
+    def awake(self) -> bool:
+        return self._awake_since is not None
+
+    def wake(self) -> None:
+        try:
+            with self._wake_device as i2c:
+                i2c.write(b"\x00")
+        except OSError:
+            pass  # the NACK is the point
+        self._sleep(WAKE_MS / 1000)
+        self._awake_since = self._monotonic()
+        self.wakes += 1
+
+    def idle(self) -> None:
+        self._word(0x02)
+
+    def sleep(self) -> None:
+        self._word(0x01)
+
+    def _word(self, address: int) -> None:
+        if self._awake_since is None:
+            return
+        with self._device as i2c:
+            i2c.write(bytes((address,)))
+        self._awake_since = None
+
+    def execute(self, opcode: int, param1: int, param2: int = 0, data=b"", response: int = 1) -> bytearray:
+        """Run one command, waking the chip if needed; returns its response data."""
+        exec_ms = EXEC_MS[opcode]
+        if (self._awake_since is not None
+                and (self._monotonic() - self._awake_since) * 1000 + exec_ms > WATCHDOG_MS):
+            self.idle()
+        if self._awake_since is None:
+            self.wake()
+
+        packet = bytearray(8 + len(data))
+        packet[0] = 0x03  # word address: command
+        packet[1] = len(packet) - 1
+        packet[2] = opcode
+        packet[3] = param1
+        packet[4] = param2 & 0xFF
+        packet[5] = param2 >> 8
+        packet[6:6 + len(data)] = data
+        crc = _crc16(memoryview(packet)[1:-2])
+        packet[-2] = crc & 0xFF
+        packet[-1] = crc >> 8
+        with self._device as i2c:
+            i2c.write(packet)
+        self.commands += 1
+        self._sleep(exec_ms / 1000)
+
+        reply = bytearray(response + 3)  # count, data, CRC
+        for _ in range(RETRIES):
+            try:
+                with self._device as i2c:
+                    i2c.readinto(reply)
+                break
+            except OSError:
+                self._sleep(0.002)
+        else:
+            raise RuntimeError("ATECC did not answer")
+
+        count = reply[0]
+        if not 4 <= count <= len(reply):
+            raise RuntimeError("ATECC reply has a bad length")
+        crc = _crc16(memoryview(reply)[:count - 2])
+        if reply[count - 2] != crc & 0xFF or reply[count - 1] != crc >> 8:
+            raise RuntimeError("ATECC reply CRC mismatch")
+        if count != len(reply) or (response == 1 and reply[1]):
+            raise RuntimeError(f"ATECC error 0x{reply[1]:02x} for opcode 0x{opcode:02x}")
+        return reply[1:count - 2]
+
+class _Batch:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def __enter__(self):
+        self._backend._depth += 1
+        return self._backend
+
+    def __exit__(self, *exc):
+        backend = self._backend
+        backend._depth -= 1
+        if not backend._depth:
+            backend.transport.idle()
+        return False
+
+class AteccSha256:
+    """
+    hashlib-style SHA-256 object computed by the chip. Input is kept
+    until digest(), which runs start/update/end in one batch; the chip has
+    a single SHA context, so hashes never interleave on it. Meant for the
+    short inputs of hash_pin and HKDF, and copy() is cheap.
+    """
+    digest_size = 32
+    block_size = SHA_BLOCK
+
+    def __init__(self, backend, data=b""):
+        self._backend = backend
+        self._data = bytearray(data)
+
+    def update(self, data) -> None:
+        self._data.extend(data)
+
+    def copy(self):
+        return AteccSha256(self._backend, self._data)
+
+    def digest(self) -> bytes:
+        return self._backend.sha256_digest(self._data)
+
+class AteccBackend:
+    """
+    One ATECC608 as a crypto backend. Every public call is a batch on its
+    own; wrap several in `with backend.batch():` to share one wake.
+    """
+    def __init__(self, transport: AteccTransport, aes_slot=None):
+        self.transport = transport
+        self.aes_slot = aes_slot  # key slot for aes_ecb(), None if not provisioned
+        self._depth = 0
+
+    def batch(self) -> _Batch:
+        return _Batch(self)
+
+    def sha256(self, data=b"") -> AteccSha256:
+        return AteccSha256(self, data)
+
+    def sha256_digest(self, data) -> bytes:
+        data = memoryview(data)
+        full = len(data) - len(data) % SHA_BLOCK
+        with self.batch():
+            self.transport.execute(OP_SHA, SHA_START)
+            for i in range(0, full, SHA_BLOCK):
+                self.transport.execute(OP_SHA, SHA_UPDATE, SHA_BLOCK, data[i:i + SHA_BLOCK])
+            tail = data[full:]
+            return bytes(self.transport.execute(OP_SHA, SHA_END, len(tail), tail, response=32))
+
+    def random_bytes(self, count: int) -> bytearray:
+        out = bytearray()
+        with self.batch():
+            while len(out) < count:
+                block = self.transport.execute(OP_RANDOM, 0x00, 0, response=RANDOM_BYTES)
+                if block == UNLOCKED_RANDOM:
+                    raise RuntimeError("ATECC config zone is unlocked, its RNG is disabled")
+                out.extend(block)
+        return out[:count]
+
+    def aes_ecb(self, data, decrypt: bool = False) -> bytearray:
+        """Encrypt or decrypt whole 16-byte blocks with the key in aes_slot."""
+        if self.aes_slot is None:
+            raise RuntimeError("No AES key slot configured")
+        if len(data) % AES_BLOCK:
+            raise ValueError("Data must be whole AES blocks")
+        data = memoryview(data)
+        out = bytearray(len(data))
+        mode = AES_DECRYPT if decrypt else AES_ENCRYPT
+        with self.batch():
+            for i in range(0, len(data), AES_BLOCK):
+                out[i:i + AES_BLOCK] = self.transport.execute(
+                    OP_AES, mode, self.aes_slot << 8, data[i:i + AES_BLOCK], response=AES_BLOCK)
+        return out
@@ -2,15 +2,17 @@ import binascii
 import json
 import os
 import time
-from key_store import KeyStore
-from nvm_storage import save_slot, load_slot, nvm_wipe
-from crypto_utils import generate_salt, hash_pin, derive_key
+from key_store import KeyStore, vault_files
+from flash_store import FlashKeyStore
+from nvm_storage import save_slot, load_slot, load_slot_record, nvm_wipe
+from crypto_utils import (generate_salt, hash_pin, derive_key, stretch_pin, calibrate_pin_iterations,
+                          PIN_TARGET_MS)
 
 
 KEYS_FILE = "sd/keys.db"
 SYS_PARAM_FILE = "sd/systemparam_finger.db"
 
-THE_FILES = [KEYS_FILE, SYS_PARAM_FILE]
+THE_FILES = [SYS_PARAM_FILE]  # plus every vault file, see vault_files()
 
 SLOT_SIZE = 128
 
@@ -21,15 +23,21 @@ BACKUP_KEY_SLOT = 2
 DEBUG = True
 LIFETIME = 30  # seconds
 
+# settings.toml: PLUTO_VAULT_BACKEND = "flash" keeps the vault index on flash
+# for collections larger than RAM; anything else uses the in-RAM KeyStore.
+VAULT_BACKENDS = {"ram": KeyStore, "flash": FlashKeyStore}
+
 class AuthManager:
     def __init__(self):
         self.fingerprint = None
         self._authenticated = False
         self._f_authenticated = False
         self._vault = None
+        self._locked_vault = None  # kept across sessions, see authenticate()
         self._master_key = None
         self._session_expiry = None
         self._session_lifetime = LIFETIME
+        self.pin_check_ms = None  # duration of the last verify_pin()
     
     def attach_fingerprint(self, fingerprint):
         self.fingerprint = fingerprint
@@ -52,8 +60,8 @@ class AuthManager:
         except:
             return None, None
 
-    def _set_slot(self, slot_index: int, salt: bytes, hsh: bytes):
-        save_slot(slot_index, SLOT_SIZE, salt, hsh)
+    def _set_slot(self, slot_index: int, salt: bytes, hsh: bytes, iterations: int = 0):
+        save_slot(slot_index, SLOT_SIZE, salt, hsh, iterations)
         if DEBUG: print(f"Slot {slot_index} updated.")
 
     def _get_slot(self, slot_index: int):
@@ -64,15 +72,19 @@ class AuthManager:
         """Sets a new PIN for the fingerprint sensor and stores its hash."""
         # if self._get_slot(PIN_SLOT) and not self.authenticate: #TODO
         #     raise ValueError("Please verify before setting a new one.")
-        pin_bytes = pin_str.encode("utf-8")
-        salt = generate_salt()
-        pin_hash = hash_pin(pin_bytes, salt)
-        self._set_slot(PIN_SLOT, salt, pin_hash)
+        pin_hash = self._store_pin(pin_str.encode("utf-8"), calibrate_pin_iterations())
         self.fingerprint.set_pin(pin_str)
         print("🔑 PIN set successfully.")
         self.fingerprint.initialize()
         return pin_hash
     
+    def _store_pin(self, pin_bytes: bytes, iterations: int) -> bytes:
+        salt = generate_salt()
+        pin_hash = stretch_pin(pin_bytes, salt, iterations)
+        self._set_slot(PIN_SLOT, salt, pin_hash, iterations)
+        if DEBUG: print(f"🔑 PIN stretched with {iterations} iterations.")
+        return pin_hash
+
     @property
     def authenticated(self):
         return self._authenticated
@@ -82,13 +94,33 @@ class AuthManager:
         return self._f_authenticated
     
     def verify_pin(self, pin_str: str) -> bool:
+        """
+        Check pin_str against the PIN slot. The time the check took is left
+        in pin_check_ms. A correct PIN stored as a plain hash, or stretched
+        for less than half of PIN_TARGET_MS, is re-stretched for the target;
+        the new count is scaled from the time this check took.
+        """
         self._reset_authentication()
         try:
             pin_bytes = pin_str.encode("utf-8")
-            salt, stored_hash = self._get_slot(PIN_SLOT)
-
-            if hash_pin(pin_bytes, salt) == stored_hash:
+            salt, stored_hash, iterations = load_slot_record(PIN_SLOT, SLOT_SIZE)
+
+            start = time.monotonic_ns()
+            if iterations:
+                pin_hash = stretch_pin(pin_bytes, salt, iterations)
+            else:
+                pin_hash = hash_pin(pin_bytes, salt)  # slot from before stretching
+            elapsed_ns = max(time.monotonic_ns() - start, 1)
+            self.pin_check_ms = elapsed_ns // 1_000_000
+            print(f"⏱️ PIN check took {self.pin_check_ms} ms ({iterations} iterations)")
+
+            if pin_hash == stored_hash:
                 self._authenticated = True
+                if not iterations:
+                    self._store_pin(pin_bytes, calibrate_pin_iterations())
+                elif self.pin_check_ms < PIN_TARGET_MS // 2:
+                    # Scale the count the check just ran at up to the target.
+                    self._store_pin(pin_bytes, iterations * PIN_TARGET_MS * 1_000_000 // elapsed_ns)
             return self._authenticated
         
         except Exception as e:
@@ -99,11 +131,20 @@ class AuthManager:
         self._authenticated = False
     
     def _reset_f_authentication(self):
+        flushed = self.flush_vault() is True
         self._f_authenticated = False
         if self._master_key:
             # Overwrite and delete from memory
             self._master_key = bytearray(os.urandom(len(self._master_key)))
         self._master_key = None
+        if not flushed:
+            # Keep the unsaved changes instead of dropping them: tick()
+            # retries the flush and the next session takes the vault back.
+            print("⚠️ Vault kept in RAM until its changes reach flash.")
+            return
+        if self._vault is not None and not self._vault.dirty:
+            self._vault.lock()
+            self._locked_vault = self._vault
         self._vault = None
 
     def is_registered(self, slot: int = PIN_SLOT) -> bool:
@@ -181,7 +222,15 @@ class AuthManager:
 
         # Store decrypted vault
         self._master_key = master_key
-        self._vault = KeyStore(self._master_key)
+        vault, self._locked_vault = self._locked_vault, None
+        if self._vault is not None and bytes(self._vault.master_key) == bytes(master_key):
+            if DEBUG: print("♻️ Reusing the vault kept with unsaved changes.")
+        elif vault is not None and vault.unlock(self._master_key):
+            if DEBUG: print("♻️ Vault unchanged on flash, reusing loaded index.")
+            self._vault = vault
+        else:
+            backend = VAULT_BACKENDS.get(os.getenv("PLUTO_VAULT_BACKEND") or "ram", KeyStore)
+            self._vault = backend(self._master_key)
 
         # Mark session as active
         self._f_authenticated = True
@@ -207,7 +256,28 @@ class AuthManager:
         """Check if fingerprint session is still valid (not expired)."""
         if not self._f_authenticated or self._session_expiry is None:
             return False
-        return time.monotonic() < self._session_expiry
+        if time.monotonic() < self._session_expiry:
+            return True
+        self.flush_vault()  # session over: nothing may stay in RAM only
+        return False
+
+    def flush_vault(self):
+        """Write any deferred vault changes to flash. Returns True or the error."""
+        if self._vault is None or not self._vault.dirty:
+            return True
+        result = self._vault.flush()
+        if result is not True:
+            print("❌ Failed to flush vault:", result)
+        return result
+
+    def tick(self):
+        """Main-loop hook: lets the vault flush once it has been idle."""
+        if self._vault is not None and self._vault.dirty:
+            result = self._vault.flush_if_due()
+            if result is not True:
+                print("❌ Failed to flush vault:", result)
+        if self._vault is not None and not self._f_authenticated and not self._vault.dirty:
+            self._reset_f_authentication()  # the kept vault is on flash now: lock it
 
     def ensure_authenticated(self) -> bool:
         """Use cached session if still valid; otherwise, require fingerprint again."""
@@ -246,11 +316,13 @@ class AuthManager:
         return False
     
     def factory_reset(self):
+        self.flush_vault()
         if not self.authenticate():
             print("❌ Authentication failed. Factory reset aborted.")
             return False
 
-        failed_files = [f for f in THE_FILES if not self._try_delete(f)]
+        self._locked_vault = None
+        failed_files = [f for f in vault_files() + THE_FILES if not self._try_delete(f)]
 
         if failed_files and not nvm_wipe():
             print(f"❌ Could not delete: {', '.join(failed_files)}.")
@@ -1,12 +1,17 @@
 import json
+import crypto_backend
 from crypto_utils import encrypt_aes_bytes, decrypt_aes_bytes
 import time
-from utils import csv_reader, generate_password
+from utils import csv_reader, generate_password, generate_passwords, MAX_PASSWORD_LENGTH
+from wordlist import generate_passphrases
 from backup_handler import handle_backup_command, BackupCommandError
+from key_store import AmbiguousSite, split_account_key
 
 
 DELAY = 0.0
 DEBUG_MODE = True
+FIND_LIMIT = 20  # matches returned by `find`
+BATCH_MAX = 64  # passwords per `passwd --batch`
 SESSION_KEY  = bytes.fromhex("f3d1c97a8b4e234c2d10ab51f9c76aee")  # 128-bit key
 
 class CommandProcessor:
@@ -18,6 +23,7 @@ class CommandProcessor:
         self.vault = None
         self.password = None
         self.same_used = False
+        self._showkeys_cache = (None, -1, "")  # (vault, generation, reply)
 
     def _log_usb_error(self, where: str, exc: Exception) -> None:
         """Write a succinct error message to the USB port."""
@@ -45,6 +51,66 @@ class CommandProcessor:
             self._log_usb_error("secure_read", exc)
             return None
 
+    @staticmethod
+    def _describe(alias: str, key: str) -> str:
+        url, username = split_account_key(key)
+        return f"{alias}: {username} @ {url}" if username else f"{alias}: {url}"
+
+    def _candidates_reply(self, error: AmbiguousSite) -> str:
+        lines = "".join(f"  {self._describe(alias, key)}\n" for alias, key in error.candidates)
+        return f"⚠️ {error}, add user=<username> or use one of:\n{lines}"
+
+    @staticmethod
+    def _split_user(argument: str):
+        """Split 'github.com user=alice' into ("github.com", "alice"); None without user=."""
+        site, sep, username = argument.partition(" user=")
+        return site.strip(), (username.strip() if sep else None)
+
+    @staticmethod
+    def _password_params(options: str) -> dict:
+        """Parse 'len=12,lvl=2' into {"len": 12, "lvl": 2}; 'words=6' asks for a passphrase."""
+        params = {}
+        for opt in options.strip().split(","):
+            k, v = opt.split("=")
+            k = k.strip().lower()
+            if k not in ("len", "lvl", "words"):
+                raise ValueError(f"Unknown parameter: '{k}'")
+            params[k] = int(v.strip())
+        return params
+
+    def _passwd_batch(self, options: str) -> None:
+        """passwd --batch N [len=..,lvl=..|words=..] [--store <site>[ user=<name>];...]"""
+        spec, storing, store = options.partition("--store")
+        parts = spec.split(None, 1)
+        if not parts or not parts[0].isdigit():
+            raise ValueError("Usage: passwd --batch N [len=..,lvl=..|words=..] [--store site1 user=bob;site2;...]")
+        count = int(parts[0])
+        if not 0 < count <= BATCH_MAX:
+            raise ValueError(f"Batch size must be 1..{BATCH_MAX}")
+        params = self._password_params(parts[1]) if len(parts) > 1 else {}
+        if not 0 < params.get("len", 12) <= MAX_PASSWORD_LENGTH:
+            raise ValueError(f"Password length must be 1..{MAX_PASSWORD_LENGTH}")
+        targets = [self._split_user(item) for item in store.split(";") if item.strip()]
+        if storing and not targets:
+            raise ValueError("--store needs at least one site")
+        if storing and len(targets) != count:
+            raise ValueError(f"{count} passwords for {len(targets)} sites")
+
+        if "words" in params:
+            passwords = generate_passphrases(count, params["words"])
+        else:
+            passwords = generate_passwords(count, params.get("len", 12), params.get("lvl", 2))
+        if targets:
+            vault = self.authenticator.get_vault()
+            with vault.transaction():  # all stored or none
+                for (site, username), password in zip(targets, passwords):
+                    if not vault.set_password(site, password, username):
+                        raise ValueError(f"Domain not found: {site}")
+            lines = [f"{site}: {password}" for (site, _), password in zip(targets, passwords)]
+        else:
+            lines = passwords
+        self.secure_write("\n".join(lines) + "\n")
+
     def execute(self, command):
         command = self.secure_read(command)
         print(f"Executing command: '{command}'")
@@ -107,11 +173,11 @@ class CommandProcessor:
                 self.secure_write(f"❌ encrypt_save failed: {e}\n")
 
         elif command.startswith("type "):
-            _, domain = command.split(" ", 1)
-            domain = domain.strip()
+            """type <domain> [user=<username>]"""
+            domain, username = self._split_user(command[5:])
             try:
                 vault = self.authenticator.get_vault()
-                creds = vault.get(domain)
+                creds = vault.get(domain, username)
                 if not creds:
                     self.secure_write("⚠️ Domain not found\n")
                     return
@@ -122,6 +188,8 @@ class CommandProcessor:
                     self.hid.key_strokes("TAB")
                 self.hid.type_text(creds["password"], delay=DELAY)
                 self.hid.key_strokes("ENTER")
+            except AmbiguousSite as e:
+                self.secure_write(self._candidates_reply(e))
             except Exception as e:
                 self.secure_write(f"❌ Error retrieving credentials: {e}\n")
                 print(f"Error: {e}")
@@ -161,51 +229,96 @@ class CommandProcessor:
                 self.secure_write(f"❌ Failed to add credentials: {e}\n")
         
         elif command.startswith("get "):
-            _, domain = command.split(" ", 1)
-            domain = domain.strip()
+            """get <domain> [user=<username>]"""
+            domain, username = self._split_user(command[4:])
             try:
                 vault = self.authenticator.get_vault()
-                creds = vault.get(domain)
+                creds = vault.get(domain, username)
                 if not creds:
                     self.secure_write(f"⚠️ Domain not found: {domain}\n")
                     return
                 self.secure_write(f"{domain}: {creds}\n")
+            except AmbiguousSite as e:
+                self.secure_write(self._candidates_reply(e))
             except Exception as e:
                 self.secure_write(f"❌ Error: retrieving credentials: {e}\n")
         
         elif command.startswith("showkeys"):
             try:
                 vault = self.authenticator.get_vault()
-                self.secure_write(f"{vault.get_aliases()}\n")
+                cached_vault, generation, reply = self._showkeys_cache
+                if cached_vault is not vault or generation != vault.generation:
+                    reply = f"{list(vault.get_aliases())}\n"
+                    self._showkeys_cache = (vault, vault.generation, reply)
+                self.secure_write(reply)
             except Exception as e:
                 self.secure_write(f"❌ Error: retrieving credentials: {e}\n")
 
+        elif command == "sync":
+            try:
+                vault = self.authenticator.get_vault()
+                result = vault.flush()
+                if result is not True:
+                    raise result
+                self.secure_write("✅ Vault synced\n")
+            except Exception as e:
+                self.secure_write(f"❌ Sync failed: {e}\n")
+
+        elif command == "status":
+            try:
+                vault = self.authenticator.get_vault()
+                self.secure_write(f"{vault.status()}\n")
+            except Exception as e:
+                self.secure_write(f"❌ Error: retrieving status: {e}\n")
+
+        elif command == "crypto bench":
+            try:
+                self.secure_write(f"{crypto_backend.backends()}\n{crypto_backend.bench()}\n")
+            except Exception as e:
+                self.secure_write(f"❌ Crypto bench failed: {e}\n")
+
+        elif command.startswith("find "):
+            prefix = command[5:].strip()
+            try:
+                vault = self.authenticator.get_vault()
+                matches = vault.find(prefix, limit=FIND_LIMIT)
+                if not matches:
+                    self.secure_write(f"⚠️ No match for: {prefix}\n")
+                    return
+                self.secure_write("".join(f"{self._describe(alias, key)}\n" for alias, key in matches))
+            except Exception as e:
+                self.secure_write(f"❌ Error: searching credentials: {e}\n")
+
         elif command.startswith("delete "):
-            _, domain = command.split(" ", 1)
-            domain = domain.strip()
+            """delete <domain> [user=<username>]"""
+            domain, username = self._split_user(command[7:])
 
             try:
                 vault = self.authenticator.get_vault()
-                if vault.delete(domain):
+                if vault.delete(domain, username):
                     self.secure_write(f"✅ Deleted credentials for {domain}\n")
                 else:
                     self.secure_write("⚠️ Domain not found\n")
+            except AmbiguousSite as e:
+                self.secure_write(self._candidates_reply(e))
             except Exception as e:
                 self.secure_write(f"❌ Failed to delete credentials: {e}\n")
 
         elif command.startswith("update "):
-            """update example.com[username:alice_wonder,password:newP@ss,note:2FA enabled]"""
+            """update example.com [user=alice][username:alice_wonder,password:newP@ss,note:2FA enabled]"""
             try:
                 domain, rest = command[7:].split("[", 1)
-                domain = domain.strip()
+                domain, username = self._split_user(domain)
                 updates = rest.strip("[] ")
 
                 vault = self.authenticator.get_vault()
                 
-                if not vault.update(domain, updates):
+                if not vault.update(domain, updates, username):
                     self.secure_write("⚠️ Failed to update credentials\n")
                     return
                 self.secure_write(f"Modified credentials for {domain}\n")
+            except AmbiguousSite as e:
+                self.secure_write(self._candidates_reply(e))
             except Exception as e:
                 self.secure_write(f"Failed to modify credentials: {e}\n")
         
@@ -233,11 +346,13 @@ class CommandProcessor:
                 self.secure_write(f"❌ Bulk-add failed: {exc}\n")
 
         elif command == "passwd" or command.startswith("passwd"):
-            """passwd len=12,lvl=2 or passwd --same"""
+            """passwd len=12,lvl=2, passwd words=6, passwd --same or passwd --batch N ..."""
             try:
                 _, options = command.split(" ", 1)
 
-                if options.strip() == "--same":
+                if options.strip().startswith("--batch"):
+                    self._passwd_batch(options.strip()[7:])
+                elif options.strip() == "--same":
                     if not self.password:
                         raise ValueError("No passwd available")
                     if self.same_used:
@@ -247,22 +362,21 @@ class CommandProcessor:
                     self.secure_write(f"Typed\n")
                     self.same_used = True
                 else:
-                    params = {}
-                    for opt in options.strip().split(","):
-                        k, v = opt.split("=")
-                        k = k.strip().lower()
-                        if k not in ("len", "lvl"):
-                            raise ValueError(f"Unknown parameter: '{k}'")
-                        params[k] = int(v.strip())
-
-                    self.password = generate_password(
-                        length=params.get("len", 12),
-                        level=params.get("lvl", 2)
-                    )
+                    params = self._password_params(options)
+
+                    if "words" in params:
+                        self.password = generate_passphrases(1, params["words"])[0]
+                    else:
+                        self.password = generate_password(
+                            length=params.get("len", 12),
+                            level=params.get("lvl", 2)
+                        )
                     self.same_used = False
                     self.hid.type_text(self.password, delay=DELAY)
                     self.secure_write(f"Typed\n")
 
+            except AmbiguousSite as e:
+                self.secure_write(self._candidates_reply(e))
             except Exception as e:
                 self.secure_write(f"❌ Password generation failed: {e}\n")
 
@@ -0,0 +1,177 @@
+"""
+One place that decides which implementation backs each crypto primitive.
+
+SHA-256 comes from the firmware's C `hashlib` when the build has one and
+from the pure-Python adafruit_hashlib otherwise; AES always comes from
+`aesio`. Both are probed at import time. The ATECC608 co-processor shares
+the I2C bus with the display, so it is only probed by atecc(), on first
+use, and never at import.
+
+With PLUTO_CRYPTO_OFFLOAD = "atecc" in settings.toml, hash_pin and HKDF
+hash on the chip through atecc_backend (kdf_sha256()); bulk hashing and
+AES stay in software, which is far faster. offload() is None otherwise,
+or when no chip answers, and set_offload() injects a backend directly.
+
+crypto_utils builds on sha256() and hmac_sha256() from here; `crypto
+bench` on the serial console prints bench().
+"""
+import os
+import time
+import aesio
+import adafruit_hashlib
+
+HMAC_BLOCK = 64  # SHA-256 block size
+BENCH_BYTES = 4096
+
+try:
+    import hashlib as _native_hashlib
+    _native_hashlib.new("sha256", b"")
+except (ImportError, AttributeError, ValueError):
+    _native_hashlib = None
+
+def _native_sha256(data=b""):
+    return _native_hashlib.new("sha256", data)
+
+SHA256_BACKENDS = {"adafruit_hashlib": adafruit_hashlib.sha256}
+if _native_hashlib is not None:
+    SHA256_BACKENDS["hashlib"] = _native_sha256
+SHA256_BACKEND = "hashlib" if _native_hashlib is not None else "adafruit_hashlib"
+sha256 = SHA256_BACKENDS[SHA256_BACKEND]
+AES_BACKEND = "aesio"
+
+_atecc = None
+_atecc_probed = False
+_offload = None
+_offload_probed = False
+
+class HMACSHA256:
+    """
+    HMAC-SHA256 over whichever sha256() was picked.
+
+    copy() clones the pad states when the hash objects support copy(), as
+    adafruit_hashlib does. The C hashlib of CircuitPython does not, so a
+    copy is then rebuilt from the stored pads: two compressions in C,
+    which only works before anything has been fed in. That is the only
+    way crypto_utils copies (keyed templates for HKDF and the sealed
+    container).
+    """
+    digest_size = 32
+    block_size = HMAC_BLOCK
+
+    def __init__(self, key, msg=None, hash_cons=None):
+        self._cons = hash_cons or sha256
+        if len(key) > HMAC_BLOCK:
+            key = self._cons(key).digest()
+        key = bytes(key) + bytes(HMAC_BLOCK - len(key))
+        self._ipad = bytes(b ^ 0x36 for b in key)
+        self._opad = bytes(b ^ 0x5C for b in key)
+        self.inner = self._cons(self._ipad)
+        self.outer = self._cons(self._opad)
+        self._fed = False
+        if msg is not None:
+            self.update(msg)
+
+    def update(self, msg) -> None:
+        self._fed = True
+        self.inner.update(msg)
+
+    def copy(self):
+        other = self.__class__.__new__(self.__class__)
+        other._cons, other._ipad, other._opad, other._fed = self._cons, self._ipad, self._opad, self._fed
+        if hasattr(self.inner, "copy"):
+            other.inner, other.outer = self.inner.copy(), self.outer.copy()
+        elif self._fed:
+            raise ValueError("hash backend cannot copy a started HMAC")
+        else:
+            other.inner, other.outer = self._cons(self._ipad), self._cons(self._opad)
+        return other
+
+    def digest(self) -> bytes:
+        outer = self.outer.copy() if hasattr(self.outer, "copy") else self._cons(self._opad)
+        outer.update(self.inner.digest())
+        return outer.digest()
+
+def hmac_sha256(key, msg=None, hash_cons=None) -> HMACSHA256:
+    return HMACSHA256(key, msg, hash_cons)
+
+def atecc(i2c=None):
+    """
+    Return the ATECC608 driver, or None when no chip answers. The bus is
+    board.I2C(), the same singleton the display uses, unless one is given.
+    Probed once; later calls return the cached result.
+    """
+    global _atecc, _atecc_probed
+    if not _atecc_probed:
+        _atecc_probed = True
+        try:
+            import board
+            from adafruit_atecc.adafruit_atecc import ATECC
+            _atecc = ATECC(i2c or board.I2C())
+        except Exception as e:  # no chip, no driver or no bus on this board
+            print("ℹ️ No ATECC608 found:", e)
+            _atecc = None
+    return _atecc
+
+def offload():
+    """The AteccBackend hash_pin and HKDF run on, or None for software."""
+    global _offload, _offload_probed
+    if not _offload_probed:
+        _offload_probed = True
+        if os.getenv("PLUTO_CRYPTO_OFFLOAD") == "atecc" and atecc() is not None:
+            from atecc_backend import AteccBackend, AteccTransport
+            _offload = AteccBackend(AteccTransport.for_chip(_atecc))
+    return _offload
+
+def set_offload(backend) -> None:
+    """Use backend (an AteccBackend, or None for software) from now on."""
+    global _offload, _offload_probed
+    _offload, _offload_probed = backend, True
+
+def kdf_sha256():
+    """SHA-256 constructor for small key-derivation inputs."""
+    backend = offload()
+    return backend.sha256 if backend is not None else sha256
+
+def backends() -> dict:
+    chip = atecc()
+    return {
+        "sha256": SHA256_BACKEND,
+        "aes": AES_BACKEND,
+        "atecc": chip is not None,
+        "kdf": "atecc" if offload() is not None else SHA256_BACKEND,
+    }
+
+def _time(func, nbytes: int) -> str:
+    start = time.monotonic_ns()
+    func()
+    seconds = max(time.monotonic_ns() - start, 1) / 1e9
+    return f"{nbytes / 1024 / seconds:.1f} KiB/s"
+
+def bench(nbytes: int = BENCH_BYTES) -> str:
+    """Time every available backend on nbytes of data; one line each."""
+    data = os.urandom(nbytes)
+    lines = []
+    for name, cons in SHA256_BACKENDS.items():
+        mark = "*" if name == SHA256_BACKEND else " "
+        lines.append(f"{mark} sha256 {name}: {_time(lambda: cons(data).digest(), nbytes)}")
+        lines.append(f"{mark} hmac   {name}: {_time(lambda: HMACSHA256(b'k' * 32, data, cons).digest(), nbytes)}")
+
+    cipher = aesio.AES(bytes(16), aesio.MODE_CBC, IV=bytes(16))
+    out = bytearray(nbytes)
+    lines.append(f"* aes    aesio: {_time(lambda: cipher.encrypt_into(data, out), nbytes)}")
+
+    chip = atecc()
+    if chip is None:
+        lines.append("  atecc: not present")
+    else:
+        def chip_sha():
+            chip.sha_start()
+            for i in range(0, 256, 64):
+                chip.sha_update(data[i:i + 64])
+            chip.sha_digest()
+        lines.append(f"  sha256 atecc driver: {_time(chip_sha, 256)}")
+    backend = offload()
+    if backend is not None:
+        lines.append(f"* kdf    atecc batched: {_time(lambda: backend.sha256_digest(data[:256]), 256)}")
+        lines.append(f"  random atecc batched: {_time(lambda: backend.random_bytes(64), 64)}")
+    return "\n".join(lines)
@@ -1,12 +1,40 @@
 import aesio
 import os
+import time
 import binascii
-import adafruit_hashlib as hashlib
-import circuitpython_hmac as hmac
+from crypto_backend import sha256, hmac_sha256, kdf_sha256, offload
 import microcontroller
 
 BLOCK_SIZE = 16
 SALT_SIZE = 16
+PIN_TARGET_MS = 300  # stretch_pin() cost aimed for by calibrate_pin_iterations()
+PIN_PROBE_ITERATIONS = 32
+PIN_PROBE_MS = 50  # shortest timed probe in calibrate_pin_iterations()
+MIN_PIN_ITERATIONS = 64
+CHUNK_SIZE = 512  # streaming granularity, a multiple of BLOCK_SIZE
+CIPHER_CACHE = 4  # prepared cipher contexts kept, one per recently used key
+
+# Sealed (encrypt-then-MAC) layout, see SealEncryptor:
+#   header | check:8 | IV + AES-CBC(payload) | tag:32
+SEAL_MAGIC = b"PVS1"
+SEAL_VERSION = 1
+SEAL_HEADER = SEAL_MAGIC + bytes((SEAL_VERSION,))
+CHECK_SIZE = 8
+TAG_SIZE = 32
+SEAL_OVERHEAD = CHECK_SIZE + BLOCK_SIZE + TAG_SIZE  # plus the header and padding
+SEAL_INFO = b"pluto-seal"
+
+# key -> (padded key, aesio.AES). aesio has no way to set only the IV, so
+# a cached context is still rekeyed per message, but the key padding and
+# the object allocation are done once per key.
+_ciphers = {}
+# Work area shared by encrypt_aes_bytes/decrypt_aes_bytes, which return new
+# str objects and never hand out views into it. It grows for long messages
+# until clear_cipher_cache(); decrypt_aes_bytes zeroes the plaintext it
+# left there, and encrypt_aes_bytes leaves only ciphertext.
+_scratch = bytearray(256)
+# key -> (AES key, HMAC-SHA256 with its pads already absorbed)
+_seal_keys = {}
 
 def pad(data):
     """Apply PKCS#7 padding."""
@@ -20,69 +48,66 @@ def unpad(padded_data):
         raise ValueError("Invalid padding")
     return padded_data[:-pad_len]
 
-def encrypt_aes(plaintext, key_string):
-    key = key_string.encode("utf-8")
-    key = (key + b"\x00" * BLOCK_SIZE)[:BLOCK_SIZE]
+def _cipher(key, iv):
+    """Return the cached AES-CBC context for key, restarted at iv."""
+    key = bytes(key)
+    cached = _ciphers.get(key)
+    if cached is None:
+        if len(_ciphers) >= CIPHER_CACHE:
+            _ciphers.pop(next(iter(_ciphers)))
+        padded = (key + b"\x00" * BLOCK_SIZE)[:BLOCK_SIZE]  # Pad/truncate to 16 bytes
+        cached = (padded, aesio.AES(padded, aesio.MODE_CBC, IV=iv))
+        _ciphers[key] = cached
+    else:
+        cached[1].rekey(cached[0], IV=iv)
+    return cached[1]
 
-    iv = os.urandom(BLOCK_SIZE)
-    padded = pad(plaintext.encode("utf-8"))
-    encrypted = bytearray(len(padded))
+def clear_cipher_cache() -> None:
+    """Drop the prepared cipher contexts, the keys they hold and the work area."""
+    global _scratch
+    _ciphers.clear()
+    _seal_keys.clear()
+    _scratch[:] = bytes(len(_scratch))
+    _scratch = bytearray(256)
 
-    cipher = aesio.AES(key, aesio.MODE_CBC, IV=iv)
-    cipher.encrypt_into(padded, encrypted)
+def _scratch_view(size: int) -> memoryview:
+    global _scratch
+    if len(_scratch) < size:
+        _scratch = bytearray(size)
+    return memoryview(_scratch)[:size]
 
-    result = iv + encrypted
-    return binascii.b2a_base64(result).decode("utf-8").strip()
+def encrypt_aes(plaintext, key_string):
+    return encrypt_aes_bytes(plaintext, key_string.encode("utf-8"))
 
 def decrypt_aes(base64_input, key_string):
-    key = key_string.encode("utf-8")
-    key = (key + b"\x00" * BLOCK_SIZE)[:BLOCK_SIZE]
-
-    try:
-        encrypted_data = binascii.a2b_base64(base64_input)
-    except Exception:
-        return "[ERROR] Invalid base64"
-
-    if len(encrypted_data) < BLOCK_SIZE:
-        return "[ERROR] Data too short"
-
-    iv = encrypted_data[:BLOCK_SIZE]
-    ciphertext = encrypted_data[BLOCK_SIZE:]
-    decrypted = bytearray(len(ciphertext))
-
-    cipher = aesio.AES(key, aesio.MODE_CBC, IV=iv)
-    cipher.decrypt_into(ciphertext, decrypted)
-
-    try:
-        unpadded = unpad(decrypted)
-        return unpadded.decode("utf-8")
-    except Exception:
-        return "[ERROR] Invalid padding or decoding"
+    return decrypt_aes_bytes(base64_input, key_string.encode("utf-8"))
 
 def encrypt_aes_bytes(plaintext: str, key: bytes) -> str:
     """
     Encrypts the given plaintext using AES-CBC with the given binary key.
     Returns a base64-encoded string of IV + ciphertext.
     """
-    key = (key + b"\x00" * BLOCK_SIZE)[:BLOCK_SIZE]  # Pad/truncate to 16 bytes
+    data = plaintext.encode("utf-8")
+    pad_len = BLOCK_SIZE - (len(data) % BLOCK_SIZE)
+    end = BLOCK_SIZE + len(data) + pad_len
 
+    # IV | plaintext | padding, encrypted in place behind the IV.
+    buf = _scratch_view(end)
     iv = os.urandom(BLOCK_SIZE)
-    padded = pad(plaintext.encode("utf-8"))
-    encrypted = bytearray(len(padded))
-
-    cipher = aesio.AES(key, aesio.MODE_CBC, IV=iv)
-    cipher.encrypt_into(padded, encrypted)
+    buf[:BLOCK_SIZE] = iv
+    buf[BLOCK_SIZE:end - pad_len] = data
+    for i in range(end - pad_len, end):
+        buf[i] = pad_len
+    body = buf[BLOCK_SIZE:]
+    _cipher(key, iv).encrypt_into(body, body)
 
-    result = iv + encrypted
-    return binascii.b2a_base64(result).decode("utf-8").strip()
+    return binascii.b2a_base64(buf).decode("utf-8").strip()
 
 def decrypt_aes_bytes(base64_input: str, key: bytes) -> str:
     """
     Decrypts the base64 input string using AES-CBC and the given binary key.
     Returns the plaintext as a UTF-8 string.
     """
-    key = (key + b"\x00" * BLOCK_SIZE)[:BLOCK_SIZE]
-
     try:
         encrypted_data = binascii.a2b_base64(base64_input)
     except Exception:
@@ -91,45 +116,382 @@ def decrypt_aes_bytes(base64_input: str, key: bytes) -> str:
     if len(encrypted_data) < BLOCK_SIZE:
         return "[ERROR] Data too short"
 
-    iv = encrypted_data[:BLOCK_SIZE]
-    ciphertext = encrypted_data[BLOCK_SIZE:]
-    decrypted = bytearray(len(ciphertext))
-
-    cipher = aesio.AES(key, aesio.MODE_CBC, IV=iv)
-    cipher.decrypt_into(ciphertext, decrypted)
+    data = memoryview(encrypted_data)
+    decrypted = _scratch_view(len(data) - BLOCK_SIZE)
+    _cipher(key, encrypted_data[:BLOCK_SIZE]).decrypt_into(data[BLOCK_SIZE:], decrypted)
 
     try:
-        unpadded = unpad(decrypted)
-        return unpadded.decode("utf-8")
+        pad_len = decrypted[-1]
+        if pad_len > BLOCK_SIZE or pad_len == 0:
+            raise ValueError("Invalid padding")
+        return str(decrypted[:-pad_len], "utf-8")
     except Exception:
         return "[ERROR] Invalid padding or decoding"
+    finally:
+        decrypted[:] = bytes(len(decrypted))
+
+def encrypt_aes_raw(plaintext: bytes, key: bytes) -> bytes:
+    """
+    Encrypts raw bytes using AES-CBC with the given binary key.
+    Returns IV + ciphertext without any text encoding, for on-flash records.
+    """
+    iv = os.urandom(BLOCK_SIZE)
+    padded = pad(plaintext)
+    encrypted = bytearray(BLOCK_SIZE + len(padded))
+    encrypted[:BLOCK_SIZE] = iv
+
+    _cipher(key, iv).encrypt_into(padded, memoryview(encrypted)[BLOCK_SIZE:])
+    return encrypted
+
+def decrypt_aes_raw(data: bytes, key: bytes) -> memoryview:
+    """
+    Decrypts IV + ciphertext produced by encrypt_aes_raw.
+    Returns a memoryview over the plaintext, so unpadding does not copy it.
+    Raises ValueError if the data is malformed or the key is wrong.
+    """
+    if len(data) < 2 * BLOCK_SIZE or len(data) % BLOCK_SIZE:
+        raise ValueError("Invalid ciphertext length")
+
+    decrypted = bytearray(len(data) - BLOCK_SIZE)
+    _cipher(key, bytes(data[:BLOCK_SIZE])).decrypt_into(memoryview(data)[BLOCK_SIZE:], decrypted)
+    pad_len = decrypted[-1]
+    if pad_len > BLOCK_SIZE or pad_len == 0:
+        raise ValueError("Invalid padding")
+    return memoryview(decrypted)[:-pad_len]
+
+class CBCEncryptor:
+    """
+    Streams AES-CBC ciphertext (IV first) to `sink`, anything with write().
+
+    Plaintext is gathered into a preallocated chunk buffer and encrypted a
+    chunk at a time, so callers never hold a padded copy or the whole
+    ciphertext. close() adds the PKCS#7 padding and writes the last chunk.
+    """
+    def __init__(self, key: bytes, sink, chunk_size: int = CHUNK_SIZE, iv: bytes = None):
+        self._key = (key + b"\x00" * BLOCK_SIZE)[:BLOCK_SIZE]
+        self._sink = sink
+        self._chain = bytearray(iv or os.urandom(BLOCK_SIZE))
+        self._cipher = aesio.AES(self._key, aesio.MODE_CBC, IV=bytes(self._chain))
+        self._buf = bytearray(chunk_size)
+        self._out = bytearray(chunk_size)
+        self._fill = 0
+        sink.write(self._chain)
+
+    def write(self, data) -> None:
+        data = memoryview(data)
+        size = len(self._buf)
+        while len(data):
+            n = min(len(data), size - self._fill)
+            self._buf[self._fill:self._fill + n] = data[:n]
+            self._fill += n
+            data = data[n:]
+            if self._fill == size:
+                self._encrypt_chunk(size)
+
+    def close(self) -> None:
+        # The buffer is flushed whenever it fills, so the pad always fits.
+        pad_len = BLOCK_SIZE - (self._fill % BLOCK_SIZE)
+        for i in range(self._fill, self._fill + pad_len):
+            self._buf[i] = pad_len
+        self._encrypt_chunk(self._fill + pad_len)
+
+    def _encrypt_chunk(self, length: int) -> None:
+        # Carry the CBC chain explicitly: the next chunk's IV is the last
+        # ciphertext block of this one.
+        self._cipher.rekey(self._key, IV=bytes(self._chain))
+        out = memoryview(self._out)[:length]
+        self._cipher.encrypt_into(memoryview(self._buf)[:length], out)
+        self._chain[:] = out[length - BLOCK_SIZE:]
+        self._sink.write(out)
+        self._fill = 0
+
+class CBCDecryptor:
+    """
+    Streams AES-CBC ciphertext (IV first) from `source`, anything with
+    readinto(), through one preallocated chunk buffer.
+    """
+    def __init__(self, key: bytes, source, chunk_size: int = CHUNK_SIZE):
+        self._key = (key + b"\x00" * BLOCK_SIZE)[:BLOCK_SIZE]
+        self._source = source
+        self._chain = bytearray(BLOCK_SIZE)
+        if source.readinto(self._chain) != BLOCK_SIZE:
+            raise ValueError("Data too short")
+        self._cipher = aesio.AES(self._key, aesio.MODE_CBC, IV=bytes(self._chain))
+        self._buf = bytearray(chunk_size)
+
+    def readinto(self, dest) -> int:
+        """
+        Decrypt all remaining ciphertext into dest and check the padding.
+        dest must be large enough for the ciphertext; returns the length of
+        the plaintext at its start.
+        """
+        total = self._decrypt_all(memoryview(dest))
+        return total - _pad_length(dest, total)
+
+    def _decrypt_all(self, dest) -> int:
+        total = 0
+        while True:
+            n = self._source.readinto(self._buf)
+            if not n:
+                break
+            if n % BLOCK_SIZE or total + n > len(dest):
+                raise ValueError("Invalid ciphertext length")
+            self._cipher.rekey(self._key, IV=bytes(self._chain))
+            self._cipher.decrypt_into(memoryview(self._buf)[:n], dest[total:total + n])
+            self._chain[:] = memoryview(self._buf)[n - BLOCK_SIZE:n]
+            total += n
+        return total
+
+def _pad_length(data, length: int) -> int:
+    if not length:
+        raise ValueError("Data too short")
+    pad_len = data[length - 1]
+    if pad_len > BLOCK_SIZE or pad_len == 0:
+        raise ValueError("Invalid padding")
+    return pad_len
+
+def _seal_context(key):
+    """Return (AES key, keyed HMAC template) for sealing with key."""
+    key = bytes(key)
+    cached = _seal_keys.get(key)
+    if cached is None:
+        if len(_seal_keys) >= CIPHER_CACHE:
+            _seal_keys.pop(next(iter(_seal_keys)))
+        okm = derive_key(key, info=SEAL_INFO, length=BLOCK_SIZE + 32)
+        cached = (okm[:BLOCK_SIZE], hmac_sha256(okm[BLOCK_SIZE:]))
+        _seal_keys[key] = cached
+    return cached
+
+def _check_value(mac, header, iv) -> bytes:
+    check = mac.copy()
+    check.update(header)
+    check.update(iv)
+    return check.digest()[:CHECK_SIZE]
+
+def _digests_equal(a, b) -> bool:
+    if len(a) != len(b):
+        return False
+    diff = 0
+    for x, y in zip(a, b):
+        diff |= x ^ y
+    return diff == 0
+
+class _MacSink:
+    def __init__(self, sink, mac):
+        self._sink = sink
+        self._mac = mac
+
+    def write(self, data) -> None:
+        self._mac.update(data)
+        self._sink.write(data)
+
+class _MacSource:
+    """Reads at most `limit` bytes from source, feeding them to mac."""
+    def __init__(self, source, mac, limit: int):
+        self._source = source
+        self._mac = mac
+        self.limit = limit
+
+    def readinto(self, buf) -> int:
+        buf = memoryview(buf)[:min(len(buf), self.limit)]
+        n = self._source.readinto(buf) if len(buf) else 0
+        self._mac.update(buf[:n])
+        self.limit -= n
+        return n
+
+class _Bytes:
+    """Minimal in-memory stream for seal()/unseal()."""
+    def __init__(self, data=None, offset: int = 0):
+        self.data = data if data is not None else bytearray()
+        self._offset = offset
+
+    def write(self, data) -> None:
+        self.data.extend(data)
+
+    def readinto(self, buf) -> int:
+        n = min(len(buf), len(self.data) - self._offset)
+        buf[:n] = memoryview(self.data)[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+class SealEncryptor(CBCEncryptor):
+    """
+    CBCEncryptor that authenticates what it writes (encrypt-then-MAC).
+
+    Writes header, a short check value, the IV and ciphertext, and on
+    close() an HMAC-SHA256 tag over all of it, all in the same pass. The
+    AES and MAC keys are derived from key with HKDF. The check value is
+    HMAC(header | IV) cut to CHECK_SIZE bytes, so a reader holding the
+    wrong key gives up before touching the ciphertext.
+    """
+    def __init__(self, key: bytes, sink, header: bytes = SEAL_HEADER, chunk_size: int = CHUNK_SIZE):
+        aes_key, mac = _seal_context(key)
+        iv = os.urandom(BLOCK_SIZE)
+        self._mac = mac.copy()
+        head = header + _check_value(mac, header, iv)
+        sink.write(head)
+        self._mac.update(head)
+        self._raw_sink = sink
+        super().__init__(aes_key, _MacSink(sink, self._mac), chunk_size, iv=iv)
+
+    def close(self) -> None:
+        super().close()
+        self._raw_sink.write(self._mac.digest())
+
+class SealDecryptor(CBCDecryptor):
+    """
+    Reads what SealEncryptor wrote. The caller has already consumed
+    header (it usually dispatches on it) and passes the number of bytes
+    left in source. A wrong key raises ValueError right after the check
+    value; a damaged or tampered body raises once the tag is compared,
+    before the padding or the plaintext are looked at.
+    """
+    def __init__(self, key: bytes, source, length: int, header: bytes = SEAL_HEADER,
+                 chunk_size: int = CHUNK_SIZE):
+        body = length - SEAL_OVERHEAD
+        if body < BLOCK_SIZE or body % BLOCK_SIZE:
+            raise ValueError("Invalid sealed data length")
+        aes_key, mac = _seal_context(key)
+        check = bytearray(CHECK_SIZE)
+        if source.readinto(check) != CHECK_SIZE:
+            raise ValueError("Data too short")
+        self._mac = mac.copy()
+        self._mac.update(header)
+        self._mac.update(check)
+        self._raw_source = source
+        super().__init__(aes_key, _MacSource(source, self._mac, BLOCK_SIZE + body), chunk_size)
+        if not _digests_equal(check, _check_value(mac, header, self._chain)):
+            raise ValueError("Wrong key for sealed data")
+
+    def readinto(self, dest) -> int:
+        total = self._decrypt_all(memoryview(dest))
+        tag = bytearray(TAG_SIZE)
+        if self._raw_source.readinto(tag) != TAG_SIZE or not _digests_equal(tag, self._mac.digest()):
+            raise ValueError("Sealed data failed authentication")
+        return total - _pad_length(dest, total)
+
+def seal(plaintext, key: bytes, header: bytes = SEAL_HEADER) -> bytearray:
+    """Seal plaintext in memory; see SealEncryptor."""
+    out = _Bytes()
+    encryptor = SealEncryptor(key, out, header)
+    encryptor.write(plaintext)
+    encryptor.close()
+    return out.data
+
+def unseal(data, key: bytes, header: bytes = SEAL_HEADER) -> memoryview:
+    """Check and decrypt sealed data. Raises ValueError if it is not authentic."""
+    if not is_sealed(data, header):
+        raise ValueError("Not sealed data")
+    length = len(data) - len(header)
+    decryptor = SealDecryptor(key, _Bytes(data, len(header)), length, header)
+    plain = bytearray(length - SEAL_OVERHEAD)
+    return memoryview(plain)[:decryptor.readinto(plain)]
+
+def is_sealed(data, header: bytes = SEAL_HEADER) -> bool:
+    return bytes(data[:len(header)]) == header
 
 def generate_salt() -> bytes:
     return os.urandom(SALT_SIZE)
 
 def hash_pin(pin: bytes, salt: bytes) -> bytes:
     uid = microcontroller.cpu.uid
-    h = hashlib.sha256()
+    h = kdf_sha256()()
     h.update(salt + pin + uid)
     return h.digest()
 
+def stretch_pin(pin: bytes, salt: bytes, iterations: int) -> bytes:
+    """
+    PBKDF2-HMAC-SHA256 of pin (one 32-byte block) over salt and the board
+    uid. The cost is linear in iterations; every round copies one keyed
+    HMAC instead of re-keying it.
+    """
+    keyed = hmac_sha256(pin)
+    mac = keyed.copy()
+    mac.update(salt)
+    mac.update(microcontroller.cpu.uid)
+    mac.update(b"\x00\x00\x00\x01")
+    block = mac.digest()
+    acc = int.from_bytes(block, "big")
+    for _ in range(iterations - 1):
+        mac = keyed.copy()
+        mac.update(block)
+        block = mac.digest()
+        acc ^= int.from_bytes(block, "big")
+    return acc.to_bytes(32, "big")
+
+def calibrate_pin_iterations(target_ms: int = PIN_TARGET_MS) -> int:
+    """
+    Iteration count that makes stretch_pin() take about target_ms here.
+    The probe doubles until it runs for PIN_PROBE_MS, and the one-time
+    HMAC setup, timed on its own, is left out of the per-iteration cost.
+    """
+    salt = bytes(SALT_SIZE)
+    start = time.monotonic_ns()
+    stretch_pin(b"0000", salt, 1)
+    setup_ns = time.monotonic_ns() - start
+    iterations = PIN_PROBE_ITERATIONS
+    while True:
+        start = time.monotonic_ns()
+        stretch_pin(b"0000", salt, iterations)
+        elapsed_ns = time.monotonic_ns() - start
+        if elapsed_ns >= PIN_PROBE_MS * 1_000_000:
+            break
+        iterations *= 2
+    per_iteration_ns = max(elapsed_ns - setup_ns, 1) / (iterations - 1)
+    return max(MIN_PIN_ITERATIONS, 1 + int((target_ms * 1_000_000 - setup_ns) / per_iteration_ns))
+
+class _NoBatch:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_BATCH = _NoBatch()
+
+def _kdf_batch():
+    """
+    With HKDF offloaded, one chip wake for every hash of a derivation
+    instead of one per hash; nothing otherwise.
+    """
+    backend = offload()
+    return _NO_BATCH if backend is None else backend.batch()
+
 def hkdf_extract(salt: bytes, input_key_material: bytes) -> bytes:
     """HKDF-Extract step (RFC 5869)"""
     if not salt:
-        salt = bytes([0] * hashlib.sha256().digest_size)
-    return hmac.new(salt, input_key_material, hashlib.sha256).digest()
+        salt = bytes([0] * sha256().digest_size)
+    with _kdf_batch():
+        return hmac_sha256(salt, input_key_material, kdf_sha256()).digest()
 
-def hkdf_expand(prk: bytes, info: bytes, length: int) -> bytes:
-    """HKDF-Expand step (RFC 5869)"""
-    hash_len = hashlib.sha256().digest_size
+def _hkdf_expand(prk_mac, info: bytes, length: int) -> bytes:
+    # prk_mac is HMAC(prk) with nothing fed yet: every block starts from a
+    # copy of its pad states instead of re-keying a new HMAC.
     blocks = []
     block = b""
-    for counter in range(1, -(-length // hash_len) + 1):  # ceil(length/hash_len)
-        block = hmac.new(prk, block + info + bytes([counter]), hashlib.sha256).digest()
+    for counter in range(1, -(-length // prk_mac.digest_size) + 1):  # ceil(length/hash_len)
+        mac = prk_mac.copy()
+        mac.update(block)
+        mac.update(info)
+        mac.update(bytes((counter,)))
+        block = mac.digest()
         blocks.append(block)
     return b"".join(blocks)[:length]
 
+def hkdf_expand(prk: bytes, info: bytes, length: int) -> bytes:
+    """HKDF-Expand step (RFC 5869)"""
+    with _kdf_batch():
+        return _hkdf_expand(hmac_sha256(prk, hash_cons=kdf_sha256()), info, length)
+
+def derive_keys(template: bytes, salt: bytes = b"", infos=(b"fingerprint-key",), length: int = 32) -> list:
+    """
+    Derive one subkey per info string from a single HKDF-Extract, e.g.
+    derive_keys(template, salt, infos=(b"vault", b"backup", b"session")).
+    """
+    with _kdf_batch():
+        prk_mac = hmac_sha256(hkdf_extract(salt, template), hash_cons=kdf_sha256())
+        return [_hkdf_expand(prk_mac, info, length) for info in infos]
+
 def derive_key(template: bytes, salt: bytes = b"", info: bytes = b"fingerprint-key", length: int = 32) -> bytes:
     """Derive AES key from fingerprint template using HKDF (CircuitPython version)"""
-    prk = hkdf_extract(salt, template)
-    return hkdf_expand(prk, info, length)
\ No newline at end of file
+    return derive_keys(template, salt, (info,), length)[0]
@@ -0,0 +1,602 @@
+"""
+Out-of-core KeyStore backend for vaults larger than RAM.
+
+Entries live in one file of fixed-size encrypted blocks sorted by URL key,
+followed by a second run of blocks sorted by alias. Only the first key of
+every block is kept in RAM; a lookup binary-searches that sparse index and
+decrypts the one block it lands on, keeping the last few in a small LRU
+cache. Edits collect in a RAM overlay (and the journal, as with KeyStore)
+and are merged into a freshly written file on compaction.
+
+Selected with PLUTO_VAULT_BACKEND = "flash" in settings.toml.
+"""
+import os
+import struct
+import vault_format
+from crypto_utils import decrypt_aes_raw, seal, unseal
+from utils import bisect_right, normalize_host
+from key_store import (KeyStore, HeapRewrite, KEYS_FILE, KEYS_TMP_FILE, FLASH_FILE, JOURNAL_FILE,
+                       HEAP_FILES, HEAP_SLACK, SEALED_SCHEMA, ACCOUNT_SEP, vault_files, _file_size,
+                       _host_term, _try_remove)
+
+FLASH_TMP_FILE = FLASH_FILE + ".tmp"
+
+CACHE_BLOCKS = 4   # decrypted blocks kept per table
+
+_MISSING = object()
+_DELETED = object()
+_SEP = "\x00"  # alias table keys are alias.lower() + _SEP + URL key
+# How URL keys start, for host lookups without a RAM index of hosts.
+_URL_STARTS = ("https://", "http://", "https://www.", "http://www.", "", "www.")
+
+def _alias_key(alias: str, key: str) -> str:
+    """Alias table key: sorted like KeyStore's aliases, by lowercase then URL key."""
+    return alias.lower() + _SEP + key
+
+class BlockTable:
+    """
+    Sorted key -> entry mapping over a run of blocks in FLASH_FILE plus an
+    overlay of unsaved changes. Supports the dict operations KeyStore uses.
+    sealed is False for the blocks of a version 1 file.
+    """
+    def __init__(self, store, offset: int = 0, first_keys=None, count: int = 0,
+                 sealed: bool = True):
+        self._store = store
+        self._offset = offset
+        self._first = first_keys or []
+        self._count = count
+        self._sealed = sealed
+        self.overlay = {}  # key -> entry or _DELETED
+        self._cache = {}
+        self._recent = []  # block numbers, least recently used first
+
+    @property
+    def blocks(self) -> int:
+        return len(self._first)
+
+    def _block(self, number: int) -> dict:
+        entries = self._cache.get(number)
+        if entries is not None:
+            self._recent.remove(number)
+            self._recent.append(number)
+            return entries
+
+        size = _block_bytes(self._sealed)
+        with open(FLASH_FILE, "rb") as f:
+            f.seek(self._offset + number * size)
+            blob = f.read(size)
+        if self._sealed:
+            payload = unseal(blob, self._store.master_key, vault_format.BLOCK_TAG)
+        else:
+            payload = decrypt_aes_raw(blob, self._store.master_key)
+        entries = vault_format.decode_snapshot(payload)[0]
+        if self._first[number] not in entries:
+            raise ValueError("Vault block out of place")
+        if len(self._recent) >= CACHE_BLOCKS:
+            del self._cache[self._recent.pop(0)]
+        self._cache[number] = entries
+        self._recent.append(number)
+        return entries
+
+    def drop_cache(self):
+        self._cache = {}
+        self._recent = []
+
+    def _on_flash(self, key, default=None):
+        if not isinstance(key, str):
+            return default  # e.g. None from a failed lookup; keys are str only
+        number = bisect_right(self._first, key) - 1
+        if number < 0:
+            return default
+        return self._block(number).get(key, default)
+
+    def get(self, key, default=None):
+        entry = self.overlay.get(key, _MISSING)
+        if entry is _MISSING:
+            return self._on_flash(key, default)
+        return default if entry is _DELETED else entry
+
+    def __getitem__(self, key):
+        entry = self.get(key, _MISSING)
+        if entry is _MISSING:
+            raise KeyError(key)
+        return entry
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __setitem__(self, key, entry):
+        if key not in self:
+            self._count += 1
+        self.overlay[key] = entry
+
+    def pop(self, key, default=_MISSING):
+        entry = self.get(key, _MISSING)
+        if entry is _MISSING:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        self.overlay[key] = _DELETED
+        self._count -= 1
+        return entry
+
+    def __len__(self) -> int:
+        return self._count
+
+    def items(self, start=None):
+        """Yield (key, entry) in key order from start on, overlay merged in."""
+        pending = sorted(key for key in self.overlay if start is None or key >= start)
+        i = 0
+        number = 0 if start is None else max(bisect_right(self._first, start) - 1, 0)
+        for number in range(number, len(self._first)):
+            block = self._block(number)
+            for key in sorted(block):
+                if start is not None and key < start:
+                    continue
+                while i < len(pending) and pending[i] < key:
+                    entry = self.overlay[pending[i]]
+                    if entry is not _DELETED:
+                        yield pending[i], entry
+                    i += 1
+                if i < len(pending) and pending[i] == key:
+                    i += 1
+                    entry = self.overlay[key]
+                    if entry is _DELETED:
+                        continue
+                    yield key, entry
+                else:
+                    yield key, block[key]
+        for key in pending[i:]:
+            entry = self.overlay[key]
+            if entry is not _DELETED:
+                yield key, entry
+
+    def before(self, key=None):
+        """
+        The largest key below key (of the whole table when key is None),
+        overlay merged in; None if there is none. Walks blocks backwards
+        from the one key falls in, so usually one block is decrypted.
+        """
+        best = None
+        for other, entry in self.overlay.items():
+            if entry is not _DELETED and (key is None or other < key) and (best is None or other > best):
+                best = other
+        number = len(self._first) - 1 if key is None else bisect_right(self._first, key) - 1
+        for number in range(number, -1, -1):
+            block = self._block(number)
+            below = [other for other in block
+                     if (key is None or other < key) and self.overlay.get(other) is not _DELETED]
+            if below:
+                found = max(below)
+                return found if best is None or found > best else best
+        return best
+
+    def keys(self):
+        for key, _ in self.items():
+            yield key
+
+    __iter__ = keys
+
+    def values(self):
+        for _, entry in self.items():
+            yield entry
+
+def _first(items):
+    for item in items:
+        return item
+    return None
+
+def _write_blocks(f, store, items, heap: int):
+    """Pack (key, entry) pairs, in order, into fixed-size blocks."""
+    first = []
+    batch = {}
+    names = {}
+    size = 7  # heap, schema, name count, entry count
+    for key, entry in items:
+        grow = vault_format.entry_size(key, entry, names)
+        if batch and size + grow > vault_format.BLOCK_PAYLOAD:
+            _write_block(f, store, batch, heap)
+            batch, names = {}, {}
+            grow = vault_format.entry_size(key, entry, names)
+            size = 7
+        if size + grow > vault_format.BLOCK_PAYLOAD:
+            raise ValueError(f"Entry too large for a vault block: {key}")
+        if not batch:
+            first.append(key)
+        batch[key] = entry
+        size += grow
+    if batch:
+        _write_block(f, store, batch, heap)
+    return first
+
+def _write_block(f, store, batch: dict, heap: int):
+    payload = vault_format.encode_snapshot(batch, heap, store.schema)
+    payload.extend(bytes(vault_format.BLOCK_PAYLOAD - len(payload)))
+    f.write(seal(payload, store.master_key, vault_format.BLOCK_TAG))
+
+def _block_bytes(sealed: bool) -> int:
+    return vault_format.BLOCK_BYTES if sealed else vault_format.LEGACY_BLOCK_BYTES
+
+def _read_index(master_key):
+    """
+    Read the header and sparse block index of FLASH_FILE, or of the new
+    file an interrupted save left in FLASH_TMP_FILE. Returns (header
+    fields, first keys) or None if there is no file. A version 1
+    file is only read at a schema before SEALED_SCHEMA.
+    """
+    try:
+        f = open(FLASH_FILE, "rb")
+    except OSError:
+        # _save() was interrupted between removing the old file and renaming
+        # the new one into place. The header is written last, so a new file
+        # that has one is complete.
+        try:
+            with open(FLASH_TMP_FILE, "rb") as f:
+                magic = f.read(len(vault_format.FLASH_MAGIC))
+        except OSError:
+            return None
+        if magic != vault_format.FLASH_MAGIC:
+            return None
+        os.rename(FLASH_TMP_FILE, FLASH_FILE)
+        f = open(FLASH_FILE, "rb")
+    with f:
+        header = struct.unpack(vault_format.FLASH_HEADER, f.read(vault_format.FLASH_HEADER_SIZE))
+        sealed = header[1] >= vault_format.SEALED_FLASH_VERSION
+        if (header[0] != vault_format.FLASH_MAGIC or header[1] > vault_format.FLASH_VERSION
+                or not (sealed or header[1] == 1 and header[3] < SEALED_SCHEMA)):
+            raise ValueError("Not a vault block file")
+        data_blocks, alias_blocks, index_len = header[5], header[6], header[10]
+        f.seek(vault_format.FLASH_HEADER_SIZE
+               + (data_blocks + alias_blocks) * _block_bytes(sealed))
+        index = f.read(index_len)
+    if sealed:
+        index = unseal(index, master_key, vault_format.INDEX_TAG)
+    else:
+        index = decrypt_aes_raw(index, master_key)
+    return header, vault_format.decode_keys(index)
+
+def load_entries(store):
+    """
+    Read every entry of FLASH_FILE into a dict, for the in-RAM KeyStore.
+    Returns (entries, epoch, schema, heap).
+    """
+    header, first = _read_index(store.master_key)
+    table = BlockTable(store, vault_format.FLASH_HEADER_SIZE, first[:header[5]], header[7],
+                       header[1] >= vault_format.SEALED_FLASH_VERSION)
+    return dict(table.items()), header[2], header[3], header[4]
+
+class FlashKeyStore(KeyStore):
+    """
+    KeyStore with the same public API whose index stays on flash. RAM use
+    is the sparse block index, CACHE_BLOCKS decrypted blocks per table and
+    the edits made since the last compaction.
+
+    Aliases are resolved through the alias table; as with KeyStore, an
+    alias shared by several entries raises AmbiguousSite unless a
+    username picks one of them.
+    """
+    def _load_db(self):
+        self._aliases = BlockTable(self)
+        self._live = 0
+        try:
+            index = _read_index(self.master_key)
+            if index is None:
+                return self._migrate_from_keystore()
+            return self._open_tables(*index)
+        except Exception as e:
+            print("⚠️ Failed to load key store:", e)
+            return BlockTable(self)
+
+    def _open_tables(self, header, first):
+        """Set up the alias table and return the data table of FLASH_FILE."""
+        (_, version, self._epoch, self.schema, heap, data_blocks, _,
+         count, aliases, self._live, _) = header
+        sealed = version >= vault_format.SEALED_FLASH_VERSION
+        self._heap_path = HEAP_FILES[heap]
+        data = BlockTable(self, vault_format.FLASH_HEADER_SIZE, first[:data_blocks], count, sealed)
+        if version < vault_format.FOLDED_ALIAS_VERSION:
+            # Rewritten with sealed blocks and the alias table rebuilt in
+            # lowercase order.
+            self._migrate_format = True
+            self._aliases = BlockTable(self)
+            for key, entry in data.items():
+                self._index_add(key, entry)
+            return data
+        self._aliases = BlockTable(
+            self, vault_format.FLASH_HEADER_SIZE + data_blocks * _block_bytes(sealed),
+            first[data_blocks:], aliases, sealed)
+        return data
+
+    def _migrate_from_keystore(self):
+        """Take over a vault written by the in-RAM KeyStore, if there is one."""
+        table = BlockTable(self)
+        if not _file_size(KEYS_FILE) and not _file_size(KEYS_TMP_FILE):
+            return table
+        for key, entry in KeyStore._load_db(self).items():
+            table[key] = entry
+        self._migrate_format = True
+        return table
+
+    def _save(self, grow: bool = True):
+        """
+        Merge the overlay into a new block file and swap it in. The old file
+        stays in place until the new one is complete.
+        """
+        self._close_heap()
+        rewrite = self._heap_size > HEAP_SLACK and self._heap_size > 2 * self._live
+        heap, heap_copy = self._heap_path, None
+        live = 0
+
+        try:
+            if rewrite:
+                heap_copy = HeapRewrite(self._heap_path)
+                heap = heap_copy.path
+            heap_index = HEAP_FILES.index(heap)
+            with open(FLASH_TMP_FILE, "wb") as f:
+                f.write(bytes(vault_format.FLASH_HEADER_SIZE))
+
+                def entries():
+                    nonlocal live
+                    for key, entry in self.db.items():
+                        ref = entry.get("secret") if isinstance(entry, dict) else None
+                        if ref:
+                            live += ref[1]
+                        yield key, entry if heap_copy is None else heap_copy.move(entry)
+
+                data_first = _write_blocks(f, self, entries(), heap_index)
+                alias_first = _write_blocks(f, self, self._aliases.items(), heap_index)
+                index = seal(vault_format.encode_keys(data_first + alias_first),
+                             self.master_key, vault_format.INDEX_TAG)
+                f.write(index)
+                f.seek(0)
+                f.write(struct.pack(vault_format.FLASH_HEADER, vault_format.FLASH_MAGIC,
+                                    vault_format.FLASH_VERSION, self._epoch + 1, self.schema,
+                                    heap_index, len(data_first), len(alias_first), len(self.db),
+                                    len(self._aliases), live, len(index)))
+            if heap_copy is not None:
+                heap_copy.close()
+            try:
+                os.remove(FLASH_FILE)
+            except OSError:
+                pass
+            os.rename(FLASH_TMP_FILE, FLASH_FILE)
+            print(f"💾 Vault saved successfully ({len(data_first)} blocks).")
+        except Exception as e:
+            if heap_copy is not None:
+                heap_copy.close()
+            print("❌ Failed to save vault:", e)
+            return e
+
+        if rewrite:
+            _try_remove(self._heap_path)
+            self._heap_path, self._heap_size = heap, heap_copy.size
+        self._epoch += 1
+        self._live = live
+        offset = vault_format.FLASH_HEADER_SIZE
+        self.db = BlockTable(self, offset, data_first, len(self.db))
+        offset += len(data_first) * vault_format.BLOCK_BYTES
+        self._aliases = BlockTable(self, offset, alias_first, len(self._aliases))
+        if self._migrate_format:
+            # The in-RAM backend's files are superseded now.
+            for path in vault_files():
+                if path not in (FLASH_FILE, JOURNAL_FILE) and path not in HEAP_FILES:
+                    _try_remove(path)
+            self._migrate_format = False
+        _try_remove(JOURNAL_FILE)
+        self._journal_records = 0
+        self._journal_frames = 0
+        self._clear_pending()
+        return True
+
+    def _reshard(self, count: int, entries=None):
+        pass  # a single sorted file; nothing to spread
+
+    def _lock_index(self):
+        # Everything is on flash: drop the block index and decrypted blocks.
+        self.db = BlockTable(self)
+        self._aliases = BlockTable(self)
+
+    def _unlock_index(self):
+        index = _read_index(self.master_key)
+        if index is None:
+            raise ValueError("No vault block file")
+        self.db = self._open_tables(*index)
+        self._journal_records = self._journal_frames = 0
+        if not self._replay_journal():
+            raise ValueError("Journal replay stopped")
+        self._rebuild_index()
+
+    def _touch(self, key: str, present: bool):
+        pass
+
+    def _rebuild_index(self):
+        """The alias table is on flash; only bring in the replayed edits."""
+        self.generation += 1
+        for key, entry in self.db.overlay.items():
+            self._index_remove(key, self.db._on_flash(key))
+            if entry is not _DELETED:
+                self._index_add(key, entry)
+
+    def _index_add(self, key: str, entry):
+        if isinstance(entry, dict) and entry.get("alias"):
+            self._aliases[_alias_key(entry["alias"], key)] = {"alias": entry["alias"]}
+
+    def _index_remove(self, key: str, entry):
+        if isinstance(entry, dict) and entry.get("alias"):
+            self._aliases.pop(_alias_key(entry["alias"], key), None)
+
+    def _url_keys(self, url: str):
+        """Accounts of url: the keys equal to it or starting with url + ACCOUNT_SEP."""
+        keys = []
+        for key, _ in self.db.items(url):
+            if key != url and not key.startswith(url + ACCOUNT_SEP):
+                break
+            keys.append(key)
+        return keys
+
+    def _alias_keys(self, alias: str):
+        prefix = alias.lower() + _SEP
+        keys = []
+        for key, entry in self._aliases.items(prefix):
+            if not key.startswith(prefix):
+                break
+            if entry["alias"] == alias:
+                keys.append(key[len(prefix):])
+        return keys
+
+    def _group(self, term: str):
+        """The aliases whose lowercase is term, in get_aliases() order."""
+        prefix = term + _SEP
+        aliases = []
+        for key, entry in self._aliases.items(prefix):
+            if not key.startswith(prefix):
+                break
+            if entry["alias"] not in aliases:
+                aliases.append(entry["alias"])
+        return aliases
+
+    def _last_alias_before(self, key=None):
+        """The last alias of the groups below key (of all when None)."""
+        key = self._aliases.before(key)
+        return None if key is None else self._group(key[:key.find(_SEP)])[-1]
+
+    def get_aliases(self):
+        """
+        Every alias as a tuple in KeyStore's order, read from the alias
+        table on each call; nothing is kept. Browse with first_alias(),
+        alias_after() and alias_before() instead of indexing.
+        """
+        return tuple(self.iter_aliases())
+
+    def iter_aliases(self, start: str = ""):
+        """get_aliases() from the first alias at or after start on, streamed."""
+        term, seen = None, []
+        for key, entry in self._aliases.items(start.lower()):
+            group = key[:key.find(_SEP)]
+            if group != term:
+                term, seen = group, []
+            if entry["alias"] not in seen:  # one per group of accounts
+                seen.append(entry["alias"])
+                yield entry["alias"]
+
+    def first_alias(self, prefix: str = ""):
+        first = None
+        for alias in self.iter_aliases(prefix):
+            if first is None:
+                first = alias
+            if alias == prefix:
+                return alias
+            if alias.lower() != prefix.lower():
+                break
+        return first if first is not None else self._last_alias_before()
+
+    def alias_after(self, alias: str):
+        first, found = None, False
+        for other in self.iter_aliases(alias):
+            if found:
+                return other
+            if first is None:
+                first = other
+            if other == alias:
+                found = True
+            elif other.lower() != alias.lower():
+                break
+        if first is not None and not found:
+            return first
+        return _first(self.iter_aliases())
+
+    def alias_before(self, alias: str):
+        term = alias.lower()
+        group = self._group(term)
+        if alias in group[1:]:
+            return group[group.index(alias) - 1]
+        return self._last_alias_before(term + _SEP) or self._last_alias_before()
+
+    def find(self, prefix: str, limit: int = 0):
+        """
+        Like KeyStore.find, as range scans of the two sorted tables. Host
+        matches are looked up as URL keys under each of _URL_STARTS, so
+        they come start by start, and a URL key with capitals in its host
+        is not found by host.
+        """
+        prefix = prefix.strip().lower()
+        found = []
+        seen = set()
+        starts = [(self._aliases, prefix)]
+        starts += [(self.db, start + prefix) for start in _URL_STARTS]
+        for table, start in starts:
+            for key, entry in table.items(start):
+                if not key.startswith(start) or (limit and len(found) >= limit):
+                    break
+                if table is self._aliases:
+                    alias, key = entry["alias"], key[key.find(_SEP) + 1:]
+                elif _host_term(key, entry).startswith(prefix):
+                    alias = entry.get("alias", key) if isinstance(entry, dict) else key
+                else:
+                    continue
+                if key not in seen:
+                    seen.add(key)
+                    found.append((alias, key))
+        return found
+
+    def alias_position(self, prefix: str) -> int:
+        """Counted by streaming the aliases before prefix; O(position)."""
+        position = 0
+        for alias in self.iter_aliases():
+            if alias.lower() >= prefix.lower():
+                break
+            position += 1
+        return position
+
+    def match_domain(self, site: str):
+        """
+        Like KeyStore.match_domain without a RAM index: each suffix is
+        looked up as a URL key under each of _URL_STARTS, and the keys
+        whose normalized host is the suffix are kept.
+        """
+        host = normalize_host(site)
+        while host:
+            keys = []
+            for start in _URL_STARTS:
+                for key, entry in self.db.items(start + host):
+                    if not key.startswith(start + host):
+                        break
+                    if _host_term(key, entry) == host and key not in keys:
+                        keys.append(key)
+            if keys:
+                return keys
+            dot = host.find(".")
+            host = host[dot + 1:] if dot >= 0 else ""
+        return []
+
+    def initials(self):
+        """One range scan per letter, each reading a single alias."""
+        letters = []
+        key = _first(self._aliases.keys())
+        while key is not None:
+            letters.append(key[0])
+            key = _first(other for other, _ in self._aliases.items(chr(ord(key[0]) + 1)))
+        return letters
+
+    def content_generation(self):
+        """The block file header (epoch, counts) stands in for the manifest."""
+        try:
+            with open(FLASH_FILE, "rb") as f:
+                header = f.read(vault_format.FLASH_HEADER_SIZE)
+        except OSError:
+            header = b""
+        return (bytes(header), _file_size(JOURNAL_FILE),
+                self._heap_path, _file_size(self._heap_path))
+
+    def lock(self):
+        self.db.drop_cache()
+        self._aliases.drop_cache()
+        super().lock()
+
+    def status(self) -> dict:
+        status = super().status()
+        status["backend"] = "flash"
+        status["blocks"] = self.db.blocks + self._aliases.blocks
+        status["unsaved"] = len(self.db.overlay) + len(self._aliases.overlay)
+        del status["shards"]
+        return status
@@ -1,93 +1,1042 @@
 import gc
 import json
-from crypto_utils import decrypt_aes_bytes, encrypt_aes_bytes
-from utils import csv_reader
+import os
+import struct
+import time
+import vault_format
+import binascii
+from crypto_backend import sha256
+from crypto_utils import (decrypt_aes_bytes, decrypt_aes_raw, seal, unseal, is_sealed,
+                          CBCDecryptor, SealDecryptor, SealEncryptor, BLOCK_SIZE, SEAL_OVERHEAD,
+                          clear_cipher_cache)
+from utils import csv_reader, bisect_left, normalize_host
 
-KEYS_FILE = "sd/keys.db"
+KEYS_FILE = "sd/keys.db"  # manifest
+KEYS_TMP_FILE = KEYS_FILE + ".tmp"
+JOURNAL_FILE = "sd/keys.log"
+HEAP_FILES = ("sd/keys.s0", "sd/keys.s1")  # sealed secrets; compaction alternates
+SHARD_FILE = "sd/keys.{:02d}{}"  # shard number, slot "a"/"b"; saves alternate
+FLASH_FILE = "sd/keys.blk"  # written by the out-of-core backend, see flash_store.py
+VAULT_DIR, VAULT_PREFIX = "sd", "keys."
+
+SHARD_TARGET = 64       # entries per shard before the vault is resharded
+MAX_SHARDS = 32
+
+COMPACT_THRESHOLD = 32  # journal records before folding them into the snapshot
+WRITE_BEHIND = True     # defer persistence and flush from the main loop
+IDLE_FLUSH_DELAY = 2    # seconds without mutations before an idle flush
+MAX_UNFLUSHED = 10      # seconds a change may stay in RAM only, at most
+HEAP_SLACK = 4096       # heap garbage tolerated before compaction rewrites it
+
+# Schema migrations as (version reached, KeyStore method), oldest first.
+# Append new steps here; never renumber or remove old ones.
+MIGRATIONS = (
+    (1, "_normalize_loaded_db"),  # URL keys, alias filled in, secrets sealed
+    (2, "_migrate_account_keys"),  # (URL, username) keys
+    (3, "_seal_heap_secrets"),  # encrypt-then-MAC heap blobs
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+SEALED_SCHEMA = 3  # from here on heap blobs and journal frames must be sealed
+
+# Fields sealed per entry and only decrypted on demand by get().
+SECRET_FIELDS = ("password", "note")
+
+_MISSING = object()
+
+# An entry is keyed by its URL alone, or by URL + ACCOUNT_SEP + username
+# when it has a username, so several accounts can share one site.
+ACCOUNT_SEP = "\x1f"
+
+def account_key(url: str, username: str = "") -> str:
+    return url + ACCOUNT_SEP + username if username else url
+
+def split_account_key(key: str):
+    """account_key() reversed: returns (url, username)."""
+    sep = key.find(ACCOUNT_SEP)
+    return (key, "") if sep < 0 else (key[:sep], key[sep + 1:])
+
+class AmbiguousSite(LookupError):
+    """Several entries match a site equally well; see .candidates."""
+    def __init__(self, site: str, candidates):
+        super().__init__(f"Several entries match {site}")
+        self.candidates = candidates  # [(alias, key), ...]
+
+class Transaction:
+    """
+    Context manager returned by KeyStore.transaction().
+
+    Mutations inside the block are applied in memory only and persisted with
+    a single snapshot write on exit. If the block raises or the write fails,
+    every touched entry is restored and nothing reaches the flash.
+    """
+    def __init__(self, store):
+        self._store = store
+
+    def __enter__(self):
+        self._store._begin()
+        return self._store
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._store._commit()
+        else:
+            self._store._rollback()
+        return False
 
 class KeyStore:
-    def __init__(self, master_key):
+    def __init__(self, master_key, write_behind: bool = WRITE_BEHIND):
         self.master_key = master_key  # raw string (authenticated)
+        self.write_behind = write_behind
+        self._pending = []            # encoded journal records not yet on flash
+        self._needs_snapshot = False  # a deferred transaction commit
+        self._pending_changes = 0
+        self._dirty_since = None
+        self._last_change = None
+        self._journal_records = 0
+        self._journal_frames = 0  # frames in the journal file, numbered from 0
+        self._txn_depth = 0
+        self._undo = None  # key -> previous entry while a transaction is open
+        self.generation = 0  # bumped on every in-memory mutation
+        self._alias_view = None
+        self._alias_view_generation = -1
+        self._heap_path = HEAP_FILES[0]
+        self._heap_out = None  # append handle kept open during a transaction
+        self._migrate_format = False  # set when a pre-binary file was read
+        self._lock_stamp = None  # (key digest, content generation) while locked
+        self._locked_count = 0  # entries at lock(), to check the reload in unlock()
+        self.schema = SCHEMA_VERSION  # lowered by the loader for older files
+        self.migrations = []  # (step, schema, seconds) run during this load
+        self._epoch = 0  # manifest save counter
+        self._slots = [1]  # live slot per shard; 1 for a shard never written
+        self._shards = [set()]  # keys held by each shard
+        self._dirty_shards = set()  # shards to rewrite on the next save
         self.db = self._load_db()
-        self._normalize_loaded_db()
+        self._heap_size = _file_size(self._heap_path)
+        intact = self._replay_journal()
+        self._rebuild_index()
+        migrated = self._run_migrations()
+        if (not intact or migrated or self._migrate_format
+                or self._journal_records >= COMPACT_THRESHOLD):
+            # A damaged tail must go before anything is appended after it,
+            # and migrated or legacy files are rewritten once at the new schema.
+            self._save()
 
     def _load_db(self):
+        """Load the manifest and every shard. Secrets stay sealed in the heap file."""
+        path = KEYS_FILE
         try:
-            with open(KEYS_FILE, "r") as f:
-                encrypted = f.read().strip()
-                decrypted = decrypt_aes_bytes(base64_input=encrypted, key=self.master_key)
-                return json.loads(decrypted)
+            try:
+                f = open(path, "rb")
+            except OSError:
+                # _save() was interrupted between removing the old manifest
+                # and renaming the new one into place.
+                path = KEYS_TMP_FILE
+                if not _file_size(path) and _file_size(FLASH_FILE):
+                    return self._load_flash_db()
+                f = open(path, "rb")
+            with f:
+                header = f.read(5)
+                if header[:4] == vault_format.MAGIC:
+                    # Unsharded vault; resharded by the save that follows.
+                    entries, heap, self.schema = self._read_shard(f, path, header)
+                    self._migrate_format = True
+                    self._heap_path = HEAP_FILES[heap]
+                    self._reshard(_shard_count(len(entries)), entries)
+                    return entries
+                if header[:4] != vault_format.MANIFEST_MAGIC:
+                    return self._load_legacy_db(header + f.read())
+                self._epoch, self.schema, heap, self._slots = \
+                    vault_format.decode_manifest(header + f.read())
+
+            entries = {}
+            self._shards = []
+            for number, slot in enumerate(self._slots):
+                path = _shard_path(number, slot)
+                with open(path, "rb") as f:
+                    header = f.read(5)
+                    shard = self._read_shard(f, path, header)[0]
+                if header[4] < vault_format.SEALED_VERSION:
+                    self._dirty_shards.add(number)
+                    self._migrate_format = True
+                entries.update(shard)
+                self._shards.append(set(shard))
+                del shard
         except Exception as e:
             print("⚠️ Failed to load key store:", e)
+            self._slots, self._shards = [1], [set()]
             return {}
 
-    def _save(self):
+        self._heap_path = HEAP_FILES[heap]
+        return entries
+
+    def _load_flash_db(self):
+        """Take over a vault written by the out-of-core backend."""
+        import flash_store  # imported here: flash_store builds on this module
+        entries, self._epoch, self.schema, heap = flash_store.load_entries(self)
+        self._migrate_format = True
+        self._heap_path = HEAP_FILES[heap]
+        self._reshard(_shard_count(len(entries)), entries)
+        return entries
+
+    def _read_shard(self, f, path: str, header):
+        """Decrypt and parse one shard file. Returns (entries, heap, schema)."""
+        if header[:4] != vault_format.MAGIC:
+            raise ValueError("Not a vault shard")
+        version = header[4]
+        if version not in vault_format.READ_VERSIONS:
+            raise ValueError("Unsupported vault version")
+        # Decrypt chunk by chunk straight into the one buffer the
+        # parser reads from; the file is never held whole.
+        size = _file_size(path) - len(header)
+        if version >= vault_format.SEALED_VERSION:
+            payload = bytearray(size - SEAL_OVERHEAD)
+            length = SealDecryptor(self.master_key, f, size, bytes(header)).readinto(payload)
+        else:
+            payload = bytearray(size - BLOCK_SIZE)
+            length = CBCDecryptor(self.master_key, f).readinto(payload)
+        return vault_format.decode_snapshot(memoryview(payload)[:length], version)
+
+    def _load_legacy_db(self, data):
+        """Read a base64 + JSON snapshot and schedule its binary rewrite."""
         try:
-            plaintext = json.dumps(self.db)
-            encrypted = encrypt_aes_bytes(plaintext, self.master_key)
-            with open(KEYS_FILE, "w") as f:
-                f.write(encrypted)
-            print("💾 Vault saved successfully.")
-            return True
+            decrypted = decrypt_aes_bytes(base64_input=str(data, "utf-8").strip(), key=self.master_key)
+            data = json.loads(decrypted)
+        except Exception as e:
+            print("⚠️ Failed to load key store:", e)
+            return {}
+
+        self._migrate_format = True
+        self.schema = 0
+        if isinstance(data.get("entries"), dict) and data.get("heap") in HEAP_FILES:
+            self._heap_path = data["heap"]
+            data = data["entries"]
+        # else: snapshot from before secrets were sealed; migrated on load.
+        self._reshard(_shard_count(len(data)), data)
+        return data
+
+    def _save(self, grow: bool = True):
+        """
+        Rewrite the shards touched since the last save, then commit them by
+        swapping in a new manifest. The journal is folded in, so it is dropped.
+        """
+        self._close_heap()
+        if grow and _shard_count(len(self.db)) > len(self._shards):
+            self._reshard(_shard_count(len(self.db)))
+        entries, heap = self.db, self._heap_path
+        live = 0
+        for entry in self.db.values():
+            if isinstance(entry, dict) and entry.get("secret"):
+                live += entry["secret"][1]
+        rewrite = self._heap_size > HEAP_SLACK and self._heap_size > 2 * live
+
+        if rewrite:
+            self._dirty_shards.update(range(len(self._shards)))
+        slots = list(self._slots)
+        dirty = sorted(self._dirty_shards)
+        try:
+            if rewrite:
+                heap, entries, heap_size = self._rewrite_heap()
+            heap_index = HEAP_FILES.index(heap)
+            for number in dirty:
+                # Shards go to the slot the live manifest does not use, so a
+                # failed save leaves every file it references untouched.
+                slots[number] ^= 1
+                shard = {key: entries[key] for key in self._shards[number]}
+                payload = vault_format.encode_snapshot(shard, heap_index, self.schema)
+                del shard
+                with open(_shard_path(number, slots[number]), "wb") as f:
+                    encryptor = SealEncryptor(self.master_key, f,
+                                              vault_format.MAGIC + bytes((vault_format.VERSION,)))
+                    encryptor.write(payload)
+                    encryptor.close()
+                del payload
+            with open(KEYS_TMP_FILE, "wb") as f:
+                f.write(vault_format.encode_manifest(self._epoch + 1, self.schema, heap_index, slots))
+            try:
+                os.remove(KEYS_FILE)
+            except OSError:
+                pass
+            os.rename(KEYS_TMP_FILE, KEYS_FILE)
+            print(f"💾 Vault saved successfully ({len(dirty)}/{len(slots)} shards).")
         except Exception as e:
             print("❌ Failed to save vault:", e)
             return e
 
-    def _find_key(self, identifier: str):
-        """Resolve an entry by URL key first, then by alias for compatibility."""
-        if identifier in self.db:
-            return identifier
+        for number in dirty:
+            _try_remove(_shard_path(number, slots[number] ^ 1))
+        self._slots, self._epoch = slots, self._epoch + 1
+        self._dirty_shards = set()
+        if self._migrate_format:
+            _try_remove(FLASH_FILE)  # superseded if the vault came from there
+            self._migrate_format = False
+        if rewrite:
+            _try_remove(self._heap_path)
+            self.db, self._heap_path, self._heap_size = entries, heap, heap_size
+
+        # The journal belongs to the previous epoch now and is never
+        # replayed again, even if removing it fails.
+        _try_remove(JOURNAL_FILE)
+        self._journal_records = 0
+        self._journal_frames = 0
+        self._clear_pending()
+        return True
+
+    def reshard(self, count: int):
+        """
+        Spread the vault over count shard files and save. Returns True or the
+        error. A later save still grows the count past SHARD_TARGET per shard.
+        """
+        if not 1 <= count <= MAX_SHARDS:
+            raise ValueError(f"Shard count must be between 1 and {MAX_SHARDS}")
+        previous = len(self._slots)
+        self._reshard(count)
+        result = self._save(grow=False)
+        if result is not True:
+            return result
+        for number in range(count, previous):
+            for slot in (0, 1):
+                _try_remove(_shard_path(number, slot))
+        return result
+
+    def _reshard(self, count: int, entries=None):
+        """Reassign every key to one of count shards; all of them become dirty."""
+        entries = self.db if entries is None else entries
+        self._shards = [set() for _ in range(count)]
+        for key in entries:
+            self._shards[vault_format.shard_of(key, count)].add(key)
+        self._slots = (self._slots + [1] * count)[:count]
+        self._dirty_shards = set(range(count))
+
+    def _touch(self, key: str, present: bool):
+        """Track key in its shard and mark that shard for the next save."""
+        number = vault_format.shard_of(key, len(self._shards))
+        if present:
+            self._shards[number].add(key)
+        else:
+            self._shards[number].discard(key)
+        self._dirty_shards.add(number)
 
+    def _rewrite_heap(self):
+        """Copy live sealed secrets into the other heap file, dropping garbage.
+
+        Returns (heap_path, entries_with_new_refs, heap_size). Nothing in
+        memory changes until the snapshot that references it is in place.
+        """
+        rewrite = HeapRewrite(self._heap_path)
+        try:
+            entries = {key: rewrite.move(entry) for key, entry in self.db.items()}
+        finally:
+            rewrite.close()
+        return rewrite.path, entries, rewrite.size
+
+    def _append_secret(self, blob) -> list:
+        """Append one sealed blob to the heap and return its [offset, length]."""
+        offset = self._heap_size
+        if self._undo is not None:
+            if self._heap_out is None:
+                self._heap_out = open(self._heap_path, "ab")
+            self._heap_out.write(blob)
+        else:
+            with open(self._heap_path, "ab") as f:
+                f.write(blob)
+        self._heap_size += len(blob)
+        return [offset, len(blob)]
+
+    def _close_heap(self):
+        if self._heap_out is not None:
+            self._heap_out.close()
+            self._heap_out = None
+
+    def _seal(self, key: str, entry: dict) -> dict:
+        """
+        Move the plaintext secret fields of entry into a sealed heap blob.
+        The blob carries key, so it only unseals for the entry it was
+        written for.
+        """
+        sealed = {}
+        secret = {}
+        for field, value in entry.items():
+            if field in SECRET_FIELDS:
+                secret[field] = value
+            elif field != "secret":
+                sealed[field] = value
+        blob = seal(json.dumps([key, secret]).encode("utf-8"), self.master_key, vault_format.HEAP_MAGIC)
+        sealed["secret"] = self._append_secret(blob)
+        return sealed
+
+    def _read_secret(self, ref, heap=None):
+        """Read the heap blob at ref = [offset, length]."""
+        offset, length = ref
+        if heap is None:
+            if self._heap_out is not None:
+                self._heap_out.flush()
+            with open(self._heap_path, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+        heap.seek(offset)
+        return heap.read(length)
+
+    def _unseal(self, key: str, entry, heap=None):
+        """Return a plaintext copy of the entry under key with its secret fields decrypted."""
+        if not isinstance(entry, dict) or not entry.get("secret"):
+            return entry
+
+        plain = dict(entry)
+        blob = self._read_secret(plain.pop("secret"), heap)
+        if is_sealed(blob, vault_format.HEAP_MAGIC):
+            owner, secret = json.loads(str(unseal(blob, self.master_key, vault_format.HEAP_MAGIC), "utf-8"))
+            if owner != key:
+                raise ValueError("Secret of another entry")
+        elif self.schema < SEALED_SCHEMA:
+            # Until _seal_heap_secrets ran.
+            secret = json.loads(str(decrypt_aes_raw(blob, self.master_key), "utf-8"))
+        else:
+            raise ValueError("Unsealed secret in the heap")
+        plain.update(secret)
+        return plain
+
+    def _rekey(self, old_key: str, key: str, entry) -> None:
+        """Move entry from old_key to key; its secret is resealed for key."""
+        entry = self._unseal(old_key, entry)
+        self._remove(old_key)
+        self._put(key, entry)
+
+    def content_generation(self):
+        """
+        Identify what is on flash without decrypting it: the manifest (its
+        epoch is bumped on every save) plus the sizes of the journal
+        (append-only between saves) and the active heap.
+        """
+        try:
+            with open(KEYS_FILE, "rb") as f:
+                manifest = f.read()
+        except OSError:
+            manifest = b""
+        return (bytes(manifest), _file_size(JOURNAL_FILE),
+                self._heap_path, _file_size(self._heap_path))
+
+    def lock(self):
+        """
+        Forget the master key and the parsed index. Nothing decrypted stays
+        in RAM; unlock() reloads the index when nothing on flash changed
+        meanwhile. Deferred changes must be flushed first.
+        """
+        if self.master_key is None:
+            return
+        self._close_heap()
+        self._lock_stamp = (sha256(bytes(self.master_key)).digest(),
+                            self.content_generation())
+        self._locked_count = len(self.db)
+        self._lock_index()
+        self.master_key = None
+        clear_cipher_cache()
+
+    def _lock_index(self):
+        self.db = {}
+        self._shards = [set() for _ in self._shards]
+        self._rebuild_index()
+
+    def _unlock_index(self):
+        """
+        Reload the index lock() dropped; raises if it cannot. Resealing it
+        in RAM instead cost more than reading the shards again.
+        """
+        self.db = self._load_db()
+        self._journal_records = self._journal_frames = 0
+        if not self._replay_journal() or len(self.db) != self._locked_count:
+            raise ValueError("Vault files unreadable")
+        self._rebuild_index()
+
+    def unlock(self, master_key) -> bool:
+        """Re-attach the master key. False means the store must be reloaded."""
+        if self._lock_stamp is None:
+            return False
+        digest, stamp = self._lock_stamp
+        if (sha256(bytes(master_key)).digest() != digest
+                or self.content_generation() != stamp):
+            return False
+        self.master_key = master_key
+        try:
+            self._unlock_index()
+        except Exception as e:
+            print("⚠️ Locked vault index unreadable:", e)
+            self.master_key = None
+            return False
+        self._lock_stamp = None
+        return True
+
+    def compact(self):
+        """Fold the mutation journal back into the snapshot."""
+        if not self._journal_records:
+            return True
+        return self._save()
+
+    def _replay_journal(self) -> bool:
+        """Apply journaled mutations on top of the loaded snapshot.
+
+        Returns False if replay stopped early on an unreadable record.
+        """
+        try:
+            f = open(JOURNAL_FILE, "rb")
+        except OSError:
+            return True
+
+        heap = HEAP_FILES.index(self._heap_path)
+        with f:
+            magic = f.read(4)
+            sealed = magic == vault_format.JOURNAL_MAGIC
+            if not sealed and self.schema >= SEALED_SCHEMA:
+                print("⚠️ Journal not replayed: its records are not sealed")
+                return False
+            if sealed or magic == vault_format.UNSEALED_JOURNAL_MAGIC:
+                epoch = f.read(4)
+                if len(epoch) != 4 or struct.unpack(">I", epoch)[0] != self._epoch:
+                    # Written before the last save: already in the shards.
+                    f.close()
+                    _try_remove(JOURNAL_FILE)
+                    return True
+                if not sealed:
+                    self._migrate_format = True
+            elif magic == vault_format.LEGACY_JOURNAL_MAGIC:
+                self._migrate_format = True
+            else:
+                return self._replay_legacy_journal()
+
+            while True:
+                header = f.read(2)
+                if not header:
+                    return True
+                try:
+                    length = struct.unpack(">H", header)[0]
+                    frame = f.read(length)
+                    if len(frame) != length:
+                        raise ValueError("Truncated record")
+                    if sealed:
+                        record = unseal(frame, self.master_key, vault_format.FRAME_TAG)
+                        if struct.unpack_from(">II", record) != (self._epoch, self._journal_frames):
+                            raise ValueError("Frame out of place")
+                        record = record[8:]
+                    else:
+                        record = decrypt_aes_raw(frame, self.master_key)
+                    op, record_heap, key, entry = vault_format.decode_record(record)
+                except Exception as e:
+                    # A torn append at the tail is expected after power loss.
+                    print("⚠️ Journal replay stopped at a bad record:", e)
+                    return False
+
+                self._journal_frames += 1
+                if record_heap != heap:
+                    continue  # already folded into a snapshot with a newer heap
+                if op == vault_format.OP_PUT:
+                    self.db[key] = entry
+                elif op == vault_format.OP_DEL:
+                    self.db.pop(key, None)
+                self._touch(key, op == vault_format.OP_PUT)
+                self._journal_records += 1
+
+    def _replay_legacy_journal(self) -> bool:
+        """Replay a base64-per-line journal; the binary rewrite follows."""
+        self._migrate_format = True
+        with open(JOURNAL_FILE, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(decrypt_aes_bytes(base64_input=line, key=self.master_key))
+                    op, key = record["op"], record["key"]
+                except Exception as e:
+                    # A torn append at the tail is expected after power loss.
+                    print("⚠️ Journal replay stopped at a bad record:", e)
+                    return False
+
+                if record.get("heap", self._heap_path) != self._heap_path:
+                    continue  # already folded into a snapshot with a newer heap
+                if op == "put":
+                    self.db[key] = record["entry"]
+                elif op == "del":
+                    self.db.pop(key, None)
+                self._touch(key, op == "put")
+                self._journal_records += 1
+        return True
+
+    def transaction(self):
+        """
+        Group several mutations into one all-or-nothing snapshot write:
+
+            with vault.transaction():
+                vault.add(...)
+                vault.delete(...)
+
+        Nested transactions join the outermost one.
+        """
+        return Transaction(self)
+
+    def _begin(self):
+        if self._txn_depth == 0:
+            self._undo = {}
+        self._txn_depth += 1
+
+    def _commit(self):
+        self._txn_depth -= 1
+        if self._txn_depth:
+            return
+        self._close_heap()
+        if self._undo and self.write_behind:
+            self._needs_snapshot = True
+            self._mark_dirty(len(self._undo))
+        elif self._undo:
+            result = self._save()
+            if result is not True:
+                self._rollback_undo()
+                raise result
+        self._undo = None
+
+    def _rollback(self):
+        self._txn_depth -= 1
+        if not self._txn_depth:
+            self._close_heap()
+            self._rollback_undo()
+
+    def _rollback_undo(self):
+        self.generation += 1
+        for key, entry in self._undo.items():
+            current = self.db.pop(key, _MISSING)
+            if current is not _MISSING:
+                self._index_remove(key, current)
+            if entry is not _MISSING:
+                self.db[key] = entry
+                self._index_add(key, entry)
+            self._touch(key, entry is not _MISSING)
+        self._undo = None
+
+    def _rebuild_index(self):
+        """Build the alias and prefix indexes from scratch (once per load)."""
+        self.generation += 1
+        self._alias_index = {}
+        self._accounts = {}  # URL -> [keys], one per username
+        self._by_domain = {}  # normalized host -> [keys]
+        self._by_alias = None  # one sort below is cheaper than N inserts
         for key, entry in self.db.items():
-            if isinstance(entry, dict) and entry.get("alias") == identifier:
-                return key
+            self._index_add(key, entry)
+        self._by_alias = sorted(self.db, key=self._alias_order)
+        self._by_host = sorted(self.db, key=self._host_order)
 
-        return None
+    # The prefix indexes are lists of keys sorted by (term, key). Terms are
+    # derived from self.db on each comparison instead of being stored, so
+    # the lists cost one reference per entry.
+    def _alias_order(self, key: str):
+        return _alias_term(key, self.db[key]), key
 
-    def _normalize_loaded_db(self):
-        """Migrate legacy alias-keyed entries into URL-keyed entries."""
-        normalized = {}
-        changed = False
+    def _host_order(self, key: str):
+        return _host_term(key, self.db[key]), key
 
-        for old_key, entry in self.db.items():
-            if not isinstance(entry, dict):
-                normalized[old_key] = entry
-                continue
+    def _index_add(self, key: str, entry):
+        if self._by_alias is not None:
+            for keys, term in ((self._by_alias, _alias_term), (self._by_host, _host_term)):
+                target = (term(key, entry), key)
+                keys.insert(bisect_left(keys, target, lambda k: (term(k, self.db[k]), k)), key)
+
+        for index, term in ((self._by_domain, _host_term(key, entry)),
+                            (self._accounts, split_account_key(key)[0])):
+            keys = index.get(term)
+            if keys is None:
+                index[term] = [key]
+            elif key not in keys:
+                keys.append(key)
+
+        if not isinstance(entry, dict) or not entry.get("alias"):
+            return
+        keys = self._alias_index.get(entry["alias"])
+        if keys is None:
+            self._alias_index[entry["alias"]] = [key]
+        elif key not in keys:
+            keys.append(key)
+
+    def _index_remove(self, key: str, entry):
+        for keys, term in ((self._by_alias, _alias_term), (self._by_host, _host_term)):
+            # key may already be gone from self.db; compare it by entry.
+            target = (term(key, entry), key)
+            i = bisect_left(keys, target,
+                            lambda k: target if k == key else (term(k, self.db[k]), k))
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+        for index, term in ((self._by_domain, _host_term(key, entry)),
+                            (self._accounts, split_account_key(key)[0])):
+            keys = index.get(term)
+            if keys and key in keys:
+                keys.remove(key)
+                if not keys:
+                    del index[term]
+
+        if not isinstance(entry, dict) or not entry.get("alias"):
+            return
+        keys = self._alias_index.get(entry["alias"])
+        if keys and key in keys:
+            keys.remove(key)
+            if not keys:
+                del self._alias_index[entry["alias"]]
+
+    def _put(self, key: str, entry):
+        """Store one entry and persist it (deferred inside a transaction)."""
+        if isinstance(entry, dict) and any(field in entry for field in SECRET_FIELDS):
+            entry = self._seal(key, entry)
+        previous = self.db.get(key, _MISSING)
+        if self._undo is not None and key not in self._undo:
+            self._undo[key] = previous
+        self.generation += 1
+        if previous is not _MISSING:
+            self._index_remove(key, previous)
+        self.db[key] = entry
+        self._index_add(key, entry)
+        self._touch(key, True)
+        return self._log("put", key, entry)
+
+    def _remove(self, key: str):
+        """Drop one entry and persist it (deferred inside a transaction)."""
+        entry = self.db.pop(key)
+        if self._undo is not None and key not in self._undo:
+            self._undo[key] = entry
+        self.generation += 1
+        self._index_remove(key, entry)
+        self._touch(key, False)
+        self._log("del", key)
+        return entry
 
-            url = entry.get("url", "").strip()
-            alias = entry.get("alias")
+    def _log(self, op: str, key: str, entry=None):
+        """Append one encrypted mutation record instead of rewriting the vault."""
+        if self._undo is not None:
+            return True  # the transaction commit writes a full snapshot
 
-            if not alias:
-                alias = old_key
-                entry["alias"] = alias
-                changed = True
+        record = vault_format.encode_record(
+            vault_format.OP_PUT if op == "put" else vault_format.OP_DEL,
+            HEAP_FILES.index(self._heap_path), key, entry)
 
-            if url:
-                if url != old_key:
+        if self.write_behind:
+            if not self._needs_snapshot:  # a pending snapshot covers it
+                self._pending.append(record)
+            self._mark_dirty(1)
+            return True
+        return self._append_journal((record,))
+
+    def _append_journal(self, records):
+        """Seal and append records to the journal with one file open."""
+        try:
+            fresh = not _file_size(JOURNAL_FILE)
+            with open(JOURNAL_FILE, "ab") as f:
+                if fresh:
+                    f.write(vault_format.JOURNAL_MAGIC)
+                    f.write(struct.pack(">I", self._epoch))
+                    self._journal_frames = 0
+                for record in records:
+                    frame = seal(struct.pack(">II", self._epoch, self._journal_frames) + record,
+                                 self.master_key, vault_format.FRAME_TAG)
+                    f.write(struct.pack(">H", len(frame)))
+                    f.write(frame)
+                    self._journal_frames += 1
+        except Exception as e:
+            print("❌ Failed to append to journal:", e)
+            # Frames after a torn one would never replay: snapshot instead.
+            result = self._save()
+            return True if result is True else e
+
+        self._journal_records += len(records)
+        if self._journal_records >= COMPACT_THRESHOLD:
+            return self.compact()
+        return True
+
+    def _mark_dirty(self, changes: int):
+        now = time.monotonic()
+        if self._dirty_since is None:
+            self._dirty_since = now
+        self._last_change = now
+        self._pending_changes += changes
+
+    def _clear_pending(self):
+        self._pending = []
+        self._needs_snapshot = False
+        self._pending_changes = 0
+        self._dirty_since = None
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty_since is not None
+
+    def flush(self):
+        """Persist everything deferred by write-behind. Returns True or the error."""
+        if self._needs_snapshot:
+            return self._save()
+        if not self._pending:
+            self._clear_pending()
+            return True
+
+        result = self._append_journal(self._pending)
+        if result is True:
+            self._clear_pending()
+            print("💾 Vault changes flushed.")
+        return result
+
+    def flush_if_due(self, now=None):
+        """
+        Called from the main loop: flush once mutations have paused for
+        IDLE_FLUSH_DELAY, or unconditionally after MAX_UNFLUSHED.
+        """
+        if self._dirty_since is None:
+            return True
+        now = time.monotonic() if now is None else now
+        if (now - self._last_change >= IDLE_FLUSH_DELAY
+                or now - self._dirty_since >= MAX_UNFLUSHED):
+            return self.flush()
+        return True
+
+    def status(self) -> dict:
+        """Persistence state for the `status` command."""
+        age = 0 if self._dirty_since is None else time.monotonic() - self._dirty_since
+        return {
+            "entries": len(self.db),
+            "schema": self.schema,
+            "migrations": [(name, round(secs * 1000)) for name, _, secs in self.migrations],
+            "pending_changes": self._pending_changes,
+            "unflushed_for": round(age, 1),
+            "journal_records": self._journal_records,
+            "shards": len(self._slots),
+            "write_behind": self.write_behind,
+        }
+
+    def _find_key(self, identifier: str, username=None):
+        """
+        Resolve an entry by key, then by URL, then by alias. username picks
+        one account when several match; without it, several matches raise
+        AmbiguousSite.
+        """
+        if identifier in self.db:
+            keys = [identifier]
+        else:
+            keys = self._url_keys(identifier) or self._alias_keys(identifier)
+        return self._pick(identifier, keys, username)
+
+    def _url_keys(self, url: str):
+        return list(self._accounts.get(url, ()))
+
+    def _alias_keys(self, alias: str):
+        return list(self._alias_index.get(alias, ()))
+
+    def _pick(self, site: str, keys, username=None):
+        if username is not None:
+            keys = [key for key in keys if split_account_key(key)[1] == username]
+        if len(keys) > 1:
+            raise AmbiguousSite(site, [(self._alias_of(key), key) for key in keys])
+        return keys[0] if keys else None
+
+    def _alias_of(self, key: str) -> str:
+        entry = self.db[key]
+        return entry.get("alias", key) if isinstance(entry, dict) else key
+
+    def accounts(self, site: str):
+        """(username, key) of every account registered under a key, URL or alias."""
+        if site in self.db:
+            keys = [site]
+        else:
+            keys = self._url_keys(site) or self._alias_keys(site)
+        return sorted((split_account_key(key)[1], key) for key in keys)
+
+    def _run_migrations(self) -> bool:
+        """
+        Bring a loaded vault up to SCHEMA_VERSION. Each step runs once, in
+        order, and is skipped on later loads because the snapshot records the
+        schema it reached. Returns True if any step ran.
+        """
+        for version, name in MIGRATIONS:
+            if self.schema >= version:
+                continue
+            start = time.monotonic()
+            getattr(self, name)()
+            self.schema = version
+            elapsed = time.monotonic() - start
+            self.migrations.append((name, version, elapsed))
+            print(f"🔧 Vault migrated to schema {version} ({name}) in {elapsed * 1000:.0f} ms")
+        return bool(self.migrations)
+
+    def _normalize_loaded_db(self):
+        """
+        Migrate legacy alias-keyed entries into URL-keyed entries and seal
+        plaintext secrets left over from older vaults.
+        """
+        with self.transaction():
+            for old_key, entry in list(self.db.items()):
+                if not isinstance(entry, dict):
+                    continue
+
+                url = entry.get("url", "").strip()
+                changed = any(field in entry for field in SECRET_FIELDS)
+                if not entry.get("alias"):
                     changed = True
-                normalized[url] = entry
-            else:
+                    entry = dict(entry)
+                    entry["alias"] = old_key
+
                 # Keep malformed/legacy records reachable even without URL.
-                normalized[old_key] = entry
+                key = account_key(url, entry.get("username", "")) if url else old_key
+                if key != old_key:
+                    self._rekey(old_key, key, entry)
+                elif changed:
+                    self._put(old_key, entry)
 
-        if changed:
-            self.db = normalized
-            self._save()
+    def _migrate_account_keys(self):
+        """Re-key URL-keyed entries by (URL, username)."""
+        with self.transaction():
+            for old_key, entry in list(self.db.items()):
+                if not isinstance(entry, dict) or not entry.get("url"):
+                    continue
+                key = account_key(entry["url"].strip(), entry.get("username", ""))
+                if key != old_key:
+                    self._rekey(old_key, key, entry)
+
+    def _seal_heap_secrets(self):
+        """Reseal heap blobs written before the vault was authenticated."""
+        with self.transaction():
+            for key, entry in list(self.db.items()):
+                if not isinstance(entry, dict) or not entry.get("secret"):
+                    continue
+                try:
+                    if not is_sealed(self._read_secret(entry["secret"]), vault_format.HEAP_MAGIC):
+                        self._put(key, self._unseal(key, entry))
+                except Exception as e:
+                    print(f"⚠️ Secret of {key} left as it was:", e)
 
     def get_aliases(self):
-        aliases = []
-        for key, entry in self.db.items():
-            if isinstance(entry, dict):
-                aliases.append(entry.get("alias", key))
-            else:
-                aliases.append(key)
-        return aliases
+        """
+        Return an immutable alias view, sorted case-insensitively. It is
+        rebuilt only when `generation` has moved, so callers polling every
+        tick share one tuple.
+        """
+        if self._alias_view_generation != self.generation:
+            # One alias per group of accounts; pick one with accounts().
+            aliases = []
+            seen = set()
+            for key in self._by_alias:
+                alias = self._alias_of(key)
+                if alias not in seen:
+                    seen.add(alias)
+                    aliases.append(alias)
+            self._alias_view = tuple(aliases)
+            self._alias_view_generation = self.generation
+        return self._alias_view
+
+    def find(self, prefix: str, limit: int = 0):
+        """
+        Entries whose alias or host starts with prefix (case-insensitive),
+        as (alias, key) pairs; alias matches first. Binary search plus a
+        scan of the matches, so the cost follows the result size.
+        """
+        prefix = prefix.strip().lower()
+        found = []
+        seen = set()
+        for keys, term in ((self._by_alias, _alias_term), (self._by_host, _host_term)):
+            i = bisect_left(keys, (prefix, ""), lambda k: (term(k, self.db[k]), k))
+            while i < len(keys) and (not limit or len(found) < limit):
+                key = keys[i]
+                entry = self.db[key]
+                if not term(key, entry).startswith(prefix):
+                    break
+                if key not in seen:
+                    seen.add(key)
+                    found.append((self._alias_of(key), key))
+                i += 1
+        return found
+
+    def alias_position(self, prefix: str) -> int:
+        """Index in get_aliases() of the first alias at or after prefix."""
+        return bisect_left(self.get_aliases(), prefix.lower(), lambda alias: alias.lower())
+
+    # Cursor-style browsing, which the on-flash backend serves without
+    # holding every alias: the login screen keeps the alias it shows and
+    # asks for its neighbours.
+    def _view_position(self, alias: str):
+        """(index in get_aliases(), found) of alias or of where it would go."""
+        aliases = self.get_aliases()
+        i = self.alias_position(alias)
+        j = i
+        while j < len(aliases) and aliases[j].lower() == alias.lower():
+            if aliases[j] == alias:
+                return j, True
+            j += 1
+        return i, False
+
+    def iter_aliases(self, start: str = ""):
+        """get_aliases() from the first alias at or after start on."""
+        aliases = self.get_aliases()
+        for i in range(self.alias_position(start), len(aliases)):
+            yield aliases[i]
 
-    def get(self, site):
-        entry_key = self._find_key(site)
+    def first_alias(self, prefix: str = ""):
+        """The first alias at or after prefix, else the last one; None if empty."""
+        aliases = self.get_aliases()
+        if not aliases:
+            return None
+        return aliases[min(self._view_position(prefix)[0], len(aliases) - 1)]
+
+    def alias_after(self, alias: str):
+        """The alias following alias, wrapping around; None if empty."""
+        aliases = self.get_aliases()
+        if not aliases:
+            return None
+        i, found = self._view_position(alias)
+        return aliases[(i + 1 if found else i) % len(aliases)]
+
+    def alias_before(self, alias: str):
+        """The alias preceding alias, wrapping around; None if empty."""
+        aliases = self.get_aliases()
+        if not aliases:
+            return None
+        return aliases[self._view_position(alias)[0] - 1]
+
+    def initials(self):
+        """Distinct first letters of the aliases, in get_aliases() order."""
+        letters = []
+        i = 0
+        while i < len(self._by_alias):
+            term = self._alias_order(self._by_alias[i])[0]
+            if not term:
+                i += 1
+                continue
+            letters.append(term[0])
+            # Skip every alias sharing this first letter in one search.
+            i = bisect_left(self._by_alias, (chr(ord(term[0]) + 1), ""), self._alias_order)
+        return letters
+
+    def match_domain(self, site: str):
+        """
+        Keys registered under the longest domain suffix of site, ignoring
+        scheme, "www.", port and path: login.accounts.example.com finds
+        https://example.com. One lookup per label.
+        """
+        host = normalize_host(site)
+        while host:
+            keys = self._by_domain.get(host)
+            if keys:
+                return list(keys)
+            dot = host.find(".")
+            host = host[dot + 1:] if dot >= 0 else ""
+        return []
+
+    def _resolve(self, site: str, username=None):
+        """_find_key, falling back to the domain-suffix match."""
+        entry_key = self._find_key(site, username)
+        if entry_key:
+            return entry_key
+        return self._pick(site, self.match_domain(site), username)
+
+    def get(self, site, username=None):
+        """
+        Return a plaintext copy of the entry; its secret is decrypted here.
+        username selects one of several accounts on the site; AmbiguousSite
+        is raised when the choice is left open.
+        """
+        entry_key = self._resolve(site, username)
         if not entry_key:
             return None
-        return self.db.get(entry_key)
+        return self._unseal(entry_key, self.db.get(entry_key))
 
     def add(self, site: str, url: str, username: str,
             password: str, note: str = "") -> None:
@@ -96,69 +1045,49 @@ class KeyStore:
         if not url:
             raise ValueError("URL is required")
 
-        self.db[url] = {
+        entry = {
             "alias": site,
             "url": url,
             "username": username,
             "password": password,
             "note": note,
         }
-        self._save()
+        self._put(account_key(url, username), entry)
 
     def import_csv(self, csv_blob: str, *, skip_duplicates=False):
+        """Import rows with a single vault write; nothing is kept if it fails."""
         added, updated, skipped = [], [], []
 
-        for row_no, row in enumerate(csv_reader(csv_blob), 1):
-            if len(row) < 4:              # note is optional
-                skipped.append(f"line {row_no} (have {len(row)} cols)")
-                continue
+        with self.transaction():
+            for row_no, row in enumerate(csv_reader(csv_blob), 1):
+                if len(row) < 4:              # note is optional
+                    skipped.append(f"line {row_no} (have {len(row)} cols)")
+                    continue
 
-            name, url, user, pwd, *note = row
-            note = note[0] if note else ""
+                name, url, user, pwd, *note = row
+                note = note[0] if note else ""
 
-            if skip_duplicates and url in self.db:
-                skipped.append(url)
-                continue
+                key = account_key(url.strip(), user)
+                if skip_duplicates and key in self.db:
+                    skipped.append(url)
+                    continue
 
-            (updated if url in self.db else added).append(name)
-            self.add(name, url, user, pwd, note)
+                (updated if key in self.db else added).append(name)
+                self.add(name, url, user, pwd, note)
 
         return added, updated, skipped
-    
-    # def import_csv(self, csv_blob: str, *, skip_duplicates=False):
-    #     added, updated, skipped = [], [], []
-
-    #     for row_no, row in enumerate(csv_reader(csv_blob), 1):
-    #         if len(row) < 4:
-    #             skipped.append(f"line {row_no} (have {len(row)} cols)")
-    #             continue
-
-    #         name, url, user, pwd, *note = row
-    #         note = note[0] if note else ""
-
-    #         if skip_duplicates and name in self.db:
-    #             skipped.append(name)
-    #             continue
-
-    #         (updated if name in self.db else added).append(name)
-    #         self.db[name] = {"url": url, "username": user, "password": pwd, "note": note}
 
-    #     # Save once
-    #     self._save()
-    #     return added, updated, skipped
-    
-    def delete(self, domain: str) -> bool:
-        key = self._find_key(domain)
-        if key in self.db:
-            del self.db[key]
-            self._save()
+    def delete(self, domain: str, username=None) -> bool:
+        key = self._find_key(domain, username)
+        if key is not None and key in self.db:
+            self._remove(key)
             return True
         else:
             return False
     
-    def update(self, site: str, updates_string: str) -> bool:
+    def update(self, site: str, updates_string: str, username=None) -> bool:
         """Update an existing credential."""
-        entry_key = self._find_key(site)
+        entry_key = self._find_key(site, username)
         if not entry_key:
             return False
 
@@ -167,19 +1096,43 @@ class KeyStore:
         if not parsed_updates:
             return False
 
+        updates = {}
         for item_str in parsed_updates[0]: # Assuming a single row of updates
             if ':' not in item_str:
                 continue
             
             field, value = item_str.split(":", 1) # Split only on the first colon in case value has colons
-            self.db[entry_key][field.strip()] = value.strip()
+            updates[field.strip()] = value.strip()
 
-        # Keep URL as the database key if URL was updated.
-        new_url = self.db[entry_key].get("url", "").strip()
-        if new_url and new_url != entry_key:
-            self.db[new_url] = self.db.pop(entry_key)
+        # Only touch the sealed secret when a secret field actually changes.
+        if any(field in updates for field in SECRET_FIELDS):
+            entry = self._unseal(entry_key, self.db[entry_key])
+        else:
+            entry = dict(self.db[entry_key])
+        entry.update(updates)
 
-        self._save()
+        # Keep (URL, username) as the database key if either was updated. The
+        # rename is a delete plus a put, so it must not be journaled half-way.
+        new_url = entry.get("url", "").strip()
+        new_key = account_key(new_url, entry.get("username", "")) if new_url else entry_key
+        if new_key != entry_key:
+            if new_key in self.db:
+                url, username = split_account_key(new_key)
+                raise ValueError(f"{url} already has an account for {username or 'no username'}")
+            with self.transaction():
+                self._rekey(entry_key, new_key, entry)
+        else:
+            self._put(entry_key, entry)
+        return True
+
+    def set_password(self, site: str, password: str, username=None) -> bool:
+        """Replace the password of an existing credential."""
+        entry_key = self._find_key(site, username)
+        if not entry_key:
+            return False
+        entry = self._unseal(entry_key, self.db[entry_key])
+        entry["password"] = password
+        self._put(entry_key, entry)
         return True
 
     def backup(self, key_bytes: bytes) -> str:
@@ -189,8 +1142,20 @@ class KeyStore:
         if not key_bytes:
             raise ValueError("Backup key is not set.")
 
-        plaintext = json.dumps(self.db)
-        return encrypt_aes_bytes(plaintext=plaintext, key=key_bytes)
+        # Backups must open on another device, so secrets leave unsealed.
+        self._close_heap()
+        try:
+            heap = open(self._heap_path, "rb")
+        except OSError:
+            heap = None
+        try:
+            plain = {key: self._unseal(key, entry, heap) for key, entry in self.db.items()}
+        finally:
+            if heap is not None:
+                heap.close()
+
+        sealed = seal(json.dumps(plain).encode("utf-8"), key_bytes)
+        return binascii.b2a_base64(sealed).decode("utf-8").strip()
 
     def restore(self, key_bytes: bytes, encrypted_blob: str, *, overwrite: bool = False):
         """
@@ -204,7 +1169,8 @@ class KeyStore:
               - new keys are added
           - If overwrite=True, always replaces entire DB.
 
-        Persists restored/merged DB encrypted with self.master_key via _save().
+        Persists restored/merged DB encrypted with self.master_key in a single
+        transaction, so a failed write leaves the current vault untouched.
 
         Returns:
           dict with counts: {"added": int, "updated": int, "total_in_backup": int}
@@ -214,8 +1180,17 @@ class KeyStore:
         if not encrypted_blob:
             raise ValueError("Restore blob is missing.")
 
-        # 1) Decrypt backup payload with backup key
-        decrypted = decrypt_aes_bytes(base64_input=encrypted_blob, key=key_bytes)
+        # 1) Check and decrypt backup payload with backup key. A wrong key
+        #    or a damaged blob fails here, before any JSON is parsed.
+        try:
+            data = binascii.a2b_base64(encrypted_blob)
+        except Exception as e:
+            raise ValueError("Restore blob is not valid base64.") from e
+        if is_sealed(data):
+            decrypted = str(unseal(data, key_bytes), "utf-8")
+        else:
+            # Backup taken before blobs were sealed.
+            decrypted = decrypt_aes_bytes(base64_input=encrypted_blob, key=key_bytes)
 
         # 2) Parse JSON
         try:
@@ -231,9 +1206,12 @@ class KeyStore:
 
         # 3) Decide strategy: replace vs merge
         if overwrite or not self.db:
-            self.db = backup_db
-            self._save()
-            self._normalize_loaded_db()
+            with self.transaction():
+                for site in list(self.db):
+                    self._remove(site)
+                for site, entry in backup_db.items():
+                    self._put(_backup_key(site, entry), entry)
+                self._normalize_loaded_db()
             return {
                 "added": len(backup_db),
                 "updated": 0,
@@ -245,20 +1223,94 @@ class KeyStore:
         added = 0
         updated = 0
 
-        for site, entry in backup_db.items():
-            if site in self.db:
+        with self.transaction():
+            for site, entry in backup_db.items():
                 # Update entire entry (simpler + deterministic)
-                self.db[site] = entry
-                updated += 1
-            else:
-                self.db[site] = entry
-                added += 1
-
-        self._save()
-        self._normalize_loaded_db()
+                site = _backup_key(site, entry)
+                if site in self.db:
+                    updated += 1
+                else:
+                    added += 1
+                self._put(site, entry)
+            self._normalize_loaded_db()
         return {
             "added": added,
             "updated": updated,
             "total_in_backup": len(backup_db),
             "mode": "merge",
-        }
\ No newline at end of file
+        }
+
+class HeapRewrite:
+    """
+    Copies sealed secrets from heap_path into the other heap file as
+    entries pass through move(), which returns the entry with its new
+    reference. Both backends compact the heap with it.
+    """
+    def __init__(self, heap_path: str):
+        self.path = HEAP_FILES[1] if heap_path == HEAP_FILES[0] else HEAP_FILES[0]
+        self.size = 0
+        self._src = open(heap_path, "rb")
+        try:
+            self._out = open(self.path, "wb")
+        except OSError:
+            self._src.close()
+            raise
+
+    def move(self, entry):
+        ref = entry.get("secret") if isinstance(entry, dict) else None
+        if not ref:
+            return entry
+        self._src.seek(ref[0])
+        self._out.write(self._src.read(ref[1]))
+        entry = dict(entry)
+        entry["secret"] = [self.size, ref[1]]
+        self.size += ref[1]
+        return entry
+
+    def close(self) -> None:
+        self._src.close()
+        self._out.close()
+
+def _backup_key(site: str, entry) -> str:
+    """Backups made before (URL, username) keys are keyed by URL alone."""
+    if isinstance(entry, dict) and entry.get("url", "").strip():
+        return account_key(entry["url"].strip(), entry.get("username", ""))
+    return site
+
+def _alias_term(key: str, entry) -> str:
+    alias = entry.get("alias") if isinstance(entry, dict) else None
+    return (alias or key).lower()
+
+def _host_term(key: str, entry) -> str:
+    url = entry.get("url") if isinstance(entry, dict) else None
+    return normalize_host(url or key)
+
+def _shard_count(entries: int) -> int:
+    """Smallest power of two keeping shards near SHARD_TARGET entries."""
+    count = 1
+    while count < MAX_SHARDS and entries > count * SHARD_TARGET:
+        count *= 2
+    return count
+
+def _shard_path(number: int, slot: int) -> str:
+    return SHARD_FILE.format(number, "ab"[slot])
+
+def vault_files():
+    """Every vault file currently on flash (manifest, shards, heaps, journal)."""
+    try:
+        names = os.listdir(VAULT_DIR)
+    except OSError:
+        return []
+    return [VAULT_DIR + "/" + name for name in names if name.startswith(VAULT_PREFIX)]
+
+def _file_size(path: str) -> int:
+    try:
+        return os.stat(path)[6]
+    except OSError:
+        return 0
+
+def _try_remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -2,16 +2,18 @@ import microcontroller, binascii, struct
 
 NVM = microcontroller.nvm
 MAGIC   = b"PSL1"
-VERSION = 1
+VERSION = 2
+READ_VERSIONS = (1, 2)
 
-HEADER_LEN = 4 + 1 + 1 + 1   # MAGIC + VER + slen + hlen
+HEADER_LEN_V1 = 4 + 1 + 1 + 1   # MAGIC + VER + slen + hlen
+HEADER_LEN = HEADER_LEN_V1 + 4   # + iterations (0: plain hash, see auth_manager)
 CRC_LEN    = 4
 
 def _slot_offset(slot: int, slot_size: int) -> int:
     return slot * slot_size
 
-def save_slot(slot: int, slot_size: int, salt: bytes, hsh: bytes):
-    """Save one (salt, hash) pair into a slot."""
+def save_slot(slot: int, slot_size: int, salt: bytes, hsh: bytes, iterations: int = 0):
+    """Save one (salt, hash) pair into a slot, with the stretching cost of hsh."""
     slen, hlen = len(salt), len(hsh)
     total_len = HEADER_LEN + slen + hlen + CRC_LEN
 
@@ -19,7 +21,7 @@ def save_slot(slot: int, slot_size: int, salt: bytes, hsh: bytes):
         raise ValueError("Slot too small for given salt/hash")
 
     buf = bytearray(total_len)
-    struct.pack_into(">4sBBB", buf, 0, MAGIC, VERSION, slen, hlen)
+    struct.pack_into(">4sBBBI", buf, 0, MAGIC, VERSION, slen, hlen, iterations)
     offset = HEADER_LEN
     buf[offset:offset+slen] = salt; offset += slen
     buf[offset:offset+hlen] = hsh;  offset += hlen
@@ -33,16 +35,25 @@ def save_slot(slot: int, slot_size: int, salt: bytes, hsh: bytes):
 
 def load_slot(slot: int, slot_size: int):
     """Load one (salt, hash) pair from a slot, verifying CRC."""
+    salt, hsh, _ = load_slot_record(slot, slot_size)
+    return salt, hsh
+
+def load_slot_record(slot: int, slot_size: int):
+    """Load (salt, hash, iterations) from a slot, verifying CRC."""
     base = _slot_offset(slot, slot_size)
     header = bytes(NVM[base:base+HEADER_LEN])
-    magic, ver, slen, hlen = struct.unpack(">4sBBB", header)
+    magic, ver, slen, hlen = struct.unpack(">4sBBB", header[:HEADER_LEN_V1])
 
     if magic != MAGIC:
         raise ValueError(f"Slot {slot}: invalid magic")
-    if ver != VERSION:
+    if ver not in READ_VERSIONS:
         raise ValueError(f"Slot {slot}: unsupported version")
+    # Version 1 slots have no iteration count: a plain hash.
+    header_len, iterations = HEADER_LEN_V1, 0
+    if ver >= 2:
+        header_len, iterations = HEADER_LEN, struct.unpack(">I", header[HEADER_LEN_V1:])[0]
 
-    total_len = HEADER_LEN + slen + hlen + CRC_LEN
+    total_len = header_len + slen + hlen + CRC_LEN
     data = bytes(NVM[base:base+total_len])
 
     crc_stored = struct.unpack(">I", data[-4:])[0]
@@ -50,10 +61,10 @@ def load_slot(slot: int, slot_size: int):
     if crc_calc != crc_stored:
         raise ValueError(f"Slot {slot}: CRC mismatch")
 
-    offset = HEADER_LEN
+    offset = header_len
     salt = data[offset:offset+slen]; offset += slen
     hsh  = data[offset:offset+hlen]
-    return salt, hsh
+    return salt, hsh, iterations
 
 def nvm_wipe():
     try:
@@ -3,16 +3,16 @@ import displayio
 import terminalio
 from adafruit_display_text import label
 from adafruit_displayio_ssd1306 import SSD1306
-import busio
 
 class Screen:
     def __init__(self, i2c=None, width=128, height=32, address=0x3C):
         # Release any previous displays
         displayio.release_displays()
 
-        # Initialize I2C if not provided
+        # Initialize I2C if not provided; the board singleton, so the
+        # ATECC608 probe in crypto_backend can share it
         if i2c is None:
-            i2c = busio.I2C(board.SCL, board.SDA)
+            i2c = board.I2C()
 
         # Initialize display bus
         display_bus = displayio.I2CDisplay(i2c, device_address=address)
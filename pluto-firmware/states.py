@@ -1,5 +1,6 @@
 import time
 from utils import generate_password
+from wordlist import generate_passphrase
 from encoder import PinEntryHelper
 
 MAX_ATTEMPTS = 3
@@ -199,16 +200,50 @@ class AuthState(BaseState):
         pass
 
 class LoginState(BaseState):
+    """
+    Scroll the aliases with the encoder and press to type the credentials.
+    An alias with several accounts opens a list of usernames first; RTR
+    leaves it. RTR switches to jump-by-letter: turning picks a first
+    letter, pressing jumps to the first alias with it, RTR again goes back
+    to the menu.
+
+    The alias on screen is kept in context.login_alias and its neighbours
+    are asked of the vault, so the list is never held whole.
+    """
     def enter(self):
+        self._vault = None
+        self._generation = -1
+        self._letters = None  # first letters while jumping, else None
+        self._letter_index = 0
+        self._accounts = None  # (username, key) while picking an account
+        self._account_index = 0
         self.draw_login_screen()
 
+    def _current_alias(self, vault):
+        """
+        The alias to show; looked up again only when the vault reports a
+        new generation, in case the one shown was removed meanwhile.
+        """
+        if vault is not self._vault or vault.generation != self._generation:
+            self._vault = vault
+            self._generation = vault.generation
+            self.context.login_alias = vault.first_alias(self.context.login_alias or "")
+        return self.context.login_alias
+
+    def _show_alias(self, alias):
+        self.context.login_alias = alias
+        self.context.screen.update("domain", alias)
+        return alias
+
     def draw_login_screen(self):
         self.context.screen.clear()
         self.context.screen.write("Login Page",line=1, identifier="login")
         if self.context.authenticator.authenticated:
             try:
                 vault = self.context.authenticator.get_vault()
-                domain = vault.get_aliases()[self.context.login_index]
+                domain = self._current_alias(vault)
+                if domain is None:
+                    raise ValueError("Vault is empty")
                 self.context.screen.write(domain, line=2, identifier="domain")
             except Exception as e:
                 self.context.screen.write("🔒 No credentials", line=2, identifier="domain")
@@ -223,36 +258,89 @@ class LoginState(BaseState):
                 return
 
             vault = self.context.authenticator.get_vault()
-            vault_keys = vault.get_aliases()
+            domain = self._current_alias(vault)
         except Exception as e:
             return
 
-        if not vault_keys:
+        if domain is None:
+            return
+
+        if self._letters is not None:
+            self._handle_jump(vault, direction)
+            return
+        if self._accounts is not None:
+            self._handle_accounts(vault, domain, direction)
             return
 
         if direction == "CW":
-            self.context.login_index = (self.context.login_index + 1) % len(vault_keys)
-            self.context.screen.update("domain", vault_keys[self.context.login_index])
+            domain = self._show_alias(vault.alias_after(domain))
         elif direction == "CCW":
-            self.context.login_index = (self.context.login_index - 1) % len(vault_keys)
-            self.context.screen.update("domain", vault_keys[self.context.login_index])
+            domain = self._show_alias(vault.alias_before(domain))
 
         if self.context.encoder.was_pressed():
-            domain = vault_keys[self.context.login_index]
-            creds = vault.get(domain)
-            self.context.usb.write(f"\U0001F511 Credentials for {domain}: {creds}")
-            if creds:
-                if (len(creds["username"]) > 0):
-                    time.sleep(0.2)
-                    self.context.processor.hid.type_text(creds["username"], delay=0.0)
-                    self.context.processor.hid.key_strokes("TAB")
-                time.sleep(0.1)
-                self.context.processor.hid.type_text(creds["password"], delay=0.0)
-                self.context.processor.hid.key_strokes("ENTER")
+            accounts = vault.accounts(domain)
+            if len(accounts) > 1:
+                self._accounts = accounts
+                self._account_index = 0
+                self._show_account()
+            elif accounts:
+                self._type_credentials(vault, domain, accounts[0][1])
 
         elif self.context.encoder.rtr_was_pressed():
-            self.context.transition_to(MenuState(self.context))
+            self._letters = vault.initials()
+            self._letter_index = 0
+            for i, letter in enumerate(self._letters):
+                if domain.lower().startswith(letter.lower()):
+                    self._letter_index = i
+                    break
+            self._show_letter()
+
+    def _type_credentials(self, vault, domain, key):
+        creds = vault.get(key)
+        self.context.usb.write(f"\U0001F511 Credentials for {domain}: {creds}")
+        if creds:
+            if (len(creds["username"]) > 0):
+                time.sleep(0.2)
+                self.context.processor.hid.type_text(creds["username"], delay=0.0)
+                self.context.processor.hid.key_strokes("TAB")
+            time.sleep(0.1)
+            self.context.processor.hid.type_text(creds["password"], delay=0.0)
+            self.context.processor.hid.key_strokes("ENTER")
+
+    def _show_account(self):
+        username = self._accounts[self._account_index][0] or "(no username)"
+        self.context.screen.update("domain", f"> {username}")
+
+    def _handle_accounts(self, vault, domain, direction):
+        if direction == "CW":
+            self._account_index = (self._account_index + 1) % len(self._accounts)
+            self._show_account()
+        elif direction == "CCW":
+            self._account_index = (self._account_index - 1) % len(self._accounts)
+            self._show_account()
 
+        if self.context.encoder.was_pressed():
+            self._type_credentials(vault, domain, self._accounts[self._account_index][1])
+        elif self.context.encoder.rtr_was_pressed():
+            self._accounts = None
+            self.context.screen.update("domain", domain)
+
+    def _show_letter(self):
+        self.context.screen.update("domain", f"Jump to: {self._letters[self._letter_index].upper()}")
+
+    def _handle_jump(self, vault, direction):
+        if direction == "CW":
+            self._letter_index = (self._letter_index + 1) % len(self._letters)
+            self._show_letter()
+        elif direction == "CCW":
+            self._letter_index = (self._letter_index - 1) % len(self._letters)
+            self._show_letter()
+
+        if self.context.encoder.was_pressed():
+            self._show_alias(vault.first_alias(self._letters[self._letter_index]))
+            self._letters = None
+        elif self.context.encoder.rtr_was_pressed():
+            self.context.transition_to(MenuState(self.context))
 
     def exit(self):
         pass
@@ -283,7 +371,8 @@ class PassLengthState(BaseState):
         pass
 
 class PassComplexState(BaseState):
-    COMPLEXITY_LEVELS = ["Numbers + Letters", "Numbers + Small + Special", "All Characters"]
+    COMPLEXITY_LEVELS = ["Numbers + Letters", "Numbers + Small + Special", "All Characters", "Passphrase"]
+    PASSPHRASE = 3  # index of the Diceware entry; its word count ignores the length
 
     def enter(self):
         self.draw_complexity()
@@ -303,8 +392,16 @@ class PassComplexState(BaseState):
             self.context.complexity_index = (self.context.complexity_index - 1) % len(self.COMPLEXITY_LEVELS)
             self.context.screen.update("complex_level", self.COMPLEXITY_LEVELS[self.context.complexity_index])
         if self.context.encoder.was_pressed():
-            self.context.password_generated = generate_password(self.context.password_length,
-                                                                  self.context.complexity_index)
+            if self.context.complexity_index == self.PASSPHRASE:
+                try:
+                    self.context.password_generated = generate_passphrase()
+                except ValueError as e:  # no wordlist.bin on the drive
+                    self.context.screen.update("complex_level", "No wordlist")
+                    print(f"⚠️ {e}")
+                    return
+            else:
+                self.context.password_generated = generate_password(self.context.password_length,
+                                                                      self.context.complexity_index)
             self.context.hid_output.type_text(self.context.password_generated, delay=0.1)
             self.context.transition_to(PassSaveState(self.context))
         elif self.context.encoder.rtr_was_pressed():
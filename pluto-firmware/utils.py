@@ -1,75 +1,251 @@
-import random
+import os
 
-def csv_reader(text: str,
+POOL_BYTES = 256  # random bytes fetched per refill of the entropy pool
+MAX_PASSWORD_LENGTH = 128  # longer requests are cut to this
+
+LETTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+LOWERCASE = "abcdefghijklmnopqrstuvwxyz"
+DIGITS = "0123456789"
+PUNCTUATION = "!@#$%^&*()-_=+[]{}|;:,.<>?/"
+
+# Character classes by complexity level; a password long enough gets at
+# least one character of every class of its level.
+PASSWORD_CLASSES = {
+    0: (LETTERS, DIGITS),  # Alphanumeric
+    1: (LOWERCASE, DIGITS, PUNCTUATION),  # Lowercase + symbols
+    2: (LETTERS, DIGITS, PUNCTUATION),  # Mixed
+}
+
+# CsvReader states
+_FIELD_START = 0  # nothing of the current field read yet
+_UNQUOTED = 1     # plain field, or what follows a closing quote
+_QUOTED = 2       # inside quotes
+
+class CsvReader:
+    """
+    Incremental CSV tokenizer: feed() it text in chunks of any size, then
+    close(); both return the rows completed so far as lists of strings.
+
+    Fields are found with str.find() and sliced out whole, so a chunk
+    costs a few scans in C rather than a Python step per character. A
+    field cut by a chunk boundary is kept as slices until it completes.
+
+    RFC-4180 rules supported:
+        • Fields separated by `delimiter`, records by \\n, \\r\\n or \\r
+        • A field starting with `quotechar` is quoted; inside it, the
+          delimiter and newlines are literal and a doubled quote ("") is one
+        • A quote inside an unquoted field is literal, and text after a
+          closing quote is appended as is (as the csv module does)
+        • A blank line is a record with one empty field; a final newline
+          does not start another record
+
+    With strip_fields, whitespace around every field is dropped, which
+    also allows blanks before an opening quote (a, "b"). tools/csv_check.py
+    checks the rules against the csv module and times the reader.
+    """
+    def __init__(self, delimiter: str = ",", quotechar: str = '"', strip_fields: bool = True):
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+        self.strip_fields = strip_fields
+        self._pending = ""    # text kept back until the next chunk decides it
+        self._parts = []      # slices of the field being read
+        self._row = []
+        self._state = _FIELD_START
+        self._skip_lf = False  # last chunk ended on a \r
+
+    def _end_field(self) -> None:
+        parts = self._parts
+        cell = parts[0] if len(parts) == 1 else "".join(parts)
+        self._row.append(cell.strip() if self.strip_fields else cell)
+        self._parts = []
+
+    def feed(self, chunk: str) -> list:
+        return self._parse(self._pending + chunk if self._pending else chunk, False)
+
+    def close(self) -> list:
+        """Finish the last record; an unterminated quote ends at EOF."""
+        rows = self._parse(self._pending, True)
+        if self._parts or self._row or self._state != _FIELD_START:
+            self._end_field()
+            rows.append(self._row)
+        self._row, self._state, self._skip_lf = [], _FIELD_START, False
+        return rows
+
+    def _parse(self, text: str, final: bool) -> list:
+        rows = []
+        delimiter, quotechar, parts = self.delimiter, self.quotechar, self._parts
+        state, n = self._state, len(text)
+        i = 0
+        if self._skip_lf and n:
+            self._skip_lf = False
+            if text[0] == "\n":
+                i = 1
+        lf = cr = -1  # next \n and \r at or after i, found lazily
+
+        while i < n:
+            if state == _FIELD_START:
+                if self.strip_fields:
+                    while i < n and text[i] in " \t":
+                        i += 1
+                    if i == n:
+                        break
+                if text[i] == quotechar:
+                    state = _QUOTED
+                    i += 1
+                    continue
+                state = _UNQUOTED
+
+            if state == _QUOTED:
+                j = text.find(quotechar, i)
+                if j < 0:
+                    parts.append(text[i:])
+                    i = n
+                    break
+                if j + 1 == n and not final:
+                    parts.append(text[i:j])
+                    i = j  # keep the quote: it may be the first of ""
+                    break
+                parts.append(text[i:j])
+                if j + 1 < n and text[j + 1] == quotechar:
+                    parts.append(quotechar)
+                    i = j + 2
+                else:
+                    state = _UNQUOTED
+                    i = j + 1
+                continue
+
+            # _UNQUOTED: up to the delimiter or the end of the line
+            if lf < i and lf != n:
+                lf = text.find("\n", i)
+                lf = n if lf < 0 else lf
+            if cr < i and cr != n:
+                cr = text.find("\r", i)
+                cr = n if cr < 0 else cr
+            eol = lf if lf < cr else cr
+            j = text.find(delimiter, i, eol)
+            if j >= 0:
+                parts.append(text[i:j])
+                self._end_field()
+                parts = self._parts
+                state = _FIELD_START
+                i = j + 1
+                continue
+            if eol == n:
+                parts.append(text[i:])
+                i = n
+                break
+            parts.append(text[i:eol])
+            self._end_field()
+            parts = self._parts
+            rows.append(self._row)
+            self._row = []
+            state = _FIELD_START
+            i = eol + 1
+            if text[eol] == "\r":
+                if i < n:
+                    if text[i] == "\n":
+                        i += 1
+                elif not final:
+                    self._skip_lf = True
+
+        self._state = state
+        self._pending = text[i:]
+        return rows
+
+def csv_reader(text,
                       delimiter: str = ",",
                       quotechar: str = '"',
                       strip_fields: bool = True):
     """
     A lightweight replacement for csv.reader suited for CircuitPython.
-    Yields each parsed row as a list of strings.
+    Yields each parsed row as a list of strings. `text` is a str or an
+    iterable of str chunks, such as a file opened in text mode; see
+    CsvReader for the rules.
+    """
+    reader = CsvReader(delimiter, quotechar, strip_fields)
+    for chunk in ((text,) if isinstance(text, str) else text):
+        yield from reader.feed(chunk)
+    yield from reader.close()
 
-    RFC-4180 rules supported:
-        • Fields separated by `delimiter`
-        • Fields may be quoted with `quotechar`
-        • Inside quoted fields, escape quotechar by doubling it ("")
-        • Newlines inside quoted fields are preserved
+class EntropyPool:
+    """
+    Random bytes fetched from `source` (os.urandom by default, or the
+    ATECC608's RNG) POOL_BYTES at a time into one reusable buffer, and
+    handed out as unbiased indices by rejection sampling.
     """
-    field = []
-    row = []
-    in_quotes = False
-    i = 0
-    length = len(text)
-
-    while i < length:
-        ch = text[i]
-
-        if ch == quotechar:
-            # Peek at next char to see if this is an escaped quote ("")
-            nxt = text[i + 1] if i + 1 < length else None
-            if in_quotes and nxt == quotechar:
-                field.append(quotechar)   # literal "
-                i += 1                    # skip the escape char
-            else:
-                in_quotes = not in_quotes  # enter / leave quoted field
-
-        elif ch == delimiter and not in_quotes:
-            # Field separator
-            cell = "".join(field)
-            if strip_fields:
-                cell = cell.strip()
-            row.append(cell)
-            field = []
-
-        elif (ch == "\n" or ch == "\r") and not in_quotes:
-            # End-of-line (handle \r, \n or \r\n)
-            cell = "".join(field)
-            if strip_fields:
-                cell = cell.strip()
-            row.append(cell)
-            field = []
-
-            if row:                       # skip completely blank lines
-                yield row
-            row = []
-
-            # If it's a CRLF pair, skip the second char
-            if ch == "\r" and i + 1 < length and text[i + 1] == "\n":
-                i += 1
+    def __init__(self, source=None, size: int = POOL_BYTES):
+        self._source = source or os.urandom
+        self._buf = bytearray(size)
+        self._pos = size  # empty until the first draw
+        self.refills = 0
 
-        else:
-            field.append(ch)
+    def _byte(self) -> int:
+        if self._pos >= len(self._buf):
+            self._buf[:] = self._source(len(self._buf))
+            self._pos = 0
+            self.refills += 1
+        self._pos += 1
+        return self._buf[self._pos - 1]
+
+    def randbelow(self, n: int) -> int:
+        """Uniform integer in [0, n), n <= 65536."""
+        if n <= 0 or n > 0x10000:
+            raise ValueError("randbelow() needs 0 < n <= 65536")
+        if n <= 0x100:
+            limit = 0x100 - 0x100 % n
+            while True:
+                value = self._byte()
+                if value < limit:
+                    return value % n
+        limit = 0x10000 - 0x10000 % n
+        while True:
+            value = (self._byte() << 8) | self._byte()
+            if value < limit:
+                return value % n
+
+    def choice(self, seq):
+        return seq[self.randbelow(len(seq))]
+
+    def choices(self, seq, count: int) -> list:
+        """count independent picks from seq (len(seq) <= 256), in one pass."""
+        n = len(seq)
+        limit = 0x100 - 0x100 % n
+        buf, pos, out = self._buf, self._pos, []
+        while len(out) < count:
+            if pos >= len(buf):
+                buf[:] = self._source(len(buf))
+                pos = 0
+                self.refills += 1
+            value = buf[pos]
+            pos += 1
+            if value < limit:
+                out.append(seq[value % n])
+        self._pos = pos
+        return out
 
-        i += 1
+    def shuffle(self, items: list, count: int = None) -> None:
+        """
+        Fisher-Yates, in place. With count, only the first count items are
+        sent to uniformly random places, which is all a shuffle changes
+        when the other items are independent picks anyway.
+        """
+        n = len(items)
+        for i in range(min(n - 1, n if count is None else count)):
+            j = i + self.randbelow(n - i)
+            items[i], items[j] = items[j], items[i]
 
-    # Final field / row (no trailing newline)
-    cell = "".join(field)
-    if strip_fields:
-        cell = cell.strip()
-    row.append(cell)
-    if row != [""] or len(row) > 1:       # ignore lone empty row at EOF
-        yield row
+_pool = None
 
-def generate_password(length, level):
+def entropy_pool() -> EntropyPool:
+    """The shared pool; fed by the ATECC608 when crypto offload is enabled."""
+    global _pool
+    if _pool is None:
+        from crypto_backend import offload  # here: utils stays importable alone
+        backend = offload()
+        _pool = EntropyPool(backend.random_bytes if backend is not None else None)
+    return _pool
+
+def _password_shape(length, level):
     # Safe conversion with defaults
     try:
         length, level = int(length), int(level)
@@ -77,23 +253,33 @@ def generate_password(length, level):
         length, level = 12, 1
 
     # Clamp invalid ranges
-    length = length if length > 0 else 12
+    length = min(length, MAX_PASSWORD_LENGTH) if length > 0 else 12
     level = level if level in (0, 1, 2) else 1
+    return length, level
 
-    # Character sets by complexity level
-    letters = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
-    digits = "0123456789"
-    punctuation = "!@#$%^&*()-_=+[]{}|;:,.<>?/"
-    lowercase = "abcdefghijklmnopqrstuvwxyz"
+def generate_passwords(count: int, length, level) -> list:
+    """
+    count passwords as generate_password() makes them, from one bulk draw:
+    the pool is sized so rejections and shuffling rarely need a refill.
+    """
+    length, level = _password_shape(length, level)
+    per_password = 2 * (length + 2 * len(PASSWORD_CLASSES[level]))
+    pool = EntropyPool(entropy_pool()._source, count * per_password)
+    return [generate_password(length, level, pool) for _ in range(count)]
 
-    charsets = {
-        0: letters + digits, # Alphanumeric
-        1: lowercase + digits + punctuation, # Lowercase + symbols
-        2: letters + digits + punctuation # Mixed
-    }
+def generate_password(length, level, pool=None):
+    length, level = _password_shape(length, level)
+    pool = pool or entropy_pool()
+    classes = PASSWORD_CLASSES[level]
+    chars = "".join(classes)
 
-    chars = charsets[level]
-    return ''.join(random.choice(chars) for _ in range(length))
+    # One character from every class first (when it fits), the rest from
+    # the whole set, then move the guaranteed ones to random places.
+    password = [pool.choice(cls) for cls in classes] if length >= len(classes) else []
+    guaranteed = len(password)
+    password.extend(pool.choices(chars, length - guaranteed))
+    pool.shuffle(password, guaranteed)
+    return "".join(password)
 
 def normalize_pin(pin) -> str:
     # Accept int or str; always return a 4-char, zero-padded string
@@ -107,4 +293,40 @@ def normalize_pin(pin) -> str:
 
 def pin_to_tuple(pin_str: str):
     s = normalize_pin(pin_str)          # "0304"
-    return tuple(int(ch) for ch in s)   # (0,3,0,4)
\ No newline at end of file
+    return tuple(int(ch) for ch in s)   # (0,3,0,4)
+
+def bisect_left(items, target, key=None) -> int:
+    """bisect.bisect_left with an optional key; CircuitPython has no bisect."""
+    lo, hi = 0, len(items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if (items[mid] if key is None else key(items[mid])) < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def bisect_right(items, target, key=None) -> int:
+    """bisect.bisect_right with an optional key."""
+    lo, hi = 0, len(items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if target < (items[mid] if key is None else key(items[mid])):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+def normalize_host(url: str) -> str:
+    """Host of url, lowercased, without scheme, port, path or "www."."""
+    url = url.strip().lower()
+    scheme = url.find("://")
+    if scheme >= 0:
+        url = url[scheme + 3:]
+    for sep in "/?#:":
+        end = url.find(sep)
+        if end >= 0:
+            url = url[:end]
+    if url.startswith("www."):
+        url = url[4:]
+    return url
@@ -0,0 +1,270 @@
+"""
+Binary record format for the vault manifest, shards and journal.
+
+Manifest file:    MANIFEST_MAGIC | version:u8 | epoch:u32 | schema:u8 | heap:u8
+                  | count:u8 | count * slot:u8
+Shard file:       MAGIC | version:u8 | check:8 | IV + AES-CBC(payload) | tag:32
+                  (sealed with MAGIC | version as header, see crypto_utils)
+Shard payload:    heap:u8 | schema:u8 | names | count:u32 | count * entry
+Journal file:     JOURNAL_MAGIC | epoch:u32 | frames,
+                  frame = length:u16 | sealed(FRAME_TAG, epoch:u32 | number:u32 | record)
+Journal record:   op:u8 | heap:u8 | names | entry
+Heap blob:        sealed(HEAP_MAGIC, JSON [entry key, secret fields])
+
+Flash file:       FLASH_HEADER | data blocks | alias blocks | sealed(INDEX_TAG, keys)
+                  (the out-of-core backend, see flash_store.py)
+Block:            sealed(BLOCK_TAG, shard payload zero-padded to BLOCK_PAYLOAD)
+keys   = count:u32 | count * str16  first key of every data, then alias block
+Alias block entries are keyed alias.lower() | 0x00 | URL key and hold
+{"alias": alias}, so the table sorts as KeyStore sorts its aliases.
+
+sealed(header, data) = header | check:8 | IV + AES-CBC(data) | tag:32, the
+encrypt-then-MAC container of crypto_utils.seal(). The tags keep a record
+of one kind from being accepted as another; a journal frame also carries
+the epoch and its position in the journal, and a block must start with
+the key the index lists for it, so frames and blocks cannot be replayed
+elsewhere or reordered. A heap blob names the entry it belongs to, so
+blobs cannot be swapped between entries.
+
+names  = n:u8 | n * str8          field names, referenced by index below
+entry  = key:str16 | nfields:u8 | nfields * (name_index:u8 | value)
+value  = TAG_STR str16 | TAG_KEY | TAG_REF offset:u32 length:u32 | TAG_JSON str16
+
+TAG_KEY stands for "same as the entry key" (the URL is usually both), so
+the decoder shares one str instead of holding two copies. All integers
+are big-endian. Entries that are not dicts (very old vaults) are written
+with nfields == RAW_ENTRY followed by one JSON str16.
+
+Entries are spread over the shards by shard_of(key). The manifest epoch
+is bumped on every save and a journal only replays on the epoch it was
+started in. Before sharding the vault was one shard file stored under the
+manifest name, with a PVJ1 journal that had no epoch; version 1 shard
+payloads have no schema byte and read as schema 0; shards before version
+3 have no check value or tag and are resealed by the next save.
+Before schema 3, heap blobs, PVJ2 journal frames and version 1 flash
+files were IV + AES-CBC without a tag; they are only read from vaults at
+an older schema, which the migration and the next save bring up to date.
+Flash files before version 3 key the alias table by the alias as
+written; it is rebuilt from the data blocks on load and saved folded.
+"""
+import json
+import struct
+
+MAGIC = b"PVB1"
+MANIFEST_MAGIC = b"PVM1"
+JOURNAL_MAGIC = b"PVJ3"
+UNSEALED_JOURNAL_MAGIC = b"PVJ2"
+LEGACY_JOURNAL_MAGIC = b"PVJ1"
+HEAP_MAGIC = b"PVH1"
+FRAME_TAG = b"J"
+BLOCK_TAG = b"B"
+INDEX_TAG = b"I"
+VERSION = 3
+READ_VERSIONS = (1, 2, 3)
+SEALED_VERSION = 3  # first shard version written by SealEncryptor
+MANIFEST_VERSION = 1
+
+FLASH_MAGIC = b"PVF1"
+FLASH_VERSION = 3
+SEALED_FLASH_VERSION = 2  # first version with sealed blocks and index
+FOLDED_ALIAS_VERSION = 3  # first version with alias table keys in lowercase
+# magic, version, epoch, schema, heap, data blocks, alias blocks,
+# entries, aliases, live heap bytes, key index length
+FLASH_HEADER = ">4sBIBBIIIIII"
+FLASH_HEADER_SIZE = struct.calcsize(FLASH_HEADER)
+BLOCK_PAYLOAD = 944
+# tag, check value, IV, payload and one block of padding, MAC
+BLOCK_BYTES = len(BLOCK_TAG) + 8 + 16 + BLOCK_PAYLOAD + 16 + 32
+LEGACY_BLOCK_BYTES = 1024  # version 1: IV + AES-CBC
+
+OP_PUT = 1
+OP_DEL = 2
+
+TAG_STR = 0
+TAG_KEY = 1
+TAG_REF = 2
+TAG_JSON = 3
+
+RAW_ENTRY = 0xFF
+
+def _put_str(buf: bytearray, value: str) -> None:
+    data = value.encode("utf-8")
+    buf.extend(struct.pack(">H", len(data)))
+    buf.extend(data)
+
+def _get_str(mv, offset: int):
+    end = offset + 2 + ((mv[offset] << 8) | mv[offset + 1])
+    return str(mv[offset + 2:end], "utf-8"), end
+
+def _put_names(buf: bytearray, entries) -> dict:
+    """Write the field-name table for entries and return name -> index."""
+    index = {}
+    for entry in entries:
+        if isinstance(entry, dict):
+            for name in entry:
+                if name not in index:
+                    index[name] = len(index)
+    if len(index) > 0xFF:
+        raise ValueError("Too many distinct field names")
+
+    buf.append(len(index))
+    for name in sorted(index, key=index.get):
+        data = name.encode("utf-8")
+        buf.append(len(data))
+        buf.extend(data)
+    return index
+
+def _get_names(mv, offset: int):
+    names = []
+    count = mv[offset]
+    offset += 1
+    for _ in range(count):
+        end = offset + 1 + mv[offset]
+        names.append(str(mv[offset + 1:end], "utf-8"))
+        offset = end
+    return names, offset
+
+def _put_entry(buf: bytearray, key: str, entry, names: dict) -> None:
+    _put_str(buf, key)
+    if not isinstance(entry, dict):
+        buf.append(RAW_ENTRY)
+        _put_str(buf, json.dumps(entry))
+        return
+
+    if len(entry) >= RAW_ENTRY:
+        raise ValueError("Too many fields in entry")
+    buf.append(len(entry))
+    for name, value in entry.items():
+        buf.append(names[name])
+        if value == key:
+            buf.append(TAG_KEY)
+        elif isinstance(value, str):
+            buf.append(TAG_STR)
+            _put_str(buf, value)
+        elif name == "secret":
+            buf.append(TAG_REF)
+            buf.extend(struct.pack(">II", value[0], value[1]))
+        else:
+            buf.append(TAG_JSON)
+            _put_str(buf, json.dumps(value))
+
+def _get_entry(mv, offset: int, names: list):
+    key, offset = _get_str(mv, offset)
+    nfields = mv[offset]
+    offset += 1
+    if nfields == RAW_ENTRY:
+        raw, offset = _get_str(mv, offset)
+        return key, json.loads(raw), offset
+
+    entry = {}
+    for _ in range(nfields):
+        name = names[mv[offset]]
+        tag = mv[offset + 1]
+        offset += 2
+        if tag == TAG_STR:
+            entry[name], offset = _get_str(mv, offset)
+        elif tag == TAG_KEY:
+            entry[name] = key
+        elif tag == TAG_REF:
+            entry[name] = list(struct.unpack_from(">II", mv, offset))
+            offset += 8
+        elif tag == TAG_JSON:
+            raw, offset = _get_str(mv, offset)
+            entry[name] = json.loads(raw)
+        else:
+            raise ValueError("Unknown field tag")
+    return key, entry, offset
+
+def encode_snapshot(entries: dict, heap: int, schema: int) -> bytearray:
+    """Serialize the whole index into one plaintext payload."""
+    buf = bytearray((heap, schema))
+    names = _put_names(buf, entries.values())
+    buf.extend(struct.pack(">I", len(entries)))
+    for key, entry in entries.items():
+        _put_entry(buf, key, entry, names)
+    return buf
+
+def decode_snapshot(payload, version: int = VERSION):
+    """Parse a decrypted snapshot payload in place. Returns (entries, heap, schema)."""
+    mv = memoryview(payload)
+    schema = mv[1] if version >= 2 else 0
+    names, offset = _get_names(mv, 2 if version >= 2 else 1)
+    count = struct.unpack_from(">I", mv, offset)[0]
+    offset += 4
+    entries = {}
+    for _ in range(count):
+        key, entry, offset = _get_entry(mv, offset, names)
+        entries[key] = entry
+    return entries, mv[0], schema
+
+def encode_record(op: int, heap: int, key: str, entry=None) -> bytearray:
+    """Serialize one journal mutation."""
+    entry = entry if entry is not None else {}
+    buf = bytearray((op, heap))
+    names = _put_names(buf, (entry,))
+    _put_entry(buf, key, entry, names)
+    return buf
+
+def decode_record(payload):
+    """Parse one decrypted journal mutation. Returns (op, heap, key, entry)."""
+    mv = memoryview(payload)
+    names, offset = _get_names(mv, 2)
+    key, entry, _ = _get_entry(mv, offset, names)
+    return mv[0], mv[1], key, entry
+
+def shard_of(key: str, count: int) -> int:
+    """Stable shard number for key (32-bit FNV-1a), the same on every boot."""
+    if count == 1:
+        return 0
+    h = 0x811C9DC5
+    for b in key.encode("utf-8"):
+        h = ((h ^ b) * 0x01000193) & 0xFFFFFFFF
+    return h % count
+
+def encode_manifest(epoch: int, schema: int, heap: int, slots) -> bytes:
+    """Serialize the manifest; slots[i] selects the live file of shard i."""
+    return (MANIFEST_MAGIC + struct.pack(">BIBBB", MANIFEST_VERSION, epoch, schema, heap, len(slots))
+            + bytes(slots))
+
+def decode_manifest(data):
+    """Parse a manifest. Returns (epoch, schema, heap, slots)."""
+    if data[:4] != MANIFEST_MAGIC:
+        raise ValueError("Not a vault manifest")
+    version, epoch, schema, heap, count = struct.unpack_from(">BIBBB", data, 4)
+    if version != MANIFEST_VERSION:
+        raise ValueError("Unsupported manifest version")
+    slots = list(data[12:12 + count])
+    if len(slots) != count:
+        raise ValueError("Truncated manifest")
+    return epoch, schema, heap, slots
+
+def encode_keys(keys) -> bytearray:
+    """Serialize a list of str (the sparse block index)."""
+    buf = bytearray(struct.pack(">I", len(keys)))
+    for key in keys:
+        _put_str(buf, key)
+    return buf
+
+def decode_keys(payload) -> list:
+    mv = memoryview(payload)
+    keys = []
+    offset = 4
+    for _ in range(struct.unpack_from(">I", mv, 0)[0]):
+        key, offset = _get_str(mv, offset)
+        keys.append(key)
+    return keys
+
+def entry_size(key: str, entry, names: dict) -> int:
+    """
+    Bytes entry adds to a shard payload whose name table already holds
+    names; new field names are added to names and counted as well.
+    """
+    buf = bytearray()
+    grown = 0
+    if isinstance(entry, dict):
+        for name in entry:
+            if name not in names:
+                names[name] = len(names)
+                grown += 1 + len(name.encode("utf-8"))
+    _put_entry(buf, key, entry, names)
+    return len(buf) + grown
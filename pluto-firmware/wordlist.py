@@ -0,0 +1,83 @@
+"""
+Diceware passphrases from a packed wordlist on the CIRCUITPY drive.
+
+Wordlist file:    WORDLIST_MAGIC | count:u16 | width:u8 | (count + 1) * offset
+                  | words
+offset = width-byte big-endian position in `words` (2, or 4 when the words
+take 64 KiB or more); word i is words[offset[i]:offset[i + 1]], UTF-8.
+
+Only the header is read on open. A word costs one 2 * width read from the
+offset table and one seek into the words, so the list never sits in RAM
+and the file may hold up to 65535 words. tools/pack_wordlist.py builds
+the file from a plain or dice-numbered list (the EFF large list gives
+7776 words, 12.9 bits each) and copies nothing to the board by itself.
+"""
+import struct
+from utils import entropy_pool
+
+WORDLIST_FILE = "wordlist.bin"
+WORDLIST_MAGIC = b"PWL1"
+HEADER = ">4sHB"
+HEADER_LEN = struct.calcsize(HEADER)
+DEFAULT_WORDS = 6
+MAX_WORDS = 16
+SEPARATOR = "-"
+
+class Wordlist:
+    """An open wordlist file; use with `with` or close() it."""
+    def __init__(self, path: str = WORDLIST_FILE):
+        try:
+            self._file = open(path, "rb")
+        except OSError:
+            raise ValueError(f"No wordlist at {path}, see tools/pack_wordlist.py")
+        magic, self.count, self.width = struct.unpack(HEADER, self._file.read(HEADER_LEN))
+        if magic != WORDLIST_MAGIC or self.width not in (2, 4) or not self.count:
+            self._file.close()
+            raise ValueError(f"{path} is not a packed wordlist")
+        self._format = ">2H" if self.width == 2 else ">2I"
+        self._words_at = HEADER_LEN + (self.count + 1) * self.width
+        self._offsets = bytearray(2 * self.width)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self) -> None:
+        self._file.close()
+
+    def word(self, index: int) -> str:
+        if not 0 <= index < self.count:
+            raise IndexError("word index out of range")
+        f = self._file
+        f.seek(HEADER_LEN + index * self.width)
+        f.readinto(self._offsets)
+        start, end = struct.unpack(self._format, self._offsets)
+        f.seek(self._words_at + start)
+        return f.read(end - start).decode("utf-8")
+
+def _word_count(words) -> int:
+    try:
+        words = int(words)
+    except (ValueError, TypeError):
+        words = DEFAULT_WORDS
+    return min(max(words, 1), MAX_WORDS)
+
+def generate_passphrases(count: int, words=DEFAULT_WORDS, separator: str = SEPARATOR,
+                         pool=None, path: str = WORDLIST_FILE) -> list:
+    """count passphrases of `words` uniformly drawn words, one file open."""
+    words = _word_count(words)
+    pool = pool or entropy_pool()
+    with Wordlist(path) as wordlist:
+        n = len(wordlist)
+        return [separator.join(wordlist.word(pool.randbelow(n)) for _ in range(words))
+                for _ in range(count)]
+
+def generate_passphrase(words=DEFAULT_WORDS, separator: str = SEPARATOR,
+                        pool=None, path: str = WORDLIST_FILE) -> str:
+    return generate_passphrases(1, words, separator, pool, path)[0]
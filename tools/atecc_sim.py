@@ -0,0 +1,186 @@
+"""
+Host stand-in for an ATECC608 on I2C, for exercising
+pluto-firmware/atecc_backend.py on Linux.
+
+SimulatedATECC answers the command packets the transport sends (SHA,
+RANDOM, AES-ECB), checks their CRC, NACKs while asleep and models the
+idle/sleep/watchdog rules that batching has to respect. Time is virtual:
+pass sim.sleep and sim.monotonic to AteccTransport so nothing waits.
+
+Run it to check the backend against hashlib and print wake counts,
+also for crypto_utils.derive_keys with HKDF offloaded to the chip:
+
+    python3 tools/atecc_sim.py
+"""
+import hashlib
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pluto-firmware"))
+
+from atecc_backend import (AteccBackend, AteccTransport, _crc16, OP_AES, OP_RANDOM, OP_SHA,  # noqa: E402
+                           SHA_START, SHA_UPDATE, SHA_END, AES_DECRYPT)
+
+WATCHDOG_S = 1.3
+
+class _Device:
+    def __init__(self, sim, wake):
+        self._sim = sim
+        self._wake = wake
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write(self, buf):
+        if self._wake:
+            self._sim._wake()
+            raise OSError("NACK")  # nothing lives at address 0
+        self._sim._write(bytes(buf))
+
+    def readinto(self, buf):
+        self._sim._read(buf)
+
+class SimulatedATECC:
+    def __init__(self, slots=None):
+        self.now = 0.0
+        self.slots = dict(slots or {})  # slot -> 16-byte AES key
+        self.device = _Device(self, wake=False)
+        self.wake_device = _Device(self, wake=True)
+        self.awake_since = None
+        self.sha = None
+        self.reply = None
+        self.wakes = 0
+        self.commands = 0
+        self.watchdog_trips = 0
+
+    # virtual clock for AteccTransport
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def monotonic(self):
+        return self.now
+
+    def transport(self) -> AteccTransport:
+        return AteccTransport(self.device, self.wake_device, self.sleep, self.monotonic)
+
+    def _check_watchdog(self):
+        if self.awake_since is not None and self.now - self.awake_since > WATCHDOG_S:
+            self.watchdog_trips += 1
+            self.awake_since = None
+            self.sha = None  # the watchdog sends the chip to sleep
+
+    def _wake(self):
+        self._check_watchdog()
+        if self.awake_since is None:
+            self.awake_since = self.now
+            self.wakes += 1
+
+    def _write(self, buf):
+        self._check_watchdog()
+        if self.awake_since is None:
+            raise OSError("NACK")
+        if buf[0] == 0x02:  # idle: keeps the SHA context
+            self.awake_since = None
+        elif buf[0] == 0x01:  # sleep: loses it
+            self.awake_since = None
+            self.sha = None
+        elif buf[0] == 0x03:
+            self._command(buf)
+
+    def _read(self, buf):
+        self._check_watchdog()
+        if self.awake_since is None or self.reply is None:
+            raise OSError("NACK")
+        buf[:len(self.reply)] = self.reply
+        self.reply = None
+
+    def _answer(self, data):
+        packet = bytearray((len(data) + 3,)) + data
+        crc = _crc16(packet)
+        self.reply = packet + bytes((crc & 0xFF, crc >> 8))
+
+    def _command(self, buf):
+        self.commands += 1
+        crc = _crc16(buf[1:-2])
+        if buf[1] != len(buf) - 1 or buf[-2:] != bytes((crc & 0xFF, crc >> 8)):
+            return self._answer(b"\xff")  # communication error
+        opcode, mode, param2, data = buf[2], buf[3], buf[4] | (buf[5] << 8), buf[6:-2]
+        if opcode == OP_SHA:
+            if mode == SHA_START:
+                self.sha = hashlib.sha256()
+            elif self.sha is None:
+                return self._answer(b"\x0f")  # execution error: no context
+            elif mode == SHA_UPDATE:
+                self.sha.update(data)
+            elif mode == SHA_END:
+                self.sha.update(data[:param2])
+                digest, self.sha = self.sha.digest(), None
+                return self._answer(digest)
+            return self._answer(b"\x00")
+        if opcode == OP_RANDOM:
+            return self._answer(os.urandom(32))
+        if opcode == OP_AES:
+            key = self.slots.get(param2 >> 8)
+            if key is None:
+                return self._answer(b"\x0f")
+            # Stand-in block cipher: keyed and invertible, not AES.
+            pad = hashlib.sha256(key).digest()[:16]
+            if mode == AES_DECRYPT:
+                return self._answer(bytes(a ^ b for a, b in zip(data[::-1], pad)))
+            return self._answer(bytes(a ^ b for a, b in zip(data, pad))[::-1])
+        return self._answer(b"\x03")  # parse error
+
+def _main():
+    sim = SimulatedATECC(slots={9: os.urandom(16)})
+    backend = AteccBackend(sim.transport(), aes_slot=9)
+
+    for size in (0, 1, 63, 64, 65, 200, 1500):
+        data = os.urandom(size)
+        h = backend.sha256(data[:size // 2])
+        h.update(data[size // 2:])
+        assert h.digest() == hashlib.sha256(data).digest(), size
+    blocks = os.urandom(64)
+    assert backend.aes_ecb(backend.aes_ecb(blocks), decrypt=True) == blocks
+    assert len(backend.random_bytes(100)) == 100
+    print(f"checks passed: {sim.wakes} wakes, {sim.commands} commands, "
+          f"{sim.watchdog_trips} watchdog trips")
+
+    # The same 24 commands, batched and the way the driver methods send
+    # them (wake before, idle after every one).
+    data = os.urandom(1024)
+    commands = ([(OP_SHA, SHA_START, 0, b"", 1)]
+                + [(OP_SHA, SHA_UPDATE, 64, data[i:i + 64], 1) for i in range(0, len(data), 64)]
+                + [(OP_SHA, SHA_END, 0, b"", 32)]
+                + [(OP_RANDOM, 0, 0, b"", 32)] * 2
+                + [(OP_AES, 0, 9 << 8, blocks[i:i + 16], 16) for i in range(0, len(blocks), 16)])
+    for label, batched in (("one batch", True), ("per command", False)):
+        sim.wakes = sim.commands = 0
+        start = sim.now
+        if batched:
+            with backend.batch():
+                for command in commands:
+                    backend.transport.execute(*command)
+        else:
+            for command in commands:
+                with backend.batch():
+                    backend.transport.execute(*command)
+        print(f"{label:12s}: {sim.wakes:3d} wakes for {sim.commands} commands, "
+              f"{(sim.now - start) * 1000:.0f} ms simulated")
+
+    import host_board  # crypto_utils needs the board stand-ins
+    host_board.install()
+    import crypto_backend
+    import crypto_utils
+    infos = (b"vault", b"backup", b"session")
+    expected = crypto_utils.derive_keys(b"t" * 32, b"salt", infos)
+    crypto_backend.set_offload(backend)
+    sim.wakes = sim.commands = 0
+    assert crypto_utils.derive_keys(b"t" * 32, b"salt", infos) == expected
+    crypto_backend.set_offload(None)
+    print(f"derive_keys : {sim.wakes:3d} wakes for {sim.commands} commands, 3 subkeys")
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,162 @@
+"""
+Host benchmarks for the firmware, with the stand-ins of host_board.py and
+vault files in a temporary directory:
+
+    python3 tools/bench.py [name ...]
+
+With no name, every benchmark runs. aesio is host_board's stand-in, so
+the numbers compare code paths with each other, not with the board. The
+firmware's own messages are discarded.
+
+journal   cost of one edit as the vault grows: a journal append versus
+          the full snapshot rewrite every edit cost before the journal
+alias     alias lookup in 10k entries: the alias index versus the scan
+          over every entry that _find_key did before it
+shards    one edit in a transaction plus its flush, for 1, 8 and 32
+          shards as the vault grows
+channel   secure-channel messages per second (encrypt_aes_bytes, then
+          decrypt_aes_bytes, as secure_write and secure_read do) with
+          the cipher cache, and cold as every message was before it
+passwords level 2 passwords per second from the entropy pool versus the
+          random.choice per character generate_password used before
+"""
+import contextlib
+import os
+import random
+import sys
+import time
+
+import host_board
+
+host_board.install()
+
+import crypto_utils  # noqa: E402
+import key_store  # noqa: E402
+from key_store import KeyStore  # noqa: E402
+from utils import DIGITS, LETTERS, PUNCTUATION, EntropyPool, generate_password  # noqa: E402
+
+KEY = b"k" * 32
+
+def _vault(count: int, **kwargs) -> KeyStore:
+    """A fresh vault of count entries, aliases site0, site1, ..."""
+    host_board.reset_vault()
+    store = KeyStore(KEY, **kwargs)
+    with store.transaction():
+        for i in range(count):
+            store.add(f"site{i}", f"https://site{i}.example", f"user{i}", f"pw{i}")
+    assert store.flush() is True
+    return store
+
+def _report(line: str) -> None:
+    print(line, file=sys.__stdout__)
+
+def _mean_ms(func, rounds: int) -> float:
+    """Mean milliseconds of func(i) for i in range(rounds)."""
+    start = time.perf_counter()
+    for i in range(rounds):
+        func(i)
+    return (time.perf_counter() - start) / rounds * 1000
+
+def bench_journal() -> None:
+    _report("journal: ms per edit, mean of 20 (fewer than COMPACT_THRESHOLD)")
+    for count in (50, 200, 800, 3200):
+        store = _vault(count, write_behind=False)
+        append = _mean_ms(lambda i: store.set_password(f"site{i % count}", f"new{i}"), 20)
+
+        def rewrite(i):
+            store._dirty_shards.update(range(len(store._shards)))  # every shard, as before
+            assert store._save() is True
+        _report(f"  N={count:<5d} snapshot rewrite {_mean_ms(rewrite, 20):8.2f} ms, "
+                f"journal append {append:5.2f} ms")
+
+def _scan_alias(store: KeyStore, alias: str):
+    """_find_key's alias fallback before the index: compare every entry."""
+    for key, entry in store.db.items():
+        if isinstance(entry, dict) and entry.get("alias") == alias:
+            return key
+    return None
+
+def bench_alias(count: int = 10000) -> None:
+    _report(f"alias: us per lookup in {count} entries, mean of 200")
+    store = _vault(count)
+    for label, i in (("first", 0), ("middle", count // 2), ("last", count - 1)):
+        alias = f"site{i}"
+        assert store._find_key(alias) == _scan_alias(store, alias) is not None
+        scan = _mean_ms(lambda _: _scan_alias(store, alias), 200) * 1000
+        index = _mean_ms(lambda _: store._find_key(alias), 200) * 1000
+        _report(f"  {label:6s} scan {scan:8.1f} us, index {index:5.1f} us")
+
+def bench_shards() -> None:
+    _report("shards: ms per transaction edit and flush, mean of 20")
+    target = key_store.SHARD_TARGET
+    key_store.SHARD_TARGET = 1 << 30  # keep the count reshard() sets
+    try:
+        for count in (200, 800, 3200):
+            cells = []
+            for shards in (1, 8, 32):
+                store = _vault(count)
+                assert store.reshard(shards) is True
+
+                def edit(i):
+                    with store.transaction():
+                        store.set_password(f"site{i * 7 % count}", f"new{i}")
+                    assert store.flush() is True
+                label = f"{shards} shard" + ("s" if shards > 1 else "")
+                cells.append(f"{label:>9s} {_mean_ms(edit, 20):6.2f} ms")
+            _report(f"  N={count:<5d} " + ", ".join(cells))
+    finally:
+        key_store.SHARD_TARGET = target
+
+def bench_channel(messages: int = 3000) -> None:
+    _report(f"channel: round trips per second, {messages} messages")
+    key = os.urandom(16)  # a session key
+    for size in (20, 93):
+        text = "x" * size
+        cells = []
+        for label, cold in (("cold", True), ("cached", False)):
+            crypto_utils.clear_cipher_cache()
+            host_board.CALLS["new"] = 0
+
+            def round_trip(i):
+                if cold:
+                    crypto_utils.clear_cipher_cache()
+                data = crypto_utils.encrypt_aes_bytes(text, key)
+                if cold:
+                    crypto_utils.clear_cipher_cache()
+                assert crypto_utils.decrypt_aes_bytes(data, key) == text
+            rate = 1000 / _mean_ms(round_trip, messages)
+            cells.append(f"{label} {rate / 1000:5.1f}k/s, {host_board.CALLS['new']:4d} aesio.AES")
+        _report(f"  {size:3d} B: " + ", ".join(cells))
+
+def _choice_password(length: int) -> str:
+    """generate_password(length, 2) before the entropy pool."""
+    chars = LETTERS + DIGITS + PUNCTUATION
+    return "".join(random.choice(chars) for _ in range(length))
+
+def bench_passwords(count: int = 3000) -> None:
+    _report(f"passwords: level 2 passwords per second, {count} each")
+    pool = EntropyPool()  # os.urandom, as without crypto offload
+    for length in (12, 32):
+        choice = 1000 / _mean_ms(lambda i: _choice_password(length), count)
+        pooled = 1000 / _mean_ms(lambda i: generate_password(length, 2, pool), count)
+        _report(f"  length {length}: random.choice {choice / 1000:5.1f}k/s, "
+                f"EntropyPool {pooled / 1000:5.1f}k/s")
+
+BENCHES = {
+    "journal": bench_journal,
+    "alias": bench_alias,
+    "shards": bench_shards,
+    "channel": bench_channel,
+    "passwords": bench_passwords,
+}
+
+def main(argv: list) -> None:
+    unknown = [name for name in argv if name not in BENCHES]
+    if unknown:
+        raise SystemExit(f"unknown benchmark {unknown[0]}; choose from {', '.join(BENCHES)}")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name in argv or BENCHES:
+            BENCHES[name]()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
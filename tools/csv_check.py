@@ -0,0 +1,138 @@
+"""
+Check utils.csv_reader against Python's csv module and time it against
+the character-at-a-time reader it replaced:
+
+    python3 tools/csv_check.py [--bench]
+
+The fixed RFC 4180 cases and a few thousand random documents (fields
+with delimiters, quotes, CR, LF and CRLF, with or without a final
+newline) must give the csv module's rows with strip_fields off, where a
+blank line counts as one empty field. Each document is also fed in
+random chunks, which must give the same rows as one feed(). With
+--bench, a 300-row export is parsed whole, in 64-character chunks and
+with the old reader.
+"""
+import csv
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pluto-firmware"))
+
+from utils import CsvReader, csv_reader  # noqa: E402
+
+CASES = (
+    'aaa,bbb,ccc\r\nzzz,yyy,xxx\r\n',
+    'aaa,bbb,ccc\r\nzzz,yyy,xxx',
+    '"aaa","bbb","ccc"\r\nzzz,yyy,xxx\r\n',
+    '"aaa","b\r\nbb","ccc"\r\nzzz,yyy,xxx\r\n',
+    '"aaa","b""bb","ccc"\r\n',
+    'a,,\n,b,\n\n"",x\n',
+    'a"b,c\rd,"e"f\n',
+    '""\n',
+    '"unterminated,\nfield',
+)
+ALPHABET = 'ab ,"\n\r'
+
+def expected(text: str) -> list:
+    return [row or [""] for row in csv.reader(io.StringIO(text, newline=""), strict=False)]
+
+def random_document(rng: random.Random) -> str:
+    rows = []
+    for _ in range(rng.randint(1, 6)):
+        fields = []
+        for _ in range(rng.randint(1, 4)):
+            field = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 6)))
+            if field and (field[0] in ' "' or any(c in field for c in ',"\n\r')):
+                field = '"' + field.replace('"', '""') + '"'
+            fields.append(field)
+        rows.append(",".join(fields))
+    return rng.choice(("\n", "\r\n", "\r")).join(rows) + rng.choice(("", "\n", "\r\n"))
+
+def chunked(text: str, rng: random.Random) -> list:
+    reader = CsvReader(strip_fields=False)
+    rows, i = [], 0
+    while i < len(text):
+        step = rng.randint(1, 8)
+        rows.extend(reader.feed(text[i:i + step]))
+        i += step
+    return rows + reader.close()
+
+def check(documents: int = 5000, seed: int = 4180) -> None:
+    rng = random.Random(seed)
+    texts = list(CASES) + [random_document(rng) for _ in range(documents)]
+    for text in texts:
+        rows = list(csv_reader(text, strip_fields=False))
+        assert rows == expected(text), f"{text!r}: {rows} != {expected(text)}"
+        assert chunked(text, rng) == rows, f"{text!r}: chunked feed differs"
+    assert list(csv_reader(' a , " b " \n')) == [["a", "b"]]  # strip_fields
+    print(f"{len(texts)} documents match the csv module, whole and in chunks")
+
+def char_reader(text: str, delimiter: str = ",", quotechar: str = '"', strip_fields: bool = True):
+    """csv_reader before the CsvReader rewrite, one Python step per character."""
+    field = []
+    row = []
+    in_quotes = False
+    i = 0
+    length = len(text)
+    while i < length:
+        ch = text[i]
+        if ch == quotechar:
+            nxt = text[i + 1] if i + 1 < length else None
+            if in_quotes and nxt == quotechar:
+                field.append(quotechar)
+                i += 1
+            else:
+                in_quotes = not in_quotes
+        elif ch == delimiter and not in_quotes:
+            cell = "".join(field)
+            row.append(cell.strip() if strip_fields else cell)
+            field = []
+        elif (ch == "\n" or ch == "\r") and not in_quotes:
+            cell = "".join(field)
+            row.append(cell.strip() if strip_fields else cell)
+            field = []
+            if row:
+                yield row
+            row = []
+            if ch == "\r" and i + 1 < length and text[i + 1] == "\n":
+                i += 1
+        else:
+            field.append(ch)
+        i += 1
+    cell = "".join(field)
+    row.append(cell.strip() if strip_fields else cell)
+    if row != [""] or len(row) > 1:
+        yield row
+
+def export(rows: int = 300) -> str:
+    lines = ["alias,url,username,password,note"]
+    for i in range(rows):
+        lines.append(f'site{i},https://site{i}.example.com/login,user{i}@example.com,'
+                     f'"p""{i}w,rd!x{i * 7919 % 10007}",note {i}')
+    return "\r\n".join(lines) + "\r\n"
+
+def _time(func, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1000
+
+def bench(rounds: int = 50) -> None:
+    text = export()
+    chunks = [text[i:i + 64] for i in range(0, len(text), 64)]
+    assert list(char_reader(text)) == list(csv_reader(text)) == list(csv_reader(chunks))
+    for label, func in (("char-at-a-time reader", lambda: list(char_reader(text))),
+                        ("csv_reader", lambda: list(csv_reader(text))),
+                        ("csv_reader, 64-char chunks", lambda: list(csv_reader(chunks)))):
+        print(f"{label:27s}: {_time(func, rounds):6.2f} ms for 300 rows, {len(text)} chars")
+
+def main(argv: list) -> None:
+    check()
+    if "--bench" in argv:
+        bench()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,99 @@
+"""
+Host stand-ins for the CircuitPython modules the firmware imports, so the
+vault and crypto code can run under CPython from the other tools.
+
+aesio is a keyed, invertible 16-byte permutation with real CBC chaining,
+not AES: it exercises the same code paths and counts cipher setups, so it
+compares versions of the firmware code, not AES speed. adafruit_hashlib
+is hashlib, and microcontroller has a fixed uid and a RAM-backed nvm.
+
+    import host_board
+    host_board.install()  # before any firmware import
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import types
+
+FIRMWARE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pluto-firmware")
+
+MODE_ECB, MODE_CBC, MODE_CTR = 1, 2, 6
+CALLS = {"new": 0, "rekey": 0}  # cipher setups, for the benchmarks
+
+class AES:
+    def __init__(self, key, mode=MODE_ECB, IV=None, segment_size=8):
+        CALLS["new"] += 1
+        self.mode = mode
+        self._set(key, IV)
+
+    def _set(self, key, IV):
+        if len(key) not in (16, 24, 32):
+            raise ValueError("Key must be 16, 24, or 32 bytes long")
+        digest = hashlib.sha256(bytes(key)).digest()
+        self._pad = int.from_bytes(digest[:16], "big")
+        self._turn = digest[16] % 15 + 1
+        self._iv = bytes(IV) if IV is not None else bytes(16)
+
+    def rekey(self, key, IV=None):
+        CALLS["rekey"] += 1
+        self._set(key, IV)
+
+    def _encrypt(self, block: bytes) -> bytes:
+        x = (int.from_bytes(block, "big") ^ self._pad).to_bytes(16, "big")
+        return x[self._turn:] + x[:self._turn]
+
+    def _decrypt(self, block: bytes) -> bytes:
+        x = block[-self._turn:] + block[:-self._turn]
+        return (int.from_bytes(x, "big") ^ self._pad).to_bytes(16, "big")
+
+    def encrypt_into(self, src, dest) -> None:
+        if len(src) % 16:
+            raise ValueError("Data must be whole blocks")
+        for i in range(0, len(src), 16):
+            block = bytes(src[i:i + 16])
+            if self.mode == MODE_CBC:
+                block = (int.from_bytes(block, "big") ^ int.from_bytes(self._iv, "big")).to_bytes(16, "big")
+            out = self._encrypt(block)
+            if self.mode == MODE_CBC:
+                self._iv = out
+            dest[i:i + 16] = out
+
+    def decrypt_into(self, src, dest) -> None:
+        if len(src) % 16:
+            raise ValueError("Data must be whole blocks")
+        for i in range(0, len(src), 16):
+            block = bytes(src[i:i + 16])
+            out = self._decrypt(block)
+            if self.mode == MODE_CBC:
+                out = (int.from_bytes(out, "big") ^ int.from_bytes(self._iv, "big")).to_bytes(16, "big")
+                self._iv = block
+            dest[i:i + 16] = out
+
+def _module(name: str, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+def install(workdir=None) -> str:
+    """
+    Register the stand-ins, put pluto-firmware on sys.path and change to
+    workdir (a fresh temporary directory by default) with an empty sd/,
+    where the vault files are written. Returns workdir.
+    """
+    _module("aesio", AES=AES, MODE_ECB=MODE_ECB, MODE_CBC=MODE_CBC, MODE_CTR=MODE_CTR)
+    _module("adafruit_hashlib", sha256=hashlib.sha256, new=hashlib.new)
+    _module("microcontroller", cpu=types.SimpleNamespace(uid=bytes(range(1, 9))),
+            nvm=bytearray(b"\xff" * 8192))
+    if FIRMWARE not in sys.path:
+        sys.path.insert(0, FIRMWARE)
+    workdir = workdir or tempfile.mkdtemp(prefix="pluto-")
+    os.makedirs(os.path.join(workdir, "sd"), exist_ok=True)
+    os.chdir(workdir)
+    return workdir
+
+def reset_vault() -> None:
+    """Remove every vault file, for a fresh KeyStore in the same workdir."""
+    for name in os.listdir("sd"):
+        os.remove(os.path.join("sd", name))
@@ -0,0 +1,81 @@
+"""
+Pack a Diceware wordlist into the file pluto-firmware/wordlist.py reads.
+
+The input has one word per line, optionally after its dice number as in
+the EFF lists ("11111<TAB>abacus"); blank lines are skipped. Copy the
+output to the root of the CIRCUITPY drive as wordlist.bin:
+
+    python3 tools/pack_wordlist.py eff_large_wordlist.txt wordlist.bin
+
+The packed file is read back and checked word by word. With --bench, it
+also times passphrase generation against generate_password and prints
+the peak memory of each, with CPython's tracemalloc on the host.
+"""
+import math
+import os
+import struct
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pluto-firmware"))
+
+from wordlist import HEADER, WORDLIST_MAGIC, Wordlist, generate_passphrase  # noqa: E402
+from utils import EntropyPool, generate_password  # noqa: E402
+
+def read_words(path: str) -> list:
+    words = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.split()
+            if fields:
+                words.append(fields[-1])
+    if not words or len(words) > 0xFFFF:
+        raise SystemExit(f"{path}: need 1 to 65535 words, got {len(words)}")
+    if len(set(words)) != len(words):
+        raise SystemExit(f"{path}: words are not unique")
+    return words
+
+def pack(words: list) -> bytes:
+    data = [word.encode("utf-8") for word in words]
+    offsets = [0]
+    for word in data:
+        offsets.append(offsets[-1] + len(word))
+    width = 2 if offsets[-1] <= 0xFFFF else 4
+    table = struct.pack(f">{len(offsets)}{'H' if width == 2 else 'I'}", *offsets)
+    return struct.pack(HEADER, WORDLIST_MAGIC, len(words), width) + table + b"".join(data)
+
+def _measure(func, rounds: int):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    elapsed = (time.perf_counter() - start) / rounds
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed * 1e6, peak
+
+def bench(path: str, rounds: int = 2000) -> None:
+    pool = EntropyPool()  # os.urandom, without crypto_backend's board modules
+    for label, func in (("passphrase 6 words", lambda: generate_passphrase(6, pool=pool, path=path)),
+                        ("password len=20,lvl=2", lambda: generate_password(20, 2, pool))):
+        micros, peak = _measure(func, rounds)
+        print(f"{label:22s}: {micros:7.1f} us, peak {peak} bytes")
+
+def main(argv: list) -> None:
+    args = [a for a in argv if a != "--bench"]
+    if len(args) != 2:
+        raise SystemExit(__doc__)
+    words = read_words(args[0])
+    with open(args[1], "wb") as f:
+        f.write(pack(words))
+    with Wordlist(args[1]) as wordlist:
+        assert [wordlist.word(i) for i in range(len(wordlist))] == words
+        width = wordlist.width
+    print(f"{args[1]}: {len(words)} words, {width}-byte offsets, "
+          f"{os.path.getsize(args[1])} bytes, {math.log2(len(words)):.1f} bits per word")
+    if "--bench" in argv:
+        bench(args[1])
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,240 @@
+"""
+Behaviour checks run against both vault backends (KeyStore and the
+out-of-core FlashKeyStore) on the host, with the stand-ins of
+host_board.py and vault files in a temporary directory:
+
+    python3 tools/vault_check.py
+
+Each check starts from an empty vault and raises AssertionError on the
+first difference from the expected behaviour.
+"""
+import os
+import struct
+
+import host_board
+
+host_board.install()
+
+from key_store import KeyStore  # noqa: E402
+from flash_store import FlashKeyStore  # noqa: E402
+from key_store import FLASH_FILE, JOURNAL_FILE, KEYS_FILE, KEYS_TMP_FILE, account_key  # noqa: E402
+from flash_store import FLASH_TMP_FILE  # noqa: E402
+import vault_format  # noqa: E402
+
+KEY = b"k" * 32
+BACKENDS = (KeyStore, FlashKeyStore)
+CSV = ("github,https://github.com,alice,pa\n"
+       "github,https://github.com,bob,pb\n"
+       "bank,https://bank.example,carol,pc\n")
+
+def _store(backend):
+    store = backend(KEY)
+    store.import_csv(CSV)
+    assert store.flush() is True  # on flash, so lookups go through the block index
+    return store
+
+def check_unknown_site(backend):
+    store = _store(backend)
+    assert store.get("unknown-site") is None
+    assert store.delete("unknown-site") is False
+    assert store.update("unknown-site", "note:x") is False
+    assert store.set_password("unknown-site", "x") is False
+    assert len(store.db) == 3
+
+def check_rename_onto_existing_account(backend):
+    store = _store(backend)
+    try:
+        store.update("github", "username:bob", "alice")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("rename onto an existing account was accepted")
+    assert store.get("github", "bob")["password"] == "pb"
+    assert store.get("github", "alice")["password"] == "pa"
+    assert store.update("github", "username:dave", "alice") is True
+    assert store.get("github", "dave")["password"] == "pa"
+    assert len(store.db) == 3
+
+def check_heap_compaction(backend):
+    store = _store(backend)
+    heap = store._heap_path
+    for i in range(200):  # garbage well past HEAP_SLACK and twice the live secrets
+        store.set_password("bank", f"pc{i}")
+    assert store.flush() is True
+    assert store._save() is True  # a snapshot write compacts the heap
+    assert store._heap_path != heap, "heap was not rewritten"
+    assert store._heap_size < 1024
+    reopened = backend(KEY)
+    assert reopened.get("bank")["password"] == "pc199"
+    assert reopened.get("github", "alice")["password"] == "pa"
+
+def check_alias_browsing(backend):
+    store = _store(backend)
+    store.add("apple", "https://apple.com", "", "x")  # unsaved, in the overlay on flash
+    store.delete("bank")
+    expected = ["apple", "github"]
+    assert list(store.get_aliases()) == expected
+    assert list(store.iter_aliases("b")) == ["github"]
+    assert store.alias_after("apple") == "github" and store.alias_after("github") == "apple"
+    assert store.alias_before("apple") == "github" and store.alias_before("github") == "apple"
+    assert store.first_alias("b") == "github" and store.first_alias("zz") == "github"
+    assert store.alias_after("bank") == "github" and store.alias_before("bank") == "apple"
+    assert store.initials() == ["a", "g"]
+
+    # Enough aliases for many blocks: every step decrypts at most one block.
+    with store.transaction():
+        for i in range(600):
+            store.add(f"site{i:03d}", f"https://site{i:03d}.example", "", "x")
+    assert store.flush() is True
+    if backend is FlashKeyStore:
+        import flash_store
+        decrypt, calls = flash_store.unseal, []
+        flash_store.unseal = lambda *args: calls.append(1) or decrypt(*args)
+        try:
+            store.db.drop_cache()
+            store._aliases.drop_cache()
+            alias = store.first_alias("site300")
+            assert alias == "site300" and len(calls) <= 1
+            for step in range(20):
+                alias = store.alias_after(alias)
+            assert alias == "site320"
+            for step in range(20):
+                alias = store.alias_before(alias)
+            assert alias == "site300" and len(calls) <= 3
+        finally:
+            flash_store.unseal = decrypt
+    alias, seen = store.first_alias(), []
+    for step in range(602):
+        seen.append(alias)
+        alias = store.alias_after(alias)
+    assert seen == list(store.get_aliases()) and alias == seen[0]
+
+def check_case_and_hosts(backend):
+    # Aliases match and sort case-insensitively; hosts ignore scheme,
+    # "www.", port and path.
+    store = _store(backend)
+    store.add("GitLab", "https://www.gitlab.com/users/sign_in", "eve", "pe")
+    store.add("apple", "http://apple.com:8080", "", "x")
+    assert store.flush() is True
+    gitlab = account_key("https://www.gitlab.com/users/sign_in", "eve")
+    assert store.get_aliases() == ("apple", "bank", "github", "GitLab")
+    assert store.initials() == ["a", "b", "g"]
+    assert store.alias_after("github") == "GitLab" and store.alias_before("apple") == "GitLab"
+    assert store.first_alias("GITL") == "GitLab"
+    assert [key for _, key in store.find("GIT")] == [account_key("https://github.com", "alice"),
+                                                   account_key("https://github.com", "bob"), gitlab]
+    assert store.find("gitlab.c") == [("GitLab", gitlab)]
+    assert store.match_domain("https://accounts.GitLab.com/login") == [gitlab]
+    assert store.match_domain("apple.com") == ["http://apple.com:8080"]
+    assert store.get("https://shop.apple.com/bag")["password"] == "x"
+
+def _patch(path: str, offset: int, data: bytes) -> None:
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+
+def _rejects(func) -> bool:
+    try:
+        func()
+    except ValueError:
+        return True
+    return False
+
+def check_tampering(backend):
+    store = _store(backend)
+    offset, length = store.db[account_key("https://github.com", "alice")]["secret"]
+    with open(store._heap_path, "rb") as f:
+        f.seek(offset + length - 1)
+        last = f.read(1)[0]
+    _patch(store._heap_path, offset + length - 1, bytes([last ^ 1]))
+    assert _rejects(lambda: backend(KEY).get("github", "alice")), "tampered secret was read"
+
+    # Each blob names its entry, so blobs of the same length cannot trade places.
+    store = _store(backend)
+    store.add("a", "https://a.example", "u", "secret-a")
+    store.add("b", "https://b.example", "u", "secret-b")
+    assert store.flush() is True
+    refs = [store.db[account_key(f"https://{site}.example", "u")]["secret"] for site in "ab"]
+    assert refs[0][1] == refs[1][1]
+    with open(store._heap_path, "rb") as f:
+        blobs = []
+        for offset, length in refs:
+            f.seek(offset)
+            blobs.append(f.read(length))
+    _patch(store._heap_path, refs[0][0], blobs[1])
+    _patch(store._heap_path, refs[1][0], blobs[0])
+    assert _rejects(lambda: backend(KEY).get("a")), "swapped secrets were read"
+
+    # A stale frame appended again, or a damaged one, ends the replay.
+    store = _store(backend)
+    store.set_password("bank", "x1")
+    store.set_password("bank", "x2")
+    assert store.flush() is True
+    with open(JOURNAL_FILE, "rb") as f:
+        journal = f.read()
+    first = 8 + 2 + struct.unpack_from(">H", journal, 8)[0]
+    _patch(JOURNAL_FILE, len(journal), journal[8:first])
+    store = backend(KEY)  # replay stopped, so it saved a new epoch
+    assert store.get("bank")["password"] == "x2"
+    store.set_password("bank", "x3")
+    store.set_password("bank", "x4")
+    assert store.flush() is True
+    _patch(JOURNAL_FILE, os.path.getsize(JOURNAL_FILE) - 1, b"\0")
+    assert backend(KEY).get("bank")["password"] == "x3"
+
+    if backend is FlashKeyStore:
+        store = _store(backend)
+        with store.transaction():
+            for i in range(60):
+                store.add(f"site{i:02d}", f"https://site{i:02d}.example", "", "x")
+        assert store.flush() is True and store.db.blocks > 1
+        size, start = vault_format.BLOCK_BYTES, store.db._offset
+        with open(FLASH_FILE, "rb") as f:
+            f.seek(start)
+            blocks = f.read(2 * size)
+        _patch(FLASH_FILE, start, blocks[size:] + blocks[:size])  # swap blocks 0 and 1
+        assert _rejects(lambda: backend(KEY).get("bank")), "swapped blocks were read"
+
+def check_interrupted_save(backend):
+    # Power lost after _save() removed the old file, before the rename.
+    store = _store(backend)
+    store.set_password("bank", "pc2")
+    assert store._save() is True
+    path, tmp = (FLASH_FILE, FLASH_TMP_FILE) if backend is FlashKeyStore else (KEYS_FILE, KEYS_TMP_FILE)
+    os.rename(path, tmp)
+    store = backend(KEY)
+    assert store.get("bank")["password"] == "pc2", "vault lost in the save window"
+    store.set_password("bank", "pc3")
+    assert store._save() is True
+    assert backend(KEY).get("bank")["password"] == "pc3"
+    assert len(backend(KEY).db) == 3
+
+def check_lock(backend):
+    store = _store(backend)
+    store.set_password("bank", "pc2")  # journaled, not in a snapshot yet
+    assert store.flush() is True
+    store.lock()
+    assert not list(store.db.items()) and not store._alias_keys("github"), "index kept while locked"
+    assert store.unlock(b"x" * 32) is False
+    assert store.unlock(KEY) is True
+    assert store.get("bank")["password"] == "pc2" and store.get("github", "bob")["password"] == "pb"
+    assert list(store.get_aliases()) == ["bank", "github"]
+    store.lock()
+    other = backend(KEY)
+    other.set_password("bank", "pc3")
+    assert other.flush() is True
+    assert store.unlock(KEY) is False, "unlocked over changed files"
+
+CHECKS = [check_unknown_site, check_rename_onto_existing_account, check_heap_compaction,
+          check_alias_browsing, check_case_and_hosts, check_tampering, check_interrupted_save,
+          check_lock]
+
+def main() -> None:
+    for backend in BACKENDS:
+        for check in CHECKS:
+            host_board.reset_vault()
+            check(backend)
+            print(f"ok  {backend.__name__:14s} {check.__name__}")
+
+if __name__ == "__main__":
+    main()